@@ -4,12 +4,98 @@
 import numpy as np
 
 
-def sigmoid(x):
+# Every function takes and returns an array, they are applied to
+# whole groups of nodes at once and never to single values. Given an
+# out array of x's shape and dtype, the result is written there.
+
+
+def sigmoid(x, out=None):
     """Sigmoid activation function
 
     :x: The input value
+    :out: An array the result is written to, may be x itself
     :returns: The value passed through
     the sigmoid activation function
 
     """
-    return 1 / (1+np.exp(-x))
+    # Sensors are 0 or 255, large sums must not overflow exp
+    limit = 80.0 if getattr(x, 'dtype', None) == np.float32 else 500.0
+    if out is None:
+        return 1 / (1+np.exp(-np.clip(x, -limit, limit)))
+    np.clip(x, -limit, limit, out=out)
+    np.negative(out, out=out)
+    np.exp(out, out=out)
+    out += 1
+    return np.reciprocal(out, out=out)
+
+
+def dsigmoid(y):
+    """Derivative of the sigmoid, given its output"""
+    return y * (1.0 - y)
+
+
+def tanh(x, out=None):
+    return np.tanh(x, out=out)
+
+
+def relu(x, out=None):
+    return np.maximum(x, 0.0, out=out)
+
+
+def step(x, out=None):
+    if out is None:
+        return (np.asarray(x) > 0).astype(np.float64)
+    return np.heaviside(x, 0.0, out=out)
+
+
+def identity(x, out=None):
+    if out is None:
+        return np.asarray(x, dtype=np.float64)
+    np.copyto(out, x)
+    return out
+
+
+# Fast sigmoid lookup table. Outside of its range the sigmoid is
+# within 3.4e-4 of 0 or 1.
+LUT_RANGE = 8.0
+LUT_SIZE = 4096
+LUT_SCALE = (LUT_SIZE - 1) / (2 * LUT_RANGE)
+SIGMOID_LUT = sigmoid(np.linspace(-LUT_RANGE, LUT_RANGE, LUT_SIZE))
+
+
+def fast_sigmoid(x, out=None):
+    """Sigmoid approximated by a lookup table, accurate
+    to about 1e-3. The table indices are always allocated.
+
+    :x: The input value
+    :out: An array the result is written to
+    :returns: The approximated sigmoid
+
+    """
+    index = (np.clip(x, -LUT_RANGE, LUT_RANGE) + LUT_RANGE) * LUT_SCALE
+    if out is None:
+        return SIGMOID_LUT[(index + 0.5).astype(np.intp)]
+    np.copyto(out, SIGMOID_LUT[(index + 0.5).astype(np.intp)])
+    return out
+
+
+# Activation genes store an index into this list, so its order must
+# never change. New functions are appended.
+ACTIVATIONS = ['sigmoid', 'tanh', 'relu', 'step', 'fast_sigmoid', 'identity']
+FUNCTIONS = [sigmoid, tanh, relu, step, fast_sigmoid, identity]
+
+# The activation of nodes without an activation gene
+DEFAULT = ACTIVATIONS.index('sigmoid')
+
+
+def activation_code(name):
+    """Returns the gene value of an activation function
+
+    :name: The function's name, e.g. 'relu'
+    :returns: An integer code
+
+    """
+    try:
+        return ACTIVATIONS.index(name)
+    except ValueError:
+        raise ValueError('Unknown activation function %s' % name)
@@ -2,10 +2,13 @@
 # -*- coding: utf-8 -*-
 
 import numpy as np
-from PIL import Image
-from scipy.ndimage import zoom
 
 from neat import NEAT_Network
+from network import MLP_NN
+
+
+# The brains an agent can be built with
+BACKENDS = ('neat', 'mlp')
 
 
 class Agent():
@@ -17,13 +20,26 @@ class Agent():
                  pool_ref,
                  genome=None,
                  agent_name='Agent',
-                 sensor_radius=5):
+                 sensor_radius=5,
+                 brain=None,
+                 backend='neat',
+                 hidden=8,
+                 rng=None,
+                 load_brain=None):
         """Initializes an agent
 
         :agent_id: The agent id, must be unique to other agents
         :grid_ref: A reference to the grid the agent resides on
         :agent_name: The name of the agent
         :sensor_radius: How far the agent can see in either direction
+        :brain: An already constructed network, takes precedence
+        over genome
+        :backend: The kind of brain built when none is given: 'neat'
+        for an evolving topology or 'mlp' for a fixed MLP_NN
+        :hidden: The number of hidden neurons of an 'mlp' brain
+        :rng: The numpy Generator an 'mlp' brain's weights are drawn from
+        :load_brain: A function returning the brain, called when the
+        brain is first used. Checkpointed genomes are loaded this way.
 
         """
 
@@ -32,10 +48,33 @@ class Agent():
         self.lifetime = 0
         self.turn_multiplier = 1.0
         self.pool = pool_ref
+        self.parents = ()
+        self.eval_time = 0.0
         self.sensor_radius = sensor_radius
         self.grid = None
-
-        if genome:
+        self.sensor = None
+        # The network the brain is evaluated with and the arrays it
+        # computes in, set by the grid
+        self.evaluator = None
+        self.workspace = None
+
+        # Behavior is summarized for novelty search
+        self.turns = [0, 0]
+        self.visits = None
+
+        if backend not in BACKENDS:
+            raise ValueError('Unknown brain backend %s' % backend)
+
+        self._brain = None
+        self.load_brain = None
+        if brain is not None:
+            self.brain = brain
+        elif load_brain is not None:
+            self.load_brain = load_brain
+        elif backend == 'mlp':
+            sensor_dia = 2*sensor_radius + 1
+            self.brain = MLP_NN(sensor_dia * sensor_dia, hidden, 3, rng)
+        elif genome:
             self.brain = NEAT_Network(genome, pool_ref)
         else:
             self.brain = NEAT_Network(pool_ref.starting_genome, pool_ref)
@@ -46,6 +85,20 @@ class Agent():
     def __str__(self):
         return '%s-%d' % (self.agent_name, self.agent_id)
 
+    @property
+    def brain(self):
+        """The agent's network, loaded on first use if the agent
+        was given a load_brain function"""
+        if self._brain is None and self.load_brain is not None:
+            self._brain = self.load_brain()
+            self.load_brain = None
+        return self._brain
+
+    @brain.setter
+    def brain(self, brain):
+        self._brain = brain
+        self.load_brain = None
+
     def __add__(self, other):
         """Overloaded addition operator. This allows
         two agents to crossover for genetic evolution
@@ -54,19 +107,88 @@ class Agent():
         :returns: A new agent with a mixed genome
 
         """
-        new_agent = Agent(0, self.pool)
-        new_agent.brain = self.brain + other.brain
+        return self.crossover(other)
+
+    def crossover(self, other, rng=None):
+        """Crosses this agent over with another
+
+        :other: The other parent
+        :rng: The numpy Generator crossover and mutation draw from
+        :returns: A new agent with a mixed genome
+
+        """
+        new_agent = Agent(0,
+                          self.pool,
+                          sensor_radius=self.sensor_radius,
+                          brain=self.brain.crossover(other.brain, rng))
         return new_agent
 
+    def export(self, path):
+        """Exports the agent's brain with a description of its
+        sensors, so it can be run without the simulation
+
+        :path: The filename
+
+        """
+        sensor_dia = 2*self.sensor_radius + 1
+        outputs = sorted([(self.left, 'left'),
+                          (self.center, 'center'),
+                          (self.right, 'right')])
+        spec = {'agent_id': self.agent_id,
+                'sensor_radius': self.sensor_radius,
+                'sensor_shape': [sensor_dia, sensor_dia],
+                'wall': 255,
+                'empty': 0,
+                'outputs': [name for _, name in outputs]}
+        self.brain.export(path, spec)
+
+    def reset(self):
+        """Resets the agent's score before a new evaluation"""
+        self.lifetime = 0
+        self.turn_multiplier = 1.0
+        self.eval_time = 0.0
+
+    def end_evaluation(self):
+        """Drops the state which is only needed while the agent is
+        simulated: its grid, its last sensor reading, the brain's
+        evaluators and their workspace. The genome, score and behavior
+        are kept."""
+        self.grid = None
+        self.sensor = None
+        self.evaluator = None
+        self.workspace = None
+        if self._brain is not None:
+            self._brain.drop_caches()
+
+    def release(self):
+        """Releases the agent's genes back to the pool"""
+        self.end_evaluation()
+        # A brain which was never loaded holds no genes
+        self.load_brain = None
+        if self._brain is not None:
+            self._brain.release()
+
     def set_grid(self, grid):
         self.grid= grid
 
+    def track_behavior(self, bins):
+        """Resets the agent's behavior record
+
+        :bins: The number of coarse cells along each grid axis
+
+        """
+        self.turns = [0, 0]
+        if self.visits is None or self.visits.shape != (bins, bins):
+            self.visits = np.zeros((bins, bins))
+        else:
+            self.visits.fill(0)
+
     def get_complexity(self):
         """Returns the number of graph connections
         :returns: The number of neuron connections
 
         """
-        return len(self.brain.network.edges)
+        return self.brain.complexity()
 
     def set_pos(self, x, y):
         """Sets the position of the agent
@@ -90,14 +212,28 @@ class Agent():
 
     def step(self):
         cur_sense = self.sense()
+        if self.evaluator is None:
+            outputs = self.brain.predict(cur_sense.reshape(1, -1))
+        elif self.workspace is None:
+            outputs = self.evaluator.predict(cur_sense.reshape(1, -1))
+        else:
+            outputs = self.evaluator.predict(cur_sense.reshape(1, -1), self.workspace)
+        self.act(outputs[0])
+
+    def act(self, outputs):
+        """Turns and moves according to the brain's outputs
 
-        result = self.brain.feedforward(cur_sense)
-        result = result.index(max(result))
+        :outputs: The brain's output values, the largest one wins
+
+        """
+        result = int(np.argmax(outputs))
 
         if result == self.left:
             self.set_orientation(self.heading - 1)
+            self.turns[0] += 1
         elif result == self.right:
             self.set_orientation(self.heading + 1)
+            self.turns[1] += 1
         else:
             self.turn_multiplier -= 0.1
 
@@ -105,32 +241,30 @@ class Agent():
         self.lifetime += 1 * self.turn_multiplier
 
     def sense(self):
-        max_x = self.x + self.sensor_radius
-        min_x = self.x - self.sensor_radius
-        max_y = self.y + self.sensor_radius
-        min_y = self.y - self.sensor_radius
-
-        sensor_dia = 2*self.sensor_radius + 1
-        sensor_shape = (sensor_dia, sensor_dia)
+        """Copies the cells around the agent into its sensor buffer.
+        Trails and cells off the grid read 255, empty cells 0. The
+        buffer is provided by the grid or allocated once, and the
+        agent must be on the grid.
 
-        self.sensor = np.empty(sensor_shape)
-        self.sensor.fill(255)
-
-        x_range = (max(0, min_x), min(self.grid.width, max_x+1))
-        y_range = (max(0, min_y), min(self.grid.height, max_y+1))
-
-        for x in range(x_range[0], x_range[1]):
-            for y in range(y_range[0], y_range[1]):
-                i_x = self.sensor_radius + (x - self.x)
-                i_y = self.sensor_radius + (y - self.y)
-                if self.grid.grid[x][y] > 0:
-                    self.sensor[i_x][i_y] = 255
-                else:
-                    self.sensor[i_x][i_y] = 0
+        :returns: The sensor array
 
+        """
+        radius = self.sensor_radius
+        sensor_dia = 2*radius + 1
+        if self.sensor is None or self.sensor.shape != (sensor_dia, sensor_dia):
+            self.sensor = np.empty((sensor_dia, sensor_dia), dtype=self.grid.walls.dtype)
+
+        # The grid's walls are padded, so the window never leaves them
+        x = self.x + self.grid.pad - radius
+        y = self.y + self.grid.pad - radius
+        np.copyto(self.sensor, self.grid.walls[x:x + sensor_dia, y:y + sensor_dia])
         return self.sensor
 
     def render_sensor(self, scale=5):
+        # Imaging libraries are only loaded when something is rendered
+        from PIL import Image
+        from scipy.ndimage import zoom
+
         array = np.copy(self.sensor)
         array[array > 0] = 255
         if scale > 1:
@@ -1,12 +1,25 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import time
+
 import numpy as np
-from scipy.ndimage import zoom
-from neat import NEAT_Pool
+from checkpoint import Checkpointer
+from compiled import Compiled_Network
+from evaluation import Fitness_Cache, start_configurations
+from history import History_Store
+from memory import Memory_Accountant
+from neat import NEAT_Network, NEAT_Pool
+from network import MLP_NN, MLP_Stack
+from novelty import Novelty_Search
 from populations import Population
+from precision import cell_dtype, check_precision, sensor_dtype, weight_dtype
+from screening import Screener
+from species import Speciator
+from autotune import Autotuner
+from stopping import Generation_Result
+from streams import Random_Streams
 from worker_pool import Worker_Pool
-from rendering import Renderer
 
 class Simulation():
 
@@ -18,66 +31,543 @@ class Simulation():
             population_size,
             sim_population,
             sensor_radius=1,
-            n_threads=1):
+            n_threads=1,
+            speciation=True,
+            objective='fitness',
+            n_trials=1,
+            fitness_cache=True,
+            seed=None,
+            checkpoint_dir=None,
+            checkpoint_every=10,
+            history_dir=None,
+            backend='neat',
+            render=True,
+            max_ticks=None,
+            max_grid_time=None,
+            racing=None,
+            racing_keep=0.2,
+            remote=None,
+            remote_timeout=10.0,
+            autotune=None,
+            memory_report=False,
+            precision='float64',
+            screening=None,
+            population=None):
         """Initializes a simulation
 
         :population_size: The allowable population size per generation
         :sim_population: The allowable population size per grid simulation
         :n_threads: The number of threads to utilize
+        :speciation: If True, agents only compete and mate within
+        their species
+        :objective: What agents are selected for: 'fitness' (lifetime),
+        'novelty' or 'combined'
+        :n_trials: The number of start configurations every agent is
+        evaluated on each generation
+        :fitness_cache: If True, genomes which were already measured
+        reuse their running mean score instead of being simulated again
+        :seed: Seeds every random stream of the run: start
+        configurations, grouping, selection and reproduction
+        :checkpoint_dir: If set, checkpoints are written to this
+        directory in the background
+        :checkpoint_every: The number of generations between checkpoints
+        :history_dir: If set, every scored generation is recorded in
+        a History_Store in this directory
+        :backend: The agents' brains, 'neat' or 'mlp'. MLP brains
+        have a fixed topology, so they are neither speciated nor
+        checkpointed.
+        :render: If True, every grid step is saved as an image
+        by a background Renderer
+        :max_ticks: The most steps a grid is simulated for, None
+        for no limit
+        :max_grid_time: The most seconds a grid is simulated for
+        :racing: An increasing list of tick budgets. Grids are
+        simulated in rounds up to each budget, and after every round
+        only grids with a surviving agent which can still reach the
+        contention cutoff keep running.
+        :racing_keep: The fraction of top scores an agent has to be
+        among to be in contention, matching the elite fraction of
+        selection
+        :remote: A list of evaluation worker addresses, 'host:port'
+        or 'unix:/path'. Grids are then simulated by the workers, see
+        remote.py. Racing is not used for remote grids.
+        :remote_timeout: Seconds of silence after which a worker's
+        tasks are sent to other workers
+        :autotune: If set, the thread count and the agents per grid
+        are tuned for throughput during the run. Either True or a dict
+        of Autotuner arguments, e.g. {'threads': [1, 16]}
+        :memory_report: If True, memory is traced and the usage of
+        every subsystem is printed after each generation. Tracing
+        slows the run down considerably.
+        :precision: 'float64', 'float32' or 'int8', see precision.py.
+        Reduced precision networks may pick different moves than the
+        float64 reference, so scores are not comparable across
+        precisions.
+        :screening: If set, agents are screened before simulation and
+        only promising ones are simulated, see screening.py. Either
+        True or a dict of Screener arguments, e.g. {'keep': 0.3}.
+        Skipped agents score a tick below the worst scored agent.
+        :population: A Population to evolve instead of a new random
+        one, as restored by checkpoint.load. It is not part of the config.
 
         """
+        # Arguments are kept so a checkpoint can recreate the simulation
+        self.config = {'population_size': population_size,
+                       'sim_population': sim_population,
+                       'sensor_radius': sensor_radius,
+                       'n_threads': n_threads,
+                       'speciation': speciation,
+                       'objective': objective,
+                       'n_trials': n_trials,
+                       'fitness_cache': fitness_cache,
+                       'seed': seed,
+                       'checkpoint_dir': checkpoint_dir,
+                       'checkpoint_every': checkpoint_every,
+                       'history_dir': history_dir,
+                       'backend': backend,
+                       'render': render,
+                       'max_ticks': max_ticks,
+                       'max_grid_time': max_grid_time,
+                       'racing': racing,
+                       'racing_keep': racing_keep,
+                       'remote': remote,
+                       'remote_timeout': remote_timeout,
+                       'autotune': autotune,
+                       'memory_report': memory_report,
+                       'precision': precision,
+                       'screening': screening}
 
         # Type checking
         if type(n_threads) is not int:
             raise TypeError('Thread count must be a positive integer')
         elif n_threads < 1:
             raise ValueError('Thread count must be above 0')
+        if n_trials < 1:
+            raise ValueError('Agents must be evaluated at least once')
+        if racing is not None and list(racing) != sorted(racing):
+            raise ValueError('Racing budgets must be increasing')
+        if not 0 < racing_keep <= 1:
+            raise ValueError('Racing must keep a fraction of agents in contention')
+        if backend == 'mlp' and checkpoint_dir is not None:
+            raise ValueError('Only NEAT populations can be checkpointed')
 
         self.n_threads = n_threads
         self.sensor_radius = sensor_radius
+        self.sim_population = sim_population
+        self.sim_dims = (100, 100)
+        self.n_trials = n_trials
+        self.max_ticks = max_ticks
+        self.max_grid_time = max_grid_time
+        self.racing = racing
+        self.racing_keep = racing_keep
+        if autotune:
+            self.autotuner = Autotuner(**(autotune if isinstance(autotune, dict) else {}))
+        else:
+            self.autotuner = None
+        self.precision = check_precision(precision)
+        self.evaluated = 0
+        # Grids are reused across trials and generations
+        self.arenas = []
+        # Lifetimes are summed in a buffer reused across generations
+        self.totals = np.zeros(0)
+        self.memory = Memory_Accountant() if memory_report else None
+        if remote:
+            from remote import Remote_Pool
+            self.remote = Remote_Pool(remote, remote_timeout)
+        else:
+            self.remote = None
+        self.streams = Random_Streams(seed)
+        self.generation = 0
+
+        if population is not None:
+            self.pool = population.genetic_pool
+            self.population = population
+        else:
+            # Create genetic pool for simulation
+            # Agents see the square of cells within sensor_radius
+            dims = (2*sensor_radius + 1, 2*sensor_radius + 1)
+            self.pool = NEAT_Pool(dims, 3)
+            speciator = Speciator() if speciation and backend == 'neat' else None
+            self.population = Population(population_size,
+                                         sim_population,
+                                         self.pool,
+                                         speciator,
+                                         self.streams,
+                                         backend,
+                                         sensor_radius=sensor_radius)
+        if render:
+            # The imaging libraries are only loaded for rendering
+            from rendering import Renderer
+            self.renderer = Renderer()
+        else:
+            self.renderer = None
+
+        if objective == 'fitness':
+            self.novelty = None
+        else:
+            self.novelty = Novelty_Search(objective)
+
+        # Novelty needs every agent's behavior, so nobody can be skipped
+        if fitness_cache and self.novelty is None:
+            self.fitness_cache = Fitness_Cache()
+        else:
+            self.fitness_cache = None
+        if screening and self.novelty is None:
+            self.screener = Screener(**(screening if isinstance(screening, dict) else {}))
+        else:
+            self.screener = None
+
+        if checkpoint_dir is not None:
+            self.checkpointer = Checkpointer(checkpoint_dir, checkpoint_every)
+        else:
+            self.checkpointer = None
+
+        if history_dir is not None:
+            self.history = History_Store(history_dir)
+        else:
+            self.history = None
+
+        self.callbacks = []
+        self.ticks = 0
+
+    def add_callback(self, callback):
+        """Registers a function which is called with the
+        Generation_Result of every generation
+
+        :callback: A function taking a Generation_Result
 
-        # Create genetic pool for simulation
-        dims = (sensor_radius+1, sensor_radius+1)
-        self.pool = NEAT_Pool(dims, 3)
-        self.population = Population(population_size, sim_population, self.pool)
-        self.renderer = Renderer()
+        """
+        self.callbacks.append(callback)
 
-    def simulate(self, generations=60):
+    def simulate(self, generations=60, stop=()):
         """Evolves the Population until the specified generation
 
-        :generations: TODO
-        :returns: TODO
+        :generations: The maximum number of generations to run
+        :stop: Stop criteria, see run
+        :returns: The Generation_Result of the last generation
 
         """
+        result = None
+        for result in self.run(generations, stop):
+            pass
+        return result
+
+    def run(self, generations=None, stop=()):
+        """Evolves the Population, yielding a Generation_Result after
+        every generation. The run ends after the given number of
+        generations, once a stop criterion fires, or when the caller
+        stops iterating.
+
+        :generations: The maximum number of generations, None to
+        only rely on the stop criteria
+        :stop: A list of stop criteria such as stopping.Plateau. Each
+        is called with every Generation_Result and returns a reason
+        to stop, or None to continue.
 
-        sim_dims = (100, 100)
+        """
         workers = Worker_Pool(self.n_threads)
+        if self.memory is not None:
+            self.memory.start()
+        start = time.perf_counter()
+        start_ticks = ticks = self.ticks
+
+        try:
+            n = 0
+            while generations is None or n < generations:
+                print('Simulating Generation: %d' % self.generation)
+                eval_start = time.perf_counter()
+                scores = self.evaluate(self.generation, workers)
+                eval_time = time.perf_counter() - eval_start
+                if self.autotuner is not None:
+                    self.apply_settings(self.autotuner.observe(self.generation,
+                                                               (len(workers), self.sim_population),
+                                                               self.evaluated,
+                                                               eval_time),
+                                        workers)
+
+                if self.novelty is not None:
+                    scores = self.novelty.score(scores, *self.sim_dims)
+
+                self.population.breed(scores)
+                speciator = self.population.speciator
+                if self.history is not None:
+                    self.history.record(self.generation,
+                                        scores,
+                                        speciator.species if speciator else None)
+
+                result = Generation_Result(self.generation,
+                                           scores,
+                                           len(speciator.species) if speciator else 0,
+                                           self.ticks - ticks,
+                                           self.ticks - start_ticks,
+                                           eval_time,
+                                           time.perf_counter() - start)
+                if self.memory is not None:
+                    result.memory = self.memory.report(self.generation)
+                ticks = self.ticks
+                self.generation += 1
+                n += 1
+
+                if self.checkpointer is not None:
+                    self.checkpointer.maybe_save(self)
+
+                for criterion in stop:
+                    reason = criterion(result)
+                    if reason is not None:
+                        result.stop_reason = reason
+                        print('\tStopping: %s' % reason)
+                        break
+                for callback in self.callbacks:
+                    callback(result)
+
+                yield result
+                if result.stop_reason is not None:
+                    break
+        finally:
+            workers.close()
+            if self.remote is not None:
+                self.remote.close()
+            # Tracing slows everything down, it only runs with the simulation
+            if self.memory is not None:
+                self.memory.stop()
+            if self.checkpointer is not None:
+                self.checkpointer.wait()
+            if self.history is not None:
+                self.history.flush()
+            if self.renderer is not None:
+                self.renderer.wait_till_done()
+
+    def evaluate(self, generation, workers):
+        """Scores the current population. Every grid of a trial
+        starts from the same seeded configuration, and genomes with
+        enough cached samples are not simulated.
+
+        :generation: The generation number
+        :workers: The Worker_Pool grids are simulated on
+        :returns: A dict of agent scores
 
-        for generation in range(generations):
-            print('Simulating Generation: %d' % generation)
-            workers.reset_results()
-            pops = [pop for pop in self.population]
-            grids = []
+        """
+        agents = self.population.current_population
+        cache = self.fitness_cache
 
-            i =0
-            for population in pops:
-                g = Grid(*sim_dims, population, self.renderer.buffer, generation, i)
-                grids.append(g)
-                i += 1
+        scores = {}
+        pending = []
+        for agent in agents:
+            if cache is not None and cache.is_settled(agent.brain.key):
+                scores[agent] = cache.get(agent.brain.key).mean
+            else:
+                pending.append(agent)
+        if cache is not None:
+            print('\tCached %d, Simulated %d' % (len(scores), len(pending)))
+        skipped = []
+        if self.screener is not None:
+            pending, skipped = self.screener.select(pending, self.streams.screening(generation))
+            print('\tScreened out %d of %d' % (len(skipped), len(skipped) + len(pending)))
+
+        if len(self.totals) < len(pending):
+            self.totals = np.zeros(len(pending))
+        totals = self.totals[:len(pending)]
+        totals.fill(0.0)
+        # Agents still alive in grids racing stopped early
+        truncated = set()
+        self.evaluated = len(pending) * self.n_trials
+        self.population.schedule(pending, self.streams.grouping(generation))
+        groups = [group for group in self.population]
+
+        for trial in range(self.n_trials):
+            placements = self.placements(generation, trial)
+            for group in groups:
+                for agent in group:
+                    agent.reset()
+            if self.remote is not None:
+                self.evaluate_remotely(groups, generation, trial, placements)
+            else:
+                grids = [self.build_grid(group, generation, trial, i,
+                                         len(groups), placements,
+                                         self.arenas[i] if i < len(self.arenas) else None)
+                         for i, group in enumerate(groups)]
+                self.arenas = grids + self.arenas[len(grids):]
+                for grid in self.race(grids, workers):
+                    truncated.update(grid.active_agents)
+                self.ticks += sum(grid.iteration for grid in grids)
+                # Grids and agents reference each other, the cycle
+                # is broken so both are freed without the collector
+                for grid in grids:
+                    grid.release()
 
-            for grid in grids:
-                workers.add_task(grid.simulate)
-            workers.wait_for_completion()
-            
             # Combine results
-            scores = {}
-            for d in workers.results:
-                for k, v in d.items():
-                    scores[k] = v
-            
-            self.population.breed(scores)
+            for i, agent in enumerate(pending):
+                totals[i] += agent.lifetime
+
+        # Inference cost follows the simplified networks, not the genomes
+        stats = [agent.brain.compiled.stats for agent in pending
+                 if isinstance(agent.brain, NEAT_Network)] if self.remote is None else []
+        if stats:
+            print('\tEvaluated %d of %d connections, %d of %d nodes' % \
+                    (sum(s['evaluated_connections'] for s in stats),
+                     sum(s['connections'] for s in stats),
+                     sum(s['evaluated_nodes'] for s in stats),
+                     sum(s['nodes'] for s in stats)))
+
+        # int8 networks which fail their probe check run in float32
+        brains = [agent.brain for agent in pending if isinstance(agent.brain, MLP_NN)]
+        if self.precision == 'int8' and brains:
+            print('\tQuantized %d of %d networks' % \
+                    (sum(brain.quantized() is not None for brain in brains), len(brains)))
+
+        # Only genomes, scores and behaviors outlive evaluation
+        for agent in pending:
+            agent.end_evaluation()
+
+        # The scores are a new dict, results and callbacks keep it
+        for agent, total in zip(pending, totals.tolist()):
+            score = total / self.n_trials
+            # Truncated scores are not what the agent would have
+            # scored, they stay out of its genome's running mean
+            if cache is not None and agent not in truncated:
+                score = cache.add(agent.brain.key, score).mean
+            scores[agent] = score
+
+        # Skipped agents are not cached, they may be simulated later.
+        # They score a tick below every other agent, so they are never
+        # elites and species made of them only get no offspring.
+        if skipped:
+            floor = min(scores.values()) - 1.0
+            for agent in skipped:
+                scores[agent] = floor
+        if self.screener is not None:
+            self.screener.observe(scores)
+
+        return scores
+
+    def apply_settings(self, settings, workers):
+        """Applies evaluation settings chosen by the autotuner
+
+        :settings: A tuple of (n_threads, sim_population)
+        :workers: The Worker_Pool to resize
+
+        """
+        n_threads, sim_population = settings
+        if n_threads != len(workers):
+            workers.resize(n_threads)
+        self.n_threads = n_threads
+        self.sim_population = sim_population
+        self.population.sim_population = sim_population
 
-        self.renderer.buffer.wait_till_done()
+    def evaluate_remotely(self, groups, generation, trial, placements):
+        """Simulates a trial's grids on the remote workers and copies
+        the scores and behaviors back into the agents
+
+        :groups: The agents of every grid
+        :generation: The generation number
+        :trial: The trial number
+        :placements: The trial's start configuration
+
+        """
+        from remote import grid_task
+
+        tasks = [grid_task(self, group, generation, trial, i, len(groups), placements)
+                 for i, group in enumerate(groups)]
+        for group, (header, arrays) in zip(groups, self.remote.evaluate(tasks)):
+            for i, agent in enumerate(group):
+                agent.lifetime = float(arrays['lifetimes'][i])
+                agent.turns = arrays['turns'][i].tolist()
+                agent.set_pos(int(arrays['x'][i]), int(arrays['y'][i]))
+                agent.visits = arrays['visits'][i].copy()
+                agent.eval_time += header['elapsed']
+            self.ticks += header['ticks']
+
+    def race(self, grids, workers):
+        """Simulates grids in rounds of increasing tick budgets. Scores
+        can fall as well as rise, see score_bounds. After every round,
+        the cutoff is the top racing_keep quantile of the lowest scores
+        agents can end with. Grids where no surviving agent can reach
+        it within the last budget are stopped, so every agent which
+        could end among the top racing_keep gets the full budget.
+
+        :grids: The grids of a trial
+        :workers: The Worker_Pool grids are simulated on
+        :returns: The grids which were stopped before the last budget
+
+        """
+        budgets = list(self.racing) if self.racing else [self.max_ticks]
+        if self.max_ticks is not None:
+            budgets = [min(budget, self.max_ticks)
+                       for budget in budgets if budget is not None] or [self.max_ticks]
+
+        running = grids
+        stopped = []
+        for n, budget in enumerate(budgets):
+            workers.reset_results()
+            for grid in running:
+                workers.add_task(grid.simulate, budget)
+            workers.wait_for_completion()
+
+            running = [grid for grid in running if not grid.finished]
+            if not running or n == len(budgets) - 1:
+                break
+            # Stopped grids' scores are final
+            bounds = {}
+            for grid in grids:
+                remaining = budgets[-1] - grid.iteration if grid in running else 0
+                for agent in grid.my_agents:
+                    alive = remaining > 0 and agent in grid.active_agents
+                    bounds[agent] = score_bounds(agent, remaining if alive else 0)
+            cutoff = np.quantile([low for low, _ in bounds.values()], 1 - self.racing_keep)
+            contending = [any(bounds[agent][1] >= cutoff for agent in grid.active_agents)
+                          for grid in running]
+            stopped += [grid for grid, keep in zip(running, contending) if not keep]
+            running = [grid for grid, keep in zip(running, contending) if keep]
+        workers.reset_results()
+        return stopped
+
+    def placements(self, generation, trial):
+        """Returns the start configuration shared by every grid of a trial
+
+        :generation: The generation number
+        :trial: The trial number
+        :returns: A list of (x, y, heading) tuples
+
+        """
+        return start_configurations(self.streams.placement(generation, trial),
+                                    self.sim_population,
+                                    *self.sim_dims)
+
+    def build_grid(self, agents, generation, trial, index, n_groups=1,
+                   placements=None, arena=None):
+        """Builds a single grid of an evaluation. A grid only draws
+        from its own stream, so it can be replayed in isolation.
+
+        :agents: The agents of the grid
+        :generation: The generation number
+        :trial: The trial number
+        :index: The grid's index within the trial
+        :n_groups: The number of grids per trial, used for numbering
+        :placements: The trial's start configuration, computed if None
+        :arena: A released Grid which is reset instead of allocating
+        a new one
+        :returns: A Grid
+
+        """
+        if placements is None:
+            placements = self.placements(generation, trial)
+        if arena is not None:
+            arena.reset(agents,
+                        generation,
+                        trial * n_groups + index,
+                        placements=placements,
+                        rng=self.streams.grid(generation, trial, index),
+                        max_time=self.max_grid_time)
+            return arena
+        return Grid(*self.sim_dims,
+                    agents,
+                    self.renderer.buffer if self.renderer else None,
+                    generation,
+                    trial * n_groups + index,
+                    placements=placements,
+                    rng=self.streams.grid(generation, trial, index),
+                    max_time=self.max_grid_time,
+                    precision=self.precision)
 
 
 class Grid():
@@ -90,7 +580,12 @@ class Grid():
                  agents,
                  image_queue,
                  generation,
-                 population_number):
+                 population_number,
+                 behavior_bins=4,
+                 placements=None,
+                 rng=None,
+                 max_time=None,
+                 precision='float64'):
         """Initializes the grid with a specific width
         and height
 
@@ -99,6 +594,17 @@ class Grid():
         :num_agents: The number of agents to simulate
         :agents_per_sim: The maximum number of agents per
         simulation
+        :behavior_bins: The number of coarse cells along each
+        axis used to record where agents went
+        :placements: A list of (x, y, heading) start configurations,
+        one for each agent. Agents are placed randomly if None
+        :rng: The numpy Generator of this grid's random choices
+        :image_queue: The queue rendering jobs are put in, None
+        to not render
+        :max_time: The most seconds the grid is simulated for, over
+        all calls to simulate
+        :precision: The precision of cells, sensors and networks, one
+        of precision.PRECISIONS
 
         """
         if type(width) is not int or type(height) is not int:
@@ -108,18 +614,90 @@ class Grid():
 
         self.width = width
         self.height = height
-        self.num_agents = len(agents)
+        self.behavior_bins = behavior_bins
+        self.image_queue = image_queue
+        self.precision = check_precision(precision)
+        # Reduced precision cells are 255 where occupied, full
+        # precision cells hold the occupant's id + 1
+        self.cell_ids = cell_dtype(precision) == np.uint32
+
+        # Arena buffers, allocated once and reused by reset
+        self.grid = np.zeros((self.width, self.height), dtype=cell_dtype(precision))
+        self.walls = None
+        self.pad = 0
+        self.sensors = None
+        self.outputs = None
+        self.stack = None
+        self.stack_rows = {}
+        # Flat buffers compiled networks compute in, one per agent slot
+        self.workspaces = []
+        self.active_agents = []
+        self.my_agents = []
+
+        self.reset(agents, generation, population_number, placements, rng, max_time)
+
+    def reset(self,
+              agents,
+              generation,
+              population_number,
+              placements=None,
+              rng=None,
+              max_time=None):
+        """Clears the arena in place and registers a new set of agents,
+        so a grid is reused across trials and generations instead of
+        being allocated again. Arguments are as for the constructor.
 
-        # Create grid
-        self.__reset_grid__()
+        """
+        self.grid.fill(0)
+        self.num_agents = len(agents)
 
+        # What agents sense: 255 for trails, bordered by as many
+        # cells of wall as the farthest sighted agent can see
+        pad = max([agent.sensor_radius for agent in agents] + [0])
+        if self.walls is None or self.pad < pad:
+            self.pad = pad
+            self.walls = np.empty((self.width + 2*pad, self.height + 2*pad),
+                                  dtype=sensor_dtype(self.precision))
+        self.walls.fill(255)
+        self.walls[self.pad:self.pad + self.width, self.pad:self.pad + self.height] = 0
+
+        self.rng = np.random.default_rng() if rng is None else rng
         self.active_agents = []
         self.my_agents = []
 
-        self.register_agents(agents)
+        # Every agent senses into its own slot of the arena's buffer
+        radii = {agent.sensor_radius for agent in agents}
+        if len(radii) == 1:
+            sensor_dia = 2*radii.pop() + 1
+            if self.sensors is None or len(self.sensors) < len(agents) or \
+               self.sensors.shape[1] != sensor_dia:
+                self.sensors = np.zeros((len(agents), sensor_dia, sensor_dia),
+                                        dtype=sensor_dtype(self.precision))
+        else:
+            self.sensors = None
+
+        self.register_agents(agents, placements)
+
+        # Fixed topology brains are evaluated together, one einsum
+        # per layer and tick
+        self.stack_rows = {}
+        if agents and all(isinstance(agent.brain, MLP_NN) for agent in agents):
+            brains = [agent.brain for agent in agents]
+            if self.stack is None:
+                self.stack = MLP_Stack(brains, self.precision)
+            else:
+                self.stack.load(brains)
+            self.stack_rows = {agent: i for i, agent in enumerate(agents)}
+            shape = (len(agents), agents[0].brain.output)
+            if self.outputs is None or self.outputs.shape != shape:
+                self.outputs = np.empty(shape, dtype=weight_dtype(self.precision))
+        else:
+            self.stack = None
 
         self.iteration = 0
-        self.image_queue = image_queue
+        self.elapsed = 0.0
+        self.max_time = max_time
+        self.out_of_time = False
         self.generation = generation
         self.pop_num = population_number
 
@@ -131,20 +709,55 @@ class Grid():
         s = 'Grid-%03d-%03d-%03d' % (self.generation, self.pop_num, self.iteration)
         return s
 
-    def register_agents(self, agents):
-        for agent in agents:
+    def register_agents(self, agents, placements=None):
+        for i, agent in enumerate(agents):
             agent.set_grid(self)
+            agent.evaluator = agent.brain.reduced(self.precision)
+            if isinstance(agent.evaluator, Compiled_Network):
+                agent.workspace = self.workspace(i, agent.evaluator)
+            if self.sensors is not None:
+                agent.sensor = self.sensors[i]
+            agent.track_behavior(self.behavior_bins)
             self.active_agents.append(agent)
             self.my_agents.append(agent)
-            self.randomly_place_agent(agent)
+            if placements is None:
+                self.randomly_place_agent(agent)
+            else:
+                self.place_agent(agent, *placements[i])
+
+    def workspace(self, slot, network):
+        """Lays out a network's workspace in an agent slot's buffer,
+        which only grows when a larger network occupies the slot
+
+        :slot: The agent's index
+        :network: The Compiled_Network the agent is evaluated with
+        :returns: The workspace, see Compiled_Network.workspace
+
+        """
+        while len(self.workspaces) <= slot:
+            self.workspaces.append(None)
+        buffer = self.workspaces[slot]
+        size = network.workspace_size()
+        if buffer is None or len(buffer) < size or buffer.dtype != network.dtype:
+            buffer = np.empty(size, dtype=network.dtype)
+            self.workspaces[slot] = buffer
+        return network.workspace(1, buffer)
 
     def randomly_place_agent(self, agent):
-        pos_x = np.random.randint(0, self.width, dtype=np.uint8)
-        pos_y = np.random.randint(0, self.height, dtype=np.uint8)
-        agent.set_pos(pos_x, pos_y)
-        agent.set_orientation(np.random.randint(0, 4, dtype=np.uint8))
+        pos_x = self.rng.integers(0, self.width)
+        pos_y = self.rng.integers(0, self.height)
+        self.place_agent(agent, pos_x, pos_y, self.rng.integers(0, 4))
+
+    def place_agent(self, agent, x, y, heading):
+        # Positions are plain ints, small numpy integer types
+        # overflow once agents wander off the grid
+        agent.set_pos(int(x), int(y))
+        agent.set_orientation(int(heading))
 
     def step(self):
+        if self.stack is not None:
+            self.batched_step()
+            return
 
         for agent in self.active_agents:
             # Determine if any agents are now in walls/out of bounds
@@ -159,12 +772,50 @@ class Grid():
                 self.active_agents.remove(agent)
                 continue
             # make a step
-            self.grid[agent.x][agent.y] = agent.agent_id
+            self.grid[agent.x][agent.y] = agent.agent_id + 1 if self.cell_ids else 255
+            self.walls[agent.x + self.pad, agent.y + self.pad] = 255
+            agent.visits[int(agent.x) * self.behavior_bins // self.width,
+                         int(agent.y) * self.behavior_bins // self.height] += 1
             agent.step()
 
         self.render_grid()
         self.iteration += 1
 
+    def batched_step(self):
+        """Steps every agent at once. Walls are marked first, then all
+        agents sense the same grid and their brains are evaluated as
+        a single stack before anybody moves. The agents which survive
+        are the ones which move, so no list is built per tick."""
+        active = self.active_agents
+        i = 0
+        while i < len(active):
+            agent = active[i]
+            if self.is_out_of_bounds(agent):
+                agent.lifetime /= 10.0
+                del active[i]
+                continue
+            elif self.grid[agent.x][agent.y] != 0:
+                del active[i]
+                continue
+            self.grid[agent.x][agent.y] = agent.agent_id + 1 if self.cell_ids else 255
+            self.walls[agent.x + self.pad, agent.y + self.pad] = 255
+            agent.visits[int(agent.x) * self.behavior_bins // self.width,
+                         int(agent.y) * self.behavior_bins // self.height] += 1
+            i += 1
+
+        if active:
+            # The sensor slots are the stack's input rows, rows of
+            # agents which stopped are evaluated but ignored
+            for agent in active:
+                agent.sense()
+            inputs = self.sensors[:len(self.stack)].reshape(len(self.stack), -1)
+            outputs = self.stack.predict(inputs, out=self.outputs)
+            for agent in active:
+                agent.act(outputs[self.stack_rows[agent]])
+
+        self.render_grid()
+        self.iteration += 1
+
     def is_out_of_bounds(self, agent):
         """Checks to see if an agent is out of bounds
 
@@ -182,21 +833,73 @@ class Grid():
         return False
 
     def render_grid(self, scale=4):
+        if self.image_queue is None:
+            return
         job = {}
         job['matrix'] = np.copy(self.grid)
         job['scale'] = scale
         job['filename'] = str(self)
         self.image_queue.put(job)
 
-    def simulate(self):
+    def release(self):
+        """Drops the grid's agents once its scores were collected.
+        The arena's buffers are kept for reset."""
+        self.active_agents = []
+        self.my_agents = []
+        self.stack_rows = {}
+
+    @property
+    def finished(self):
+        """True once every agent stopped or the time budget ran out"""
+        return not self.active_agents or self.out_of_time
+
+    def simulate(self, max_ticks=None):
+        """Steps the grid until every agent stopped. Simulation can be
+        continued by calling this again with a larger budget.
+
+        :max_ticks: The step number to stop at, None for no limit
+        :returns: A dict of agent scores so far
+
+        """
+        start = time.perf_counter()
+        deadline = None
+        if self.max_time is not None:
+            deadline = start + self.max_time - self.elapsed
         while len(self.active_agents) > 0:
+            if max_ticks is not None and self.iteration >= max_ticks:
+                break
+            if deadline is not None and time.perf_counter() >= deadline:
+                self.out_of_time = True
+                break
             self.step()
+        elapsed = time.perf_counter() - start
+        self.elapsed += elapsed
 
         scores = {}
         for agent in self.my_agents:
             scores[agent] = agent.lifetime
+            agent.eval_time += elapsed
 
         return scores
 
-    def __reset_grid__(self):
-        self.grid = np.zeros((self.width, self.height), dtype=np.uint32)
+
+def score_bounds(agent, ticks):
+    """The lowest and highest score an agent can end with if it
+    survives at most ticks more steps. Every step adds the turn
+    multiplier to the score, a turn raises the multiplier by 1 and
+    going straight lowers it by 0.1. Leaving the grid divides the
+    score by 10.
+
+    :agent: The agent
+    :ticks: The number of steps it may still make
+    :returns: A tuple of (lowest, highest) scores
+
+    """
+    # Turning every step gains the most and going straight the least,
+    # both sums are extreme after no step or after all of them
+    steps = ticks * (ticks + 1) / 2.0
+    # Scores sum multipliers stepped by 0.1, which rounds
+    slack = 1e-9 * (abs(agent.lifetime) + abs(ticks * agent.turn_multiplier) + steps + 1.0)
+    high = agent.lifetime + max(0.0, ticks * agent.turn_multiplier + steps) + slack
+    low = agent.lifetime + min(0.0, ticks * agent.turn_multiplier - 0.1 * steps) - slack
+    return min(low, low / 10.0), max(high, high / 10.0)
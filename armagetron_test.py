@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import subprocess
+import sys
+
+
+# Importing the simulation core should take well under this budget
+IMPORT_BUDGET = 1.0
+
+
+def test_import_is_lightweight():
+    script = ('import sys, time;'
+              'start = time.perf_counter();'
+              'import armagetron, checkpoint, compiled;'
+              'print(time.perf_counter() - start);'
+              'print(" ".join(sorted(m for m in ("networkx", "PIL", "scipy", "rendering")'
+              ' if m in sys.modules)))')
+    output = subprocess.check_output([sys.executable, '-c', script],
+                                     cwd=os.path.dirname(os.path.abspath(__file__)),
+                                     universal_newlines=True)
+    elapsed, heavy = (output.split('\n') + [''])[:2]
+    assert(heavy == '')
+    assert(float(elapsed) < IMPORT_BUDGET)
+
+
+def test_headless_simulation(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    from armagetron import Simulation
+    sim = Simulation(10, 5, render=False, seed=0)
+    sim.simulate(1)
+    assert(sim.generation == 1)
+    assert(not os.path.exists(str(tmp_path / 'images')))
+
+
+def test_brains_see_the_whole_sensor(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    import numpy as np
+    import pytest
+    from armagetron import Simulation
+    for backend in ('neat', 'mlp'):
+        sim = Simulation(10, 5, render=False, seed=0, sensor_radius=2, backend=backend)
+        for agent in sim.population.current_population:
+            assert(agent.sensor_radius == 2)
+            assert(agent.brain.predict(np.zeros((1, 25))).shape == (1, 3))
+            with pytest.raises(ValueError):
+                agent.brain.predict(np.zeros((1, 9)))
+        sim.simulate(1)
+
+
+def test_run_stops_on_criteria(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    from armagetron import Simulation
+    from stopping import Target_Score, Tick_Budget
+
+    sim = Simulation(10, 5, render=False, seed=1)
+    seen = []
+    sim.add_callback(seen.append)
+    results = list(sim.run(5, stop=[Target_Score(float('-inf'))]))
+    assert(len(results) == 1 and seen == results)
+    assert(results[0].stop_reason is not None)
+    assert(results[0].champion in results[0].scores)
+
+    result = sim.simulate(20, stop=[Tick_Budget(1)])
+    assert(result.generation == 1)
+    assert(result.total_ticks >= 1)
+
+
+def test_racing_bounds_ticks(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    from armagetron import Simulation
+    from worker_pool import Worker_Pool
+
+    sim = Simulation(20, 5, render=False, seed=2, racing=[3, 10], max_ticks=8)
+    groups = [sim.population.current_population[i:i + 5] for i in range(0, 20, 5)]
+    grids = [sim.build_grid(group, 0, 0, i, len(groups)) for i, group in enumerate(groups)]
+    stopped = sim.race(grids, Worker_Pool(1))
+
+    # Stopped grids ran the first round, the others ran to max_ticks
+    # unless every agent died first
+    for grid in grids:
+        if grid in stopped:
+            assert(grid.iteration == 3)
+        else:
+            assert(grid.iteration == 8 or (grid.finished and grid.iteration < 8))
+
+    # Grids resume where they left off
+    unfinished = [grid for grid in grids if not grid.finished]
+    assert(unfinished)
+    grid = unfinished[0]
+    before = grid.iteration
+    grid.simulate(before + 1)
+    assert(grid.iteration == before + 1)
+
+
+class Racing_Agent():
+
+    """Just the attributes racing reads"""
+
+    def __init__(self, multiplier):
+        self.lifetime = 0.0
+        self.turn_multiplier = multiplier
+
+
+class Racing_Grid():
+
+    """Stands in for a grid whose single agent adds a fixed turn
+    multiplier every step and never dies"""
+
+    def __init__(self, multiplier):
+        self.iteration = 0
+        self.finished = False
+        self.my_agents = self.active_agents = [Racing_Agent(multiplier)]
+
+    def simulate(self, max_ticks=None):
+        agent = self.my_agents[0]
+        agent.lifetime += agent.turn_multiplier * (max_ticks - self.iteration)
+        self.iteration = max_ticks
+
+
+def test_racing_stops_losing_grids(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    from armagetron import Simulation
+    from worker_pool import Worker_Pool
+
+    sim = Simulation(4, 2, render=False, racing=[3, 10])
+    # The trailing agent could still turn every step and overtake
+    trailing, leader = Racing_Grid(1.0), Racing_Grid(2.0)
+    assert(sim.race([trailing, leader], Worker_Pool(1)) == [])
+    assert(trailing.iteration == leader.iteration == 10)
+
+    # This one cannot even reach the leaders' worst final scores,
+    # which leaving the grid would divide by 10
+    loser, leaders = Racing_Grid(-5.0), [Racing_Grid(5.0) for _ in range(4)]
+    assert(sim.race([loser] + leaders, Worker_Pool(1)) == [loser])
+    assert(loser.iteration == 3)
+    assert(all(leader.iteration == 10 for leader in leaders))
+
+
+def test_score_bounds_hold_for_real_agents(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    from armagetron import Simulation, score_bounds
+
+    sim = Simulation(20, 10, render=False, seed=6)
+    groups = [sim.population.current_population[i:i + 10] for i in range(0, 20, 10)]
+    for i, group in enumerate(groups):
+        grid = sim.build_grid(group, 0, 0, i, len(groups))
+        grid.simulate(5)
+        bounds = {agent: score_bounds(agent, 40 if agent in grid.active_agents else 0)
+                  for agent in group}
+        grid.simulate(45)
+        for agent, (low, high) in bounds.items():
+            assert(low <= agent.lifetime <= high)
+
+
+def test_truncated_scores_are_not_cached(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    from armagetron import Simulation
+    from worker_pool import Worker_Pool
+
+    sim = Simulation(20, 5, render=False, seed=2, racing=[3, 10])
+    race = sim.race
+
+    def stop_first_grid(grids, workers):
+        race(grids, workers)
+        return grids[:1]
+    sim.race = stop_first_grid
+    sim.evaluate(0, Worker_Pool(1))
+
+    # The 5 agents of the stopped grid were still alive
+    assert(sum(stats.count for stats in sim.fitness_cache.stats.values()) == 15)
+
+
+def test_reduced_precision_simulation(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    import numpy as np
+    from armagetron import Simulation
+
+    for backend in ('neat', 'mlp'):
+        sim = Simulation(10, 5, render=False, seed=3, backend=backend, precision='int8')
+        sim.simulate(1)
+        arena = sim.arenas[0]
+        assert(arena.grid.dtype == np.uint8 and arena.sensors.dtype == np.uint8)
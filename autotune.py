@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+
+class Autotuner():
+
+    """Tunes the number of worker threads and the agents per grid for
+    evaluation throughput, measured as agents evaluated per second.
+    Neighbouring settings are tried in turn, climbing towards the
+    fastest. Once settled, a drop in throughput, e.g. because genomes
+    grew, starts a new search.
+
+    Changing the agents per grid changes how many opponents an agent
+    meets, so limits should be chosen to keep scores comparable."""
+
+    def __init__(self,
+                 threads=(1, 8),
+                 sim_population=(10, 100),
+                 drift=0.15,
+                 window=3):
+        """Initializes a tuner
+
+        :threads: The (lowest, highest) number of worker threads
+        :sim_population: The (lowest, highest) number of agents per grid
+        :drift: The relative drop in throughput which starts a new search
+        :window: The number of generations throughput is averaged over
+        once settled
+
+        """
+        if threads[0] < 1 or threads[0] > threads[1]:
+            raise ValueError('Invalid thread limits %s' % (threads,))
+        if sim_population[0] < 1 or sim_population[0] > sim_population[1]:
+            raise ValueError('Invalid agents per grid limits %s' % (sim_population,))
+
+        self.threads = threads
+        self.sim_population = sim_population
+        self.drift = drift
+        self.window = window
+
+        self.current = None
+        self.measured = {}
+        self.candidates = []
+        self.reference = None
+        self.recent = []
+        # A list of (generation, settings, reason) tuples
+        self.decisions = []
+
+    def clamp(self, settings):
+        n_threads, sim_population = settings
+        return (int(np.clip(n_threads, *self.threads)),
+                int(np.clip(sim_population, *self.sim_population)))
+
+    def neighbours(self, settings):
+        """Settings one step away: threads and agents per grid are
+        doubled or halved"""
+        n_threads, sim_population = settings
+        steps = [(n_threads * 2, sim_population),
+                 (max(1, n_threads // 2), sim_population),
+                 (n_threads, sim_population * 2),
+                 (n_threads, max(1, sim_population // 2))]
+        found = []
+        for step in map(self.clamp, steps):
+            if step != settings and step not in self.measured and step not in found:
+                found.append(step)
+        return found
+
+    def observe(self, generation, settings, evaluated, seconds):
+        """Records the throughput of a generation and decides the
+        settings of the next one
+
+        :generation: The generation number
+        :settings: The (n_threads, sim_population) the generation ran with
+        :evaluated: The number of agent evaluations
+        :seconds: The time evaluation took
+        :returns: The (n_threads, sim_population) to use next
+
+        """
+        if evaluated == 0 or seconds <= 0:
+            return settings
+        throughput = evaluated / seconds
+
+        if self.reference is None:
+            # Searching
+            self.measured[settings] = throughput
+            if self.current is None:
+                self.current = settings
+                self.candidates = self.neighbours(settings)
+            return self.__advance__(generation, throughput)
+
+        # Settled, watch for drift
+        self.recent = (self.recent + [throughput])[-self.window:]
+        average = sum(self.recent) / len(self.recent)
+        if len(self.recent) == self.window and \
+           average < self.reference * (1 - self.drift):
+            self.__log__(generation, settings,
+                         'throughput fell to %.1f from %.1f agents/s, searching' % \
+                                 (average, self.reference))
+            self.measured = {settings: average}
+            self.reference = None
+            self.recent = []
+            self.current = settings
+            self.candidates = self.neighbours(settings)
+            return self.__advance__(generation, average)
+        return settings
+
+    def __advance__(self, generation, throughput):
+        """Picks the next settings to try, or settles on the best"""
+        if not self.candidates:
+            best = max(self.measured, key=self.measured.get)
+            if best != self.current:
+                # Climb, search around the new best
+                self.current = best
+                self.candidates = self.neighbours(best)
+
+        if self.candidates:
+            nxt = self.candidates.pop(0)
+            self.__log__(generation, nxt,
+                         'trying, the last settings gave %.1f agents/s' % throughput)
+            return nxt
+
+        self.reference = self.measured[self.current]
+        self.__log__(generation, self.current,
+                     'settled at %.1f agents/s' % self.reference)
+        return self.current
+
+    def __log__(self, generation, settings, reason):
+        self.decisions.append((generation, settings, reason))
+        print('\tAutotune: threads=%d agents/grid=%d, %s' % \
+                (settings[0], settings[1], reason))
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from autotune import Autotuner
+from worker_pool import Worker_Pool
+
+
+def test_tuner_climbs_to_fastest_settings():
+    # Throughput peaks at 4 threads and 40 agents per grid
+    def throughput(settings):
+        n_threads, sim_population = settings
+        return 100 - abs(n_threads - 4) * 10 - abs(sim_population - 40)
+
+    tuner = Autotuner(threads=(1, 8), sim_population=(10, 80))
+    settings = (1, 10)
+    for generation in range(30):
+        settings = tuner.observe(generation, settings, throughput(settings), 1.0)
+    assert(settings == (4, 40))
+    assert(tuner.decisions[-1][2].startswith('settled'))
+
+    # A lasting slowdown starts a new search
+    for generation in range(30, 33):
+        settings = tuner.observe(generation, settings, 10, 1.0)
+    assert(tuner.reference is None)
+
+
+def test_worker_pool_resize():
+    workers = Worker_Pool(4)
+    workers.resize(2)
+    assert(len(workers) == 2)
+    workers.resize(3)
+    workers.reset_results()
+    for i in range(10):
+        workers.add_task(lambda i=i: i)
+    workers.wait_for_completion()
+    assert(sorted(workers.results) == list(range(10)))
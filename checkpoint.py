@@ -0,0 +1,560 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from functools import partial
+from itertools import chain
+import json
+from operator import attrgetter
+import os
+import struct
+from threading import Thread
+
+import numpy as np
+
+from evaluation import Fitness_Stats
+from neat import Gene_Store, NEAT_Network, NEAT_Pool, Node
+from species import Species, Speciator
+from streams import Random_Streams
+
+
+MAGIC = b'ARMACKPT'
+# Version 2 added the evaluation state: species, the fitness cache,
+# the novelty archive and the screening model
+VERSION = 2
+ALIGNMENT = 64
+
+NODE_TYPES = ['input', 'hidden', 'output']
+
+NODE_DTYPE = np.dtype([('label', '<i8'), ('type', 'u1')])
+INNOVATION_DTYPE = np.dtype([('innovation', '<i8'), ('in', '<i8'), ('out', '<i8')])
+GENE_DTYPE = np.dtype([('innovation', '<i8'), ('weight', '<f8'), ('enabled', 'u1')])
+ACTIVATION_DTYPE = np.dtype([('label', '<i8'), ('activation', 'u1')])
+# Species refer to their representative's genome by row, a best
+# fitness of NaN was never measured
+SPECIES_DTYPE = np.dtype([('species_id', '<i8'), ('representative', '<i8'),
+                          ('age', '<i8'), ('best_fitness', '<f8'), ('staleness', '<i8')])
+CACHE_DTYPE = np.dtype([('key', '<i8'), ('count', '<i8'), ('mean', '<f8'), ('m2', '<f8')])
+SCORE_DTYPE = np.dtype([('agent_id', '<i8'), ('score', '<f8')])
+
+
+def snapshot(simulation):
+    """Captures the state of a simulation as flat arrays. This is the
+    only part of checkpointing which has to run while evolution is
+    paused, writing can then happen in the background.
+
+    :simulation: The Simulation to capture
+    :returns: A tuple of (header, arrays)
+
+    """
+    pool = simulation.pool
+    population = simulation.population
+    agents = population.current_population
+    speciator = population.speciator
+    species_list = speciator.species if speciator is not None else []
+    # Genes of networks dropped without a release leave the store first
+    pool.genes.collect()
+
+    nodes = np.empty(len(pool.nodes), dtype=NODE_DTYPE)
+    for i, node in enumerate(pool.nodes.values()):
+        nodes[i] = (node.label, NODE_TYPES.index(node.type))
+
+    # Every innovation number stands for one connection, so the
+    # connected nodes only need to be stored once
+    connections = {}
+    for gene in pool.genes.genes.values():
+        connections[gene.innovation] = (gene.in_node.label, gene.out_node.label)
+    innovations = np.empty(len(connections), dtype=INNOVATION_DTYPE)
+    for i, (innovation, (src, dest)) in enumerate(sorted(connections.items())):
+        innovations[i] = (innovation, src, dest)
+
+    # Every distinct gene is stored once, genomes are stored as rows
+    # of the gene table. Genes are matched to rows through their serial
+    # number, so genomes are flattened in a single pass. The species
+    # representatives' genomes follow the population's.
+    table = sorted(pool.genes.genes.values(), key=attrgetter('serial'))
+    serials = np.fromiter(map(attrgetter('serial'), table),
+                          dtype=np.int64, count=len(table))
+    genes = np.empty(len(table), dtype=GENE_DTYPE)
+    for field in GENE_DTYPE.names:
+        genes[field] = np.fromiter(map(attrgetter(field), table),
+                                   dtype=GENE_DTYPE[field],
+                                   count=len(table))
+
+    brains = ([agent.brain for agent in agents] +
+              [species.representative for species in species_list])
+    genomes = [brain.genome for brain in brains]
+    sizes = np.fromiter(map(len, genomes), dtype=np.int64, count=len(genomes))
+    offsets = np.zeros(len(genomes) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=offsets[1:])
+    flat = np.fromiter(map(attrgetter('serial'),
+                           chain.from_iterable(genome.values() for genome in genomes)),
+                       dtype=np.int64,
+                       count=offsets[-1])
+    genome_genes = np.searchsorted(serials, flat)
+    if len(flat) and (genome_genes.max() >= len(serials) or
+                      not np.array_equal(serials[genome_genes], flat)):
+        raise ValueError('Genomes hold genes which are not in the gene store')
+
+    # Only non default activation genes are stored
+    activation_offsets = np.zeros(len(brains) + 1, dtype=np.int64)
+    np.cumsum(np.fromiter((len(brain.activations) for brain in brains),
+                          dtype=np.int64, count=len(brains)),
+              out=activation_offsets[1:])
+    activations = np.array([item for brain in brains
+                            for item in sorted(brain.activations.items())],
+                           dtype=ACTIVATION_DTYPE)
+
+    starting = np.empty(len(pool.starting_genome), dtype=GENE_DTYPE)
+    for i, (innovation, gene) in enumerate(sorted(pool.starting_genome.items())):
+        starting[i] = (innovation, gene.weight, gene.enabled)
+
+    parent_offsets = np.zeros(len(agents) + 1, dtype=np.int64)
+    np.cumsum(np.fromiter((len(agent.parents) for agent in agents),
+                          dtype=np.int64, count=len(agents)),
+              out=parent_offsets[1:])
+    parents = np.array([parent for agent in agents for parent in agent.parents],
+                       dtype=np.int64)
+
+    species = np.full(len(agents), -1, dtype=np.int64)
+    index = {id(agent): i for i, agent in enumerate(agents)}
+    for s in species_list:
+        for agent in s.members:
+            if id(agent) in index:
+                species[index[id(agent)]] = s.species_id
+    species_records = np.array([(s.species_id,
+                                 len(agents) + i,
+                                 s.age,
+                                 np.nan if s.best_fitness is None else s.best_fitness,
+                                 s.staleness)
+                                for i, s in enumerate(species_list)],
+                               dtype=SPECIES_DTYPE)
+
+    header = {'pool': {'innovation_number': pool.innovation_number,
+                       'node_num': pool.node_num,
+                       'inputs': [node.label for node in pool.input_nodes],
+                       'outputs': [node.label for node in pool.output_nodes]},
+              'population': {'max_population': population.max_population,
+                             'sim_population': population.sim_population,
+                             'cur_id': population.cur_id,
+                             'current_generation': population.current_generation},
+              'simulation': {'config': simulation.config,
+                             'generation': simulation.generation,
+                             'entropy': str(simulation.streams.entropy)}}
+    arrays = {'nodes': nodes,
+                    'innovations': innovations,
+                    'starting_genome': starting,
+                    'genes': genes,
+                    'genome_offsets': offsets,
+                    'genome_genes': genome_genes,
+                    'activation_offsets': activation_offsets,
+                    'activations': activations,
+                    'agent_ids': np.array([agent.agent_id for agent in agents],
+                                          dtype=np.int64),
+                    'parent_offsets': parent_offsets,
+                    'parents': parents,
+                    'species': species,
+                    'species_records': species_records}
+
+    if speciator is not None:
+        header['speciator'] = {'threshold': speciator.threshold,
+                               'next_species_id': speciator.next_species_id}
+
+    # Running means decide which genomes are simulated, in LRU order
+    cache = simulation.fitness_cache
+    if cache is not None:
+        arrays['fitness_cache'] = np.array([(key, stats.count, stats.mean, stats.m2)
+                                            for key, stats in cache.stats.items()],
+                                           dtype=CACHE_DTYPE)
+
+    # Evolution keeps changing these in place while the checkpoint is
+    # written, so they are copied
+    if simulation.novelty is not None:
+        archive = simulation.novelty.archive
+        header['novelty'] = {'cursor': archive.cursor}
+        if archive.size > 0:
+            arrays['novelty_archive'] = archive.points[:archive.size].copy()
+
+    screener = simulation.screener
+    if screener is not None:
+        header['screener'] = {'samples': screener.samples}
+        arrays['parent_scores'] = np.array(list(screener.parent_scores.items()),
+                                           dtype=SCORE_DTYPE)
+        if screener.gram is not None:
+            arrays['screener_gram'] = screener.gram.copy()
+            arrays['screener_moments'] = screener.moments.copy()
+            arrays['screener_weights'] = screener.weights.copy()
+
+    return header, arrays
+
+
+def write(path, header, arrays):
+    """Writes a checkpoint file. The file is written next to its
+    destination and moved into place, so a crash never leaves a
+    partial checkpoint behind.
+
+    :path: The checkpoint filename
+    :header: A JSON serializable dict
+    :arrays: A dict of numpy arrays
+
+    """
+    table = {}
+    offset = 0
+    for name, array in arrays.items():
+        offset = align(offset)
+        table[name] = {'offset': offset,
+                       'dtype': array.dtype.descr if array.dtype.names else array.dtype.str,
+                       'shape': list(array.shape)}
+        offset += array.nbytes
+
+    header = dict(header, arrays=table)
+    encoded = json.dumps(header).encode('utf-8')
+    data_start = align(len(MAGIC) + 12 + len(encoded))
+
+    tmp = '%s.tmp' % path
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<IQ', VERSION, len(encoded)))
+        f.write(encoded)
+        for name, array in arrays.items():
+            f.seek(data_start + table[name]['offset'])
+            f.write(np.ascontiguousarray(array).tobytes())
+        # The data must be on disk before the rename is, otherwise a
+        # crash can leave an empty checkpoint in place of the old one
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class Checkpoint():
+
+    """A checkpoint file opened for reading. Arrays are memory-mapped,
+    so only the genomes which are actually touched are read from disk."""
+
+    def __init__(self, path):
+        """Opens a checkpoint
+
+        :path: The checkpoint filename
+
+        """
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError('%s is not a checkpoint' % path)
+            version, length = struct.unpack('<IQ', f.read(12))
+            if version not in (1, VERSION):
+                raise ValueError('Unsupported checkpoint version %d' % version)
+            self.header = json.loads(f.read(length).decode('utf-8'))
+        data_start = align(len(MAGIC) + 12 + length)
+
+        self.path = path
+        self.arrays = {}
+        for name, entry in self.header['arrays'].items():
+            dtype = entry['dtype']
+            if isinstance(dtype, list):
+                dtype = np.dtype([tuple(field) for field in dtype])
+            shape = tuple(entry['shape'])
+            if np.prod(shape) == 0:
+                self.arrays[name] = np.zeros(shape, dtype=dtype)
+            else:
+                self.arrays[name] = np.memmap(path,
+                                              dtype=dtype,
+                                              mode='r',
+                                              offset=data_start + entry['offset'],
+                                              shape=shape)
+        self._pool = None
+
+    def __len__(self):
+        return len(self.arrays['agent_ids'])
+
+    @property
+    def pool(self):
+        """The NEAT_Pool stored in the checkpoint"""
+        if self._pool is None:
+            self._pool = self.__restore_pool__()
+        return self._pool
+
+    def genome(self, i):
+        """Loads a single genome
+
+        :i: The genome's index
+        :returns: A genome dict, with genes interned in the pool
+
+        """
+        offsets = self.arrays['genome_offsets']
+        rows = self.arrays['genome_genes'][offsets[i]:offsets[i + 1]]
+        return self.__load_genes__(self.arrays['genes'][rows])
+
+    def network(self, i):
+        """Loads a genome as a network
+
+        :i: The genome's index
+        :returns: A NEAT_Network
+
+        """
+        return NEAT_Network(self.genome(i), self.pool, self.activations(i))
+
+    def activations(self, i):
+        """Loads the activation genes of a genome
+
+        :i: The genome's index
+        :returns: A dict of node label to activation code
+
+        """
+        if 'activations' not in self.arrays:
+            return {}
+        offsets = self.arrays['activation_offsets']
+        records = self.arrays['activations'][offsets[i]:offsets[i + 1]]
+        return dict(zip(records['label'].tolist(), records['activation'].tolist()))
+
+    def agent_id(self, i):
+        return int(self.arrays['agent_ids'][i])
+
+    def species(self, i):
+        return int(self.arrays['species'][i])
+
+    def parents(self, i):
+        if 'parents' not in self.arrays:
+            return ()
+        offsets = self.arrays['parent_offsets']
+        return tuple(self.arrays['parents'][offsets[i]:offsets[i + 1]].tolist())
+
+    def __restore_pool__(self):
+        meta = self.header['pool']
+        pool = NEAT_Pool.__new__(NEAT_Pool)
+        pool.innovation_number = meta['innovation_number']
+        pool.node_num = meta['node_num']
+        pool.genes = Gene_Store()
+        pool.nodes = {}
+        for label, node_type in self.arrays['nodes']:
+            node = Node(int(label), NODE_TYPES[node_type])
+            pool.nodes[node.label] = node
+        pool.input_nodes = [pool.nodes[label] for label in meta['inputs']]
+        pool.output_nodes = [pool.nodes[label] for label in meta['outputs']]
+
+        innovations = self.arrays['innovations']
+        self._connections = dict(zip(innovations['innovation'].tolist(),
+                                     zip(innovations['in'].tolist(),
+                                         innovations['out'].tolist())))
+        self._pool = pool
+        pool.starting_genome = self.__load_genes__(self.arrays['starting_genome'])
+        pool.genes.acquire(pool.starting_genome.values())
+        return pool
+
+    def __load_genes__(self, records):
+        pool = self.pool
+        genome = {}
+        for innovation, weight, enabled in zip(records['innovation'].tolist(),
+                                               records['weight'].tolist(),
+                                               records['enabled'].tolist()):
+            src, dest = self._connections[innovation]
+            genome[innovation] = pool.genes.intern(pool.nodes[src],
+                                                   pool.nodes[dest],
+                                                   weight,
+                                                   bool(enabled),
+                                                   innovation)
+        return genome
+
+
+def save(simulation, path):
+    """Writes a checkpoint of a simulation
+
+    :simulation: The Simulation to save
+    :path: The checkpoint filename
+
+    """
+    write(path, *snapshot(simulation))
+
+
+def load(path, **overrides):
+    """Resumes a simulation from a checkpoint. Brains are only loaded
+    from the checkpoint when they are first used.
+
+    :path: The checkpoint filename
+    :overrides: Simulation arguments replacing the stored ones,
+    e.g. n_threads
+    :returns: A Simulation which continues where the checkpoint was taken
+
+    """
+    from armagetron import Simulation
+    from agent import Agent
+    from populations import Population
+
+    checkpoint = Checkpoint(path)
+    state = checkpoint.header['simulation']
+    config = dict(state['config'], **overrides)
+    meta = checkpoint.header['population']
+
+    # Streams are keyed by generation, restoring the root entropy
+    # continues every stream where it left off
+    streams = Random_Streams(int(state['entropy']))
+    pool = checkpoint.pool
+    agents = [Agent(checkpoint.agent_id(i),
+                    pool,
+                    sensor_radius=config['sensor_radius'],
+                    load_brain=partial(checkpoint.network, i))
+              for i in range(len(checkpoint))]
+    for i, agent in enumerate(agents):
+        agent.parents = checkpoint.parents(i)
+
+    speciator = None
+    if config['speciation']:
+        speciator = Speciator()
+        restore_species(checkpoint, speciator, agents)
+
+    population = Population(meta['max_population'],
+                            meta['sim_population'],
+                            pool,
+                            speciator,
+                            streams,
+                            agents=agents,
+                            sensor_radius=config['sensor_radius'])
+    population.cur_id = meta['cur_id']
+    population.current_generation = meta['current_generation']
+
+    simulation = Simulation(population=population, **config)
+    simulation.generation = state['generation']
+    simulation.streams = streams
+    if simulation.fitness_cache is not None and 'fitness_cache' in checkpoint.arrays:
+        for key, count, mean, m2 in checkpoint.arrays['fitness_cache'].tolist():
+            stats = Fitness_Stats()
+            stats.count, stats.mean, stats.m2 = count, mean, m2
+            simulation.fitness_cache.stats[key] = stats
+    if simulation.novelty is not None and 'novelty' in checkpoint.header:
+        restore_archive(checkpoint, simulation.novelty.archive)
+    if simulation.screener is not None and 'screener' in checkpoint.header:
+        restore_screener(checkpoint, simulation.screener)
+    return simulation
+
+
+def restore_species(checkpoint, speciator, agents):
+    """Restores the species of a checkpoint, with their
+    representatives, members and the speciator's threshold
+
+    :checkpoint: A Checkpoint
+    :speciator: A new Speciator
+    :agents: The checkpoint's agents
+
+    """
+    meta = checkpoint.header.get('speciator')
+    if meta is None:
+        return
+    speciator.threshold = meta['threshold']
+    speciator.next_species_id = meta['next_species_id']
+
+    by_id = {}
+    for species_id, row, age, best_fitness, staleness in checkpoint.arrays['species_records'].tolist():
+        species = Species(species_id, checkpoint.network(row))
+        species.age = age
+        species.best_fitness = None if np.isnan(best_fitness) else best_fitness
+        species.staleness = staleness
+        speciator.adopt(species)
+        by_id[species_id] = species
+    for i, agent in enumerate(agents):
+        species = by_id.get(checkpoint.species(i))
+        if species is not None:
+            species.members.append(agent)
+
+
+def restore_archive(checkpoint, archive):
+    """Refills a novelty archive with the checkpointed behaviors
+
+    :checkpoint: A Checkpoint
+    :archive: An empty Novelty_Archive
+
+    """
+    if 'novelty_archive' in checkpoint.arrays:
+        points = checkpoint.arrays['novelty_archive']
+        archive.points = np.empty((archive.max_size, points.shape[1]))
+        archive.points[:len(points)] = points
+        archive.size = len(points)
+        archive.cursor = checkpoint.header['novelty']['cursor']
+        archive.rebuild()
+
+
+def restore_screener(checkpoint, screener):
+    """Restores a screener's model and the scores offspring are
+    judged by
+
+    :checkpoint: A Checkpoint
+    :screener: A new Screener
+
+    """
+    scores = checkpoint.arrays['parent_scores']
+    screener.parent_scores = dict(zip(scores['agent_id'].tolist(), scores['score'].tolist()))
+    screener.samples = checkpoint.header['screener']['samples']
+    if 'screener_gram' in checkpoint.arrays:
+        screener.gram = np.array(checkpoint.arrays['screener_gram'])
+        screener.moments = np.array(checkpoint.arrays['screener_moments'])
+        screener.weights = np.array(checkpoint.arrays['screener_weights'])
+
+
+class Checkpointer():
+
+    """Periodically writes checkpoints in a background thread"""
+
+    def __init__(self, directory, every=10, keep=3):
+        """Initializes a checkpointer
+
+        :directory: Where checkpoints are written
+        :every: The number of generations between checkpoints
+        :keep: The number of most recent checkpoints kept on disk
+
+        """
+        if every < 1:
+            raise ValueError('Checkpoint interval must be positive')
+
+        self.directory = directory
+        self.every = every
+        self.keep = keep
+        self.thread = None
+        self.written = []
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def path(self, generation):
+        return os.path.join(self.directory, 'generation-%06d.ckpt' % generation)
+
+    def maybe_save(self, simulation):
+        """Checkpoints the simulation if it is due. Only the snapshot
+        is taken on the calling thread.
+
+        :simulation: The Simulation to save
+        :returns: True if a checkpoint was started
+
+        """
+        if simulation.generation % self.every != 0:
+            return False
+
+        header, arrays = snapshot(simulation)
+        self.wait()
+        path = self.path(simulation.generation)
+        self.thread = Thread(target=self.__write__, args=(path, header, arrays))
+        self.thread.daemon = True
+        self.thread.start()
+        return True
+
+    def wait(self):
+        """Waits for the checkpoint being written"""
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def latest(self):
+        """Returns the most recent checkpoint in the directory, or None"""
+        names = sorted(name for name in os.listdir(self.directory)
+                       if name.endswith('.ckpt'))
+        if not names:
+            return None
+        return os.path.join(self.directory, names[-1])
+
+    def __write__(self, path, header, arrays):
+        write(path, header, arrays)
+        self.written.append(path)
+        while len(self.written) > self.keep:
+            old = self.written.pop(0)
+            if os.path.exists(old):
+                os.remove(old)
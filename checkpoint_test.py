@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+import checkpoint
+from armagetron import Simulation
+
+
+def test_checkpoint_round_trip(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    rng = np.random.default_rng(0)
+    sim = Simulation(20, 10)
+    agents = sim.population.current_population
+    # Give the genomes some structure to store
+    for i in range(len(agents)):
+        agents[i] = agents[i].crossover(agents[rng.integers(len(agents))], rng)
+        agents[i].agent_id = 100 + i
+    sim.generation = 7
+
+    path = str(tmp_path / 'run.ckpt')
+    checkpoint.save(sim, path)
+
+    ckpt = checkpoint.Checkpoint(path)
+    assert(len(ckpt) == 20)
+    assert(ckpt.agent_id(3) == 103)
+
+    resumed = checkpoint.load(path)
+    assert(resumed.generation == 7)
+    assert(resumed.pool.innovation_number == sim.pool.innovation_number)
+    assert(resumed.streams.entropy == sim.streams.entropy)
+    assert(resumed.placements(8, 0) == sim.placements(8, 0))
+    for old, new in zip(agents, resumed.population.current_population):
+        assert(old.brain.key == new.brain.key)
+
+
+def test_resumed_run_matches_uninterrupted_run(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    def run(sim, generations):
+        scores = {}
+        sim.add_callback(lambda result: scores.update(
+            ((result.generation, agent.agent_id), score)
+            for agent, score in result.scores.items()))
+        sim.simulate(generations)
+        return scores
+
+    directory = str(tmp_path / 'checkpoints')
+    full = run(Simulation(20, 10, seed=3, render=False,
+                          checkpoint_dir=directory, checkpoint_every=2), 6)
+
+    resumed_sim = checkpoint.load(str(tmp_path / 'checkpoints' / 'generation-000002.ckpt'),
+                                  checkpoint_dir=None)
+    # Brains are only loaded once they are evaluated
+    assert(all(agent._brain is None for agent in resumed_sim.population.current_population))
+    resumed = run(resumed_sim, 4)
+
+    assert(len(resumed) == 4 * 20)
+    for key, score in resumed.items():
+        assert(full[key] == score)
+
+
+def test_representatives_round_trip(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for seed in range(1, 5):
+        sim = Simulation(30, 10, seed=seed, render=False, max_ticks=200)
+        # Small species, whose representatives' agents die out
+        sim.population.speciator.threshold = 0.08
+        sim.simulate(4)
+
+        path = str(tmp_path / ('seed-%d.ckpt' % seed))
+        checkpoint.save(sim, path)
+        resumed = checkpoint.load(path)
+        old = sim.population.speciator.species
+        new = resumed.population.speciator.species
+        assert(len(old) > 1)
+        assert([s.species_id for s in old] == [s.species_id for s in new])
+        for before, after in zip(old, new):
+            assert(before.representative.key == after.representative.key)
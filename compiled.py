@@ -0,0 +1,573 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+import json
+from threading import Lock
+
+import numpy as np
+
+from activation import ACTIVATIONS, DEFAULT, FUNCTIONS
+from precision import argmax_agreement, check_precision, probe_inputs, quantize
+
+
+# Version of exported network files. Version 2 added the bias slot.
+EXPORT_VERSION = 2
+
+# Linear nodes with a single source are folded into their consumers
+IDENTITY = ACTIVATIONS.index('identity')
+
+
+class Compiled_Network():
+
+    """An immutable, flattened evaluator of a genome. Nodes are
+    numbered with the inputs first and evaluated layer by layer, each
+    layer being a single matrix product."""
+
+    def __init__(self, n_inputs, n_nodes, outputs, layers, spec=None,
+                 dtype=np.float64, scales=None, bias=None, stats=None):
+        """Initializes a compiled network
+
+        :n_inputs: The number of input nodes, which occupy the first
+        slots of the value array
+        :n_nodes: The total number of node slots
+        :outputs: The slot of every output node, n_nodes for outputs
+        which are not connected
+        :layers: A list of (nodes, sources, weights, groups) tuples where
+        weights is a dense len(sources) x len(nodes) matrix and groups
+        is a tuple of (activation, start, stop): the nodes[start:stop]
+        share the activation function with that code
+        :spec: A dict describing the inputs and outputs, only set
+        on networks loaded from an export
+        :dtype: The dtype node values are computed in
+        :scales: For int8 weights, a list with the float scales of
+        every layer's columns
+        :bias: The slot which always holds 1, None if there is none
+        :stats: A dict of the genome's and the evaluated graph's
+        sizes, see compile_genome
+
+        """
+        self.n_inputs = n_inputs
+        self.n_nodes = n_nodes
+        self.outputs = outputs
+        self.layers = layers
+        self.spec = spec
+        self.dtype = np.dtype(dtype)
+        self.scales = scales
+        self.bias = bias
+        self.stats = stats
+        # The weights predict multiplies by, in the dtype. int8
+        # weights stay int8 and are widened a layer at a time into
+        # the workspace.
+        if scales is None:
+            self.weights = [weights.astype(self.dtype, copy=False) for _, _, weights, _ in layers]
+        else:
+            self.weights = None
+
+        # Activation groups write straight into the value array when
+        # their nodes occupy consecutive slots, which compile_genome
+        # arranges
+        self.targets = []
+        for nodes, _, _, groups in layers:
+            targets = []
+            for _, start, stop in groups:
+                span = nodes[start:stop]
+                consecutive = len(span) > 0 and np.all(np.diff(span) == 1)
+                targets.append(slice(int(span[0]), int(span[-1]) + 1) if consecutive else None)
+            self.targets.append(targets)
+
+        for array in self.arrays():
+            array.setflags(write=False)
+
+    def arrays(self):
+        yield self.outputs
+        for nodes, sources, weights, _ in self.layers:
+            yield nodes
+            yield sources
+            yield weights
+        for scales in self.scales or []:
+            yield scales
+        # Weights already in the dtype are not copied
+        for (_, _, weights, _), widened in zip(self.layers, self.weights or []):
+            if widened is not weights:
+                yield widened
+
+    @property
+    def nbytes(self):
+        """The memory used by the evaluator's arrays"""
+        return sum(array.nbytes for array in self.arrays())
+
+    def predict(self, inputs, workspace=None):
+        """Evaluates a batch of inputs
+
+        :inputs: An array with one input per row, e.g. a batch of
+        sensor arrays. Rows are flattened and must hold one value per
+        input node.
+        :workspace: Arrays returned by workspace for this batch size.
+        With them no array is allocated, and the outputs returned are
+        overwritten by the next call.
+        :returns: A 2D array with one row of outputs per input
+
+        """
+        inputs = np.asarray(inputs)
+        batch = inputs.shape[0]
+        inputs = inputs.reshape(batch, -1)
+        if inputs.shape[1] != self.n_inputs:
+            raise ValueError('Feed input != neural input length: %d != %d' % \
+                    (inputs.shape[1], self.n_inputs))
+        if workspace is None:
+            workspace = self.workspace(batch)
+        values, gathered, sums, outputs, widened = workspace
+        values[:self.n_inputs] = inputs.T
+
+        for i, (nodes, sources, weights, groups) in enumerate(self.layers):
+            np.take(values, sources, axis=0, out=gathered[i], mode='clip')
+            if self.scales is not None:
+                np.multiply(weights, self.scales[i], out=widened[i])
+            np.matmul(widened[i].T, gathered[i], out=sums[i])
+            for (activation, start, stop), target in zip(groups, self.targets[i]):
+                if target is None:
+                    values[nodes[start:stop]] = FUNCTIONS[activation](sums[i][start:stop])
+                else:
+                    FUNCTIONS[activation](sums[i][start:stop], out=values[target])
+
+        # The last slot is always zero and stands in for
+        # disconnected outputs
+        np.take(values, self.outputs, axis=0, out=outputs, mode='clip')
+        return outputs.T
+
+    def workspace_size(self, batch=1):
+        """The number of values workspace needs for a batch"""
+        per_row = self.n_nodes + 1 + len(self.outputs)
+        for nodes, sources, _, _ in self.layers:
+            per_row += len(sources) + len(nodes)
+        return batch * per_row + self.scratch_size()
+
+    def scratch_size(self):
+        """The number of values int8 weights are widened into, the
+        largest layer's"""
+        if self.scales is None:
+            return 0
+        return max([weights.size for _, _, weights, _ in self.layers] + [0])
+
+    def workspace(self, batch=1, buffer=None):
+        """Lays out the arrays predict computes in. They are carved
+        from a flat buffer, so a grid can keep one buffer per agent
+        slot and reuse it for whatever network occupies the slot.
+        Arrays hold one row per node and one column per input, so
+        activation groups are contiguous and numpy never buffers.
+
+        :batch: The number of inputs per call
+        :buffer: A flat array of the network's dtype and at least
+        workspace_size(batch) values, allocated if None
+        :returns: A tuple of (values, gathered sources of every
+        layer, sums of every layer, outputs, weights of every layer).
+        The weights of int8 networks all share one scratch area.
+
+        """
+        if buffer is None:
+            buffer = np.empty(self.workspace_size(batch), dtype=self.dtype)
+        offset = 0
+
+        def carve(rows):
+            nonlocal offset
+            array = buffer[offset:offset + rows * batch].reshape(rows, batch)
+            offset += rows * batch
+            return array
+
+        values = carve(self.n_nodes + 1)
+        values.fill(0)
+        if self.bias is not None:
+            values[self.bias] = 1
+        gathered = [carve(len(sources)) for _, sources, _, _ in self.layers]
+        sums = [carve(len(nodes)) for nodes, _, _, _ in self.layers]
+        outputs = carve(len(self.outputs))
+        if self.scales is None:
+            return values, gathered, sums, outputs, self.weights
+        scratch = buffer[offset:offset + self.scratch_size()]
+        widened = [scratch[:weights.size].reshape(weights.shape) for _, _, weights, _ in self.layers]
+        return values, gathered, sums, outputs, widened
+
+    def feedforward(self, data):
+        """Evaluates a single input
+
+        :data: An array of any shape, it is flattened
+        :returns: A list of output values
+
+        """
+        return self.predict(data.reshape(1, -1))[0].tolist()
+
+    def reduced(self, precision):
+        """Builds this network with less precise weights. An int8
+        network is only used if it picks the same output as this one
+        on every pattern of the probe bank, otherwise the float32 one
+        is returned. Networks which are already reduced are returned
+        as they are, Network_Cache keeps the variants.
+
+        :precision: One of precision.PRECISIONS
+        :returns: A Compiled_Network
+
+        """
+        if check_precision(precision) == 'float64' or self.dtype != np.float64:
+            return self
+
+        if precision == 'int8':
+            quantized = [quantize(weights) for _, _, weights, _ in self.layers]
+            int8 = Compiled_Network(self.n_inputs,
+                                    self.n_nodes,
+                                    self.outputs,
+                                    [(nodes, sources, weights, groups)
+                                     for (nodes, sources, _, groups), (weights, _)
+                                     in zip(self.layers, quantized)],
+                                    self.spec,
+                                    np.float32,
+                                    [scales for _, scales in quantized],
+                                    self.bias,
+                                    self.stats)
+            probes = probe_inputs(self.n_inputs)
+            if argmax_agreement(self.predict(probes), int8.predict(probes)) == 1.0:
+                return int8
+
+        return Compiled_Network(self.n_inputs,
+                                self.n_nodes,
+                                self.outputs,
+                                [(nodes, sources, weights.astype(np.float32), groups)
+                                 for nodes, sources, weights, groups in self.layers],
+                                self.spec,
+                                np.float32,
+                                bias=self.bias,
+                                stats=self.stats)
+
+
+def save_network(network, path, spec=None):
+    """Exports a compiled network as a self-contained .npz file
+    which load_network reads without the pool it came from
+
+    :network: A Compiled_Network
+    :path: The filename
+    :spec: A JSON serializable dict describing the inputs and outputs
+
+    """
+    if network.scales is not None:
+        raise ValueError('Quantized networks cannot be exported')
+    arrays = {'version': np.array(EXPORT_VERSION),
+              'shape': np.array([network.n_inputs, network.n_nodes, len(network.layers)]),
+              'bias': np.array(-1 if network.bias is None else network.bias),
+              'outputs': network.outputs,
+              'activations': np.array(ACTIVATIONS),
+              'spec': np.array(json.dumps(spec or {}))}
+    for i, (nodes, sources, weights, groups) in enumerate(network.layers):
+        arrays['nodes_%d' % i] = nodes
+        arrays['sources_%d' % i] = sources
+        arrays['weights_%d' % i] = weights
+        arrays['groups_%d' % i] = np.array(groups, dtype=np.intp).reshape(-1, 3)
+    np.savez(path, **arrays)
+
+
+def load_network(path):
+    """Loads a network written by save_network. Only numpy is needed.
+
+    :path: The filename
+    :returns: A Compiled_Network, its spec attribute holds the
+    description of the inputs and outputs
+
+    """
+    with np.load(path, allow_pickle=False) as data:
+        version = int(data['version'])
+        if version not in (1, EXPORT_VERSION):
+            raise ValueError('Unsupported network version %d' % version)
+        bias = int(data['bias']) if version > 1 else -1
+        n_inputs, n_nodes, n_layers = data['shape'].tolist()
+        # Activations are stored by name, so files survive new
+        # functions being added
+        codes = [ACTIVATIONS.index(name) for name in data['activations'].tolist()]
+        layers = []
+        for i in range(n_layers):
+            groups = tuple((codes[activation], start, stop)
+                           for activation, start, stop in data['groups_%d' % i].tolist())
+            layers.append((data['nodes_%d' % i],
+                           data['sources_%d' % i],
+                           data['weights_%d' % i],
+                           groups))
+        return Compiled_Network(n_inputs,
+                                n_nodes,
+                                data['outputs'],
+                                layers,
+                                json.loads(str(data['spec'])),
+                                bias=None if bias < 0 else bias)
+
+
+def compile_genome(genome, input_labels, output_labels, activations=None):
+    """Compiles a genome into a Compiled_Network. The evaluated graph
+    is simplified first, without changing the outputs:
+
+    - nodes which no output depends on are dropped
+    - nodes which no input reaches compute a constant, which is
+      folded into their consumers as a bias
+    - identity nodes with a single source are folded into their
+      consumers
+    - connections with a weight of zero are skipped
+
+    :genome: A dict of genes
+    :input_labels: The labels of the input nodes, in input order
+    :output_labels: The labels of the output nodes, in output order
+    :activations: A dict of node label to activation code, nodes
+    which are missing use the default activation
+    :returns: A Compiled_Network, its stats attribute holds the
+    number of expressed nodes and connections and how many of them
+    are evaluated
+
+    """
+    inputs = set(input_labels)
+    outputs = set(output_labels)
+    activations = activations or {}
+
+    # Incoming connections of every node, inputs are always sources.
+    # Like the graph, a later gene between the same nodes overrides
+    # an earlier one.
+    connections = {}
+    for _, gene in sorted(genome.items()):
+        if gene['enabled'] and gene['out'].label not in inputs:
+            connections[(gene['in'].label, gene['out'].label)] = gene['weight']
+    incoming = {}
+    for (src, dest), weight in connections.items():
+        incoming.setdefault(dest, []).append((src, weight))
+
+    # Only ancestors of the outputs influence the result
+    needed = set()
+    stack = [label for label in output_labels if label in incoming]
+    while stack:
+        label = stack.pop()
+        if label in needed or label in inputs:
+            continue
+        needed.add(label)
+        stack.extend(src for src, _ in incoming.get(label, []))
+
+    # Connections from deeper nodes close cycles and are ignored
+    depth = layer_depths(needed, incoming, inputs)
+
+    # Walk the nodes in evaluation order. Nodes without incoming
+    # connections keep a value of zero.
+    constants = {label: 0.0 for label in needed if depth[label] == 0}
+    aliases = {}
+    live = {}
+    for label in sorted((label for label in needed if depth[label] > 0),
+                        key=lambda label: (depth[label], label)):
+        terms = {}
+        offset = 0.0
+        for src, weight in incoming[label]:
+            if depth.get(src, 0) >= depth[label] and src not in inputs:
+                continue
+            if src in constants:
+                offset += weight * constants[src]
+                continue
+            if src in aliases:
+                src, scale, shift = aliases[src]
+                offset += weight * shift
+                weight *= scale
+            terms[src] = terms.get(src, 0.0) + weight
+        terms = {src: weight for src, weight in terms.items() if weight != 0.0}
+
+        code = activations.get(label, DEFAULT)
+        if label in outputs:
+            live[label] = (terms, offset)
+        elif not terms:
+            constants[label] = float(FUNCTIONS[code](np.array([offset]))[0])
+        elif code == IDENTITY and len(terms) == 1:
+            (src, weight), = terms.items()
+            aliases[label] = (src, weight, offset)
+        else:
+            live[label] = (terms, offset)
+
+    # Dropping constants and aliases may leave nodes no output needs
+    kept = set()
+    stack = [label for label in output_labels if label in live]
+    while stack:
+        label = stack.pop()
+        if label in kept:
+            continue
+        kept.add(label)
+        stack.extend(src for src in live[label][0] if src in live)
+
+    # The simplified graph has no cycles, depths are recomputed
+    # so it is evaluated in as few layers as possible
+    levels = {}
+    for label in sorted(kept, key=lambda label: (depth[label], label)):
+        levels[label] = 1 + max([levels.get(src, 0) for src in live[label][0]] + [0])
+
+    # Folded constants are weights on a slot which always holds 1
+    slots = {label: i for i, label in enumerate(input_labels)}
+    n_nodes = len(input_labels)
+    bias = None
+    if any(live[label][1] != 0.0 for label in kept):
+        bias = n_nodes
+        n_nodes += 1
+    # Within a level, nodes sharing an activation get consecutive slots
+    for label in sorted(kept, key=lambda label: (levels[label],
+                                                 activations.get(label, DEFAULT),
+                                                 label)):
+        slots[label] = n_nodes
+        n_nodes += 1
+
+    by_level = {}
+    for label in kept:
+        by_level.setdefault(levels[label], []).append(label)
+
+    layers = []
+    n_edges = 0
+    for level in sorted(by_level):
+        # Nodes sharing an activation are next to each other, so
+        # every function is applied once per layer
+        labels = sorted(by_level[level],
+                        key=lambda label: (activations.get(label, DEFAULT), slots[label]))
+        codes = [activations.get(label, DEFAULT) for label in labels]
+        groups = tuple((code, codes.index(code), len(codes) - codes[::-1].index(code))
+                       for code in sorted(set(codes)))
+        sources = set()
+        for label in labels:
+            terms, offset = live[label]
+            sources.update(slots[src] for src in terms)
+            if offset != 0.0:
+                sources.add(bias)
+        sources = sorted(sources)
+        rows = {slot: i for i, slot in enumerate(sources)}
+        weights = np.zeros((len(sources), len(labels)))
+        for j, label in enumerate(labels):
+            terms, offset = live[label]
+            for src, weight in terms.items():
+                weights[rows[slots[src]], j] = weight
+            if offset != 0.0:
+                weights[rows[bias], j] = offset
+        n_edges += np.count_nonzero(weights)
+        layers.append((np.array([slots[label] for label in labels], dtype=np.intp),
+                       np.array(sources, dtype=np.intp),
+                       weights,
+                       groups))
+
+    stats = {'nodes': len({dest for _, dest in connections}),
+             'connections': len(connections),
+             'evaluated_nodes': len(kept),
+             'evaluated_connections': int(n_edges)}
+    outputs = np.array([slots.get(label, n_nodes) for label in output_labels],
+                       dtype=np.intp)
+
+    return Compiled_Network(len(input_labels), n_nodes, outputs, layers,
+                            bias=bias, stats=stats)
+
+
+def layer_depths(needed, incoming, inputs):
+    """Computes the evaluation depth of every needed node. Inputs and
+    nodes without incoming connections have depth 0. Connections which
+    close a cycle are ignored.
+
+    :needed: The set of node labels to evaluate
+    :incoming: A dict of node label to (source label, weight) lists
+    :inputs: The set of input labels
+    :returns: A dict of node label to depth
+
+    """
+    depth = {}
+    visiting = set()
+    for root in sorted(needed):
+        if root in depth:
+            continue
+        # Iterative depth first search so deep genomes do not hit
+        # the recursion limit
+        stack = [(root, False)]
+        while stack:
+            label, expanded = stack.pop()
+            if label in depth:
+                continue
+            if label in inputs or label not in needed:
+                depth[label] = 0
+                continue
+            if expanded:
+                visiting.discard(label)
+                preds = [depth[src] for src, _ in incoming.get(label, [])
+                         if src in depth]
+                depth[label] = 1 + max(preds) if preds else 0
+                continue
+            visiting.add(label)
+            stack.append((label, True))
+            for src, _ in incoming.get(label, []):
+                if src not in depth and src not in visiting:
+                    stack.append((src, False))
+    return depth
+
+
+class Network_Cache():
+
+    """A process wide, memory bounded LRU cache of compiled networks
+    keyed by genome hash"""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        """Initializes a cache
+
+        :max_bytes: The memory the cached networks may use
+
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.networks = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.networks)
+
+    def get(self, key, build, precision='float64'):
+        """Returns the compiled network of a genome, building it
+        if it is not cached
+
+        :key: The genome hash
+        :build: A function returning a Compiled_Network
+        :precision: One of precision.PRECISIONS. Reduced variants are
+        entries of their own, so their memory is counted and they are
+        evicted independently of the full precision network.
+        :returns: A Compiled_Network
+
+        """
+        if check_precision(precision) != 'float64':
+            return self.get((key, precision), lambda: self.get(key, build).reduced(precision))
+
+        with self.lock:
+            network = self.networks.get(key)
+            if network is not None:
+                self.networks.move_to_end(key)
+                self.hits += 1
+                return network
+            self.misses += 1
+
+        network = build()
+
+        with self.lock:
+            if key not in self.networks:
+                self.networks[key] = network
+                self.nbytes += network.nbytes
+                while self.nbytes > self.max_bytes and len(self.networks) > 1:
+                    _, evicted = self.networks.popitem(last=False)
+                    self.nbytes -= evicted.nbytes
+                    self.evictions += 1
+        return network
+
+    def clear(self):
+        with self.lock:
+            self.networks.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        """Returns the cache counters
+
+        :returns: A dict
+
+        """
+        return {'size': len(self.networks),
+                'bytes': self.nbytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions}
+
+
+network_cache = Network_Cache()
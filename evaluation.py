@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+
+import numpy as np
+
+
+class Fitness_Stats():
+
+    """Running statistics of the scores a genome has received"""
+
+    __slots__ = ('count', 'mean', 'm2')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def __repr__(self):
+        return 'Fitness_Stats(n=%d, mean=%f, var=%f)' % (self.count,
+                                                         self.mean,
+                                                         self.variance)
+
+    def add(self, score):
+        """Adds a score with Welford's running mean
+
+        :score: The new score
+
+        """
+        self.count += 1
+        delta = score - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (score - self.mean)
+
+    @property
+    def variance(self):
+        if self.count < 2:
+            return 0.0
+        return self.m2 / (self.count - 1)
+
+
+class Fitness_Cache():
+
+    """An LRU bounded cache of score statistics keyed by genome hash.
+    Genomes which were already measured enough times are not simulated
+    again, their mean score is reused."""
+
+    def __init__(self, max_size=10000, max_samples=3):
+        """Initializes a cache
+
+        :max_size: The maximum number of genomes remembered
+        :max_samples: The number of scores after which a genome's
+        mean is trusted and it is no longer simulated
+
+        """
+        if max_size < 1:
+            raise ValueError('Cache size must be positive')
+        if max_samples < 1:
+            raise ValueError('At least one sample is required')
+
+        self.max_size = max_size
+        self.max_samples = max_samples
+        self.stats = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.stats)
+
+    def get(self, key):
+        """Returns the statistics of a genome
+
+        :key: The genome hash
+        :returns: Fitness_Stats or None
+
+        """
+        stats = self.stats.get(key)
+        if stats is not None:
+            self.stats.move_to_end(key)
+        return stats
+
+    def is_settled(self, key):
+        """Returns True if a genome does not need to be simulated
+
+        :key: The genome hash
+
+        """
+        stats = self.get(key)
+        if stats is not None and stats.count >= self.max_samples:
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def add(self, key, score):
+        """Records a score for a genome
+
+        :key: The genome hash
+        :score: The score it received
+        :returns: The updated Fitness_Stats
+
+        """
+        stats = self.get(key)
+        if stats is None:
+            stats = Fitness_Stats()
+            self.stats[key] = stats
+            while len(self.stats) > self.max_size:
+                self.stats.popitem(last=False)
+        stats.add(score)
+        return stats
+
+
+def start_configurations(seed, n_slots, width, height):
+    """Generates the starting positions and headings for every agent
+    slot of a grid. Every grid sharing a seed starts the same way, so
+    agents are compared under common random numbers.
+
+    :seed: The seed of the configuration, an integer or SeedSequence
+    :n_slots: The number of agents per grid
+    :width: The grid width
+    :height: The grid height
+    :returns: A list of (x, y, heading) tuples
+
+    """
+    rng = np.random.default_rng(seed)
+    xs = rng.integers(0, width, size=n_slots)
+    ys = rng.integers(0, height, size=n_slots)
+    headings = rng.integers(0, 4, size=n_slots)
+    return list(zip(xs.tolist(), ys.tolist(), headings.tolist()))
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import re
+
+import numpy as np
+
+
+# Per agent columns and their types
+AGENT_COLUMNS = [('generation', np.int64),
+                 ('agent_id', np.int64),
+                 ('parent0', np.int64),
+                 ('parent1', np.int64),
+                 ('fitness', np.float64),
+                 ('complexity', np.int64),
+                 ('species', np.int64),
+                 ('eval_time', np.float64)]
+
+# Per generation columns
+GENERATION_COLUMNS = [('generation', np.int64),
+                      ('top', np.float64),
+                      ('low', np.float64),
+                      ('mean', np.float64),
+                      ('median', np.float64),
+                      ('mean_complexity', np.float64),
+                      ('max_complexity', np.int64),
+                      ('n_species', np.int64),
+                      ('eval_time', np.float64)]
+
+CHUNK_PATTERN = re.compile(r'^(agents|generations)-(\d+)\.npz$')
+
+
+class History_Store():
+
+    """An append-only, columnar record of a run. Generations are
+    buffered and written as chunks of uncompressed .npz files holding
+    one array per column, so queries only read the columns they need."""
+
+    def __init__(self, directory, chunk_generations=10):
+        """Opens a history store, new chunks are appended after any
+        chunks already in the directory
+
+        :directory: Where chunks are written
+        :chunk_generations: The number of generations per chunk
+
+        """
+        if chunk_generations < 1:
+            raise ValueError('Chunks must hold at least one generation')
+
+        self.directory = directory
+        self.chunk_generations = chunk_generations
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        chunks = self.__chunks__('agents')
+        self.next_chunk = chunks[-1][0] + 1 if chunks else 0
+
+        self.agent_rows = {name: [] for name, _ in AGENT_COLUMNS}
+        self.generation_rows = {name: [] for name, _ in GENERATION_COLUMNS}
+        self.buffered = 0
+
+    def record(self, generation, agent_scores, species=None):
+        """Records a scored generation
+
+        :generation: The generation number
+        :agent_scores: A dict of agent scores
+        :species: A list of Species the agents were divided into, if any
+
+        """
+        agents = list(agent_scores.keys())
+        species_of = {}
+        for s in species or []:
+            for agent in s.members:
+                species_of[id(agent)] = s.species_id
+
+        fitness = np.array([agent_scores[agent] for agent in agents], dtype=np.float64)
+        complexity = np.array([agent.get_complexity() for agent in agents], dtype=np.int64)
+        eval_time = np.array([agent.eval_time for agent in agents], dtype=np.float64)
+        parents = [tuple(agent.parents) + (-1, -1) for agent in agents]
+
+        rows = self.agent_rows
+        rows['generation'].append(np.full(len(agents), generation, dtype=np.int64))
+        rows['agent_id'].append(np.array([agent.agent_id for agent in agents], dtype=np.int64))
+        rows['parent0'].append(np.array([p[0] for p in parents], dtype=np.int64))
+        rows['parent1'].append(np.array([p[1] for p in parents], dtype=np.int64))
+        rows['fitness'].append(fitness)
+        rows['complexity'].append(complexity)
+        rows['species'].append(np.array([species_of.get(id(agent), -1) for agent in agents],
+                                        dtype=np.int64))
+        rows['eval_time'].append(eval_time)
+
+        stats = {'generation': generation,
+                 'top': fitness.max() if len(agents) else 0.0,
+                 'low': fitness.min() if len(agents) else 0.0,
+                 'mean': fitness.mean() if len(agents) else 0.0,
+                 'median': np.median(fitness) if len(agents) else 0.0,
+                 'mean_complexity': complexity.mean() if len(agents) else 0.0,
+                 'max_complexity': complexity.max() if len(agents) else 0,
+                 'n_species': len(species or []),
+                 'eval_time': eval_time.sum()}
+        for name, _ in GENERATION_COLUMNS:
+            self.generation_rows[name].append(stats[name])
+
+        self.buffered += 1
+        if self.buffered >= self.chunk_generations:
+            self.flush()
+
+    def flush(self):
+        """Writes buffered generations as a new chunk"""
+        if self.buffered == 0:
+            return
+
+        agents = {name: np.concatenate(self.agent_rows[name]).astype(dtype)
+                  for name, dtype in AGENT_COLUMNS}
+        generations = {name: np.array(self.generation_rows[name], dtype=dtype)
+                       for name, dtype in GENERATION_COLUMNS}
+        for kind, columns in (('agents', agents), ('generations', generations)):
+            path = os.path.join(self.directory, '%s-%06d.npz' % (kind, self.next_chunk))
+            tmp = '%s.tmp.npz' % path[:-len('.npz')]
+            np.savez(tmp, **columns)
+            os.replace(tmp, path)
+
+        self.next_chunk += 1
+        self.agent_rows = {name: [] for name, _ in AGENT_COLUMNS}
+        self.generation_rows = {name: [] for name, _ in GENERATION_COLUMNS}
+        self.buffered = 0
+
+    def columns(self, names, kind='agents', generations=None):
+        """Reads columns from every chunk, including buffered rows
+
+        :names: The column names to read
+        :kind: 'agents' for per agent rows, 'generations' for
+        per generation aggregates
+        :generations: Optionally a (first, last) inclusive range of
+        generations to keep
+        :returns: A dict of column name to array
+
+        """
+        wanted = list(names)
+        if generations is not None and 'generation' not in wanted:
+            wanted.append('generation')
+
+        parts = {name: [] for name in wanted}
+        for _, path in self.__chunks__(kind):
+            with np.load(path) as chunk:
+                if generations is not None:
+                    # Skip chunks outside the range without reading
+                    # anything but the generation column
+                    gens = chunk['generation']
+                    if len(gens) == 0 or gens.max() < generations[0] or \
+                       gens.min() > generations[1]:
+                        continue
+                for name in wanted:
+                    parts[name].append(chunk[name])
+
+        buffered = self.agent_rows if kind == 'agents' else self.generation_rows
+        for name in wanted:
+            if buffered[name]:
+                if kind == 'agents':
+                    parts[name].append(np.concatenate(buffered[name]))
+                else:
+                    parts[name].append(np.array(buffered[name]))
+
+        dtypes = dict(AGENT_COLUMNS if kind == 'agents' else GENERATION_COLUMNS)
+        result = {name: np.concatenate(parts[name]) if parts[name]
+                  else np.zeros(0, dtype=dtypes[name])
+                  for name in wanted}
+
+        if generations is not None:
+            keep = (result['generation'] >= generations[0]) & \
+                   (result['generation'] <= generations[1])
+            result = {name: column[keep] for name, column in result.items()}
+            if 'generation' not in names:
+                del result['generation']
+        return result
+
+    def fitness_curve(self):
+        """Returns the best, mean and lowest fitness of every generation
+
+        :returns: A dict of arrays: generation, top, mean, low
+
+        """
+        return self.columns(['generation', 'top', 'mean', 'low'], kind='generations')
+
+    def complexity_growth(self):
+        """Returns how network complexity grew over the run
+
+        :returns: A dict of arrays: generation, mean_complexity, max_complexity
+
+        """
+        return self.columns(['generation', 'mean_complexity', 'max_complexity'],
+                            kind='generations')
+
+    def lineage(self, agent_id, max_depth=None):
+        """Traces an agent's ancestry back through its first parents
+
+        :agent_id: The agent to start from
+        :max_depth: The maximum number of ancestors to follow
+        :returns: A list of (generation, agent id, fitness) tuples,
+        starting with the agent itself
+
+        """
+        data = self.columns(['agent_id', 'parent0', 'generation', 'fitness'])
+        order = np.argsort(data['agent_id'], kind='stable')
+        ids = data['agent_id'][order]
+
+        lineage = []
+        current = agent_id
+        while current >= 0 and (max_depth is None or len(lineage) <= max_depth):
+            pos = np.searchsorted(ids, current, side='right') - 1
+            if pos < 0 or ids[pos] != current:
+                break
+            # An agent which was scored in several generations is
+            # described by its latest record
+            row = order[pos]
+            lineage.append((int(data['generation'][row]),
+                            int(current),
+                            float(data['fitness'][row])))
+            current = int(data['parent0'][row])
+        return lineage
+
+    def __chunks__(self, kind):
+        chunks = []
+        for name in os.listdir(self.directory):
+            match = CHUNK_PATTERN.match(name)
+            if match and match.group(1) == kind:
+                chunks.append((int(match.group(2)), os.path.join(self.directory, name)))
+        return sorted(chunks)
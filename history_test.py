@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from history import History_Store
+
+
+class Recorded_Agent():
+
+    """Just the attributes a History_Store records"""
+
+    def __init__(self, agent_id, parents=(), complexity=1):
+        self.agent_id = agent_id
+        self.parents = parents
+        self.complexity = complexity
+        self.eval_time = 0.5
+
+    def get_complexity(self):
+        return self.complexity
+
+
+def generation(number, size=4):
+    """A scored generation whose agents descend from the previous one"""
+    first = number * size
+    agents = [Recorded_Agent(first + i,
+                             (first - size + i, first - size) if number else (),
+                             complexity=number + i)
+              for i in range(size)]
+    return {agent: float(10 * number + i) for i, agent in enumerate(agents)}
+
+
+def test_chunks_round_trip(tmp_path):
+    store = History_Store(str(tmp_path), chunk_generations=2)
+    for number in range(5):
+        store.record(number, generation(number))
+    # Two full chunks are on disk, the last generation is buffered
+    assert(len(list(tmp_path.glob('agents-*.npz'))) == 2)
+
+    data = store.columns(['generation', 'agent_id', 'fitness', 'parent0'])
+    assert(data['generation'].tolist() == [g for g in range(5) for _ in range(4)])
+    assert(data['agent_id'].tolist() == list(range(20)))
+    assert(data['fitness'].tolist() == [10.0 * g + i for g in range(5) for i in range(4)])
+    assert(data['parent0'][:4].tolist() == [-1] * 4)
+
+    curve = store.fitness_curve()
+    assert(curve['generation'].tolist() == list(range(5)))
+    assert(curve['top'].tolist() == [10.0 * g + 3 for g in range(5)])
+    growth = store.complexity_growth()
+    assert(growth['max_complexity'].tolist() == [g + 3 for g in range(5)])
+
+
+def test_reopened_store_appends(tmp_path):
+    store = History_Store(str(tmp_path), chunk_generations=2)
+    for number in range(3):
+        store.record(number, generation(number))
+    store.flush()
+
+    reopened = History_Store(str(tmp_path), chunk_generations=2)
+    assert(reopened.columns(['generation'])['generation'].max() == 2)
+    for number in range(3, 6):
+        reopened.record(number, generation(number))
+    reopened.flush()
+
+    data = History_Store(str(tmp_path)).columns(['generation', 'agent_id'])
+    assert(data['generation'].tolist() == [g for g in range(6) for _ in range(4)])
+    assert(data['agent_id'].tolist() == list(range(24)))
+
+
+def test_lineage_crosses_generations(tmp_path):
+    store = History_Store(str(tmp_path), chunk_generations=2)
+    for number in range(5):
+        store.record(number, generation(number))
+
+    # Every agent's first parent has the same position in the
+    # previous generation
+    lineage = store.lineage(18)
+    assert(lineage == [(4, 18, 42.0), (3, 14, 32.0), (2, 10, 22.0),
+                       (1, 6, 12.0), (0, 2, 2.0)])
+    assert(store.lineage(18, max_depth=1) == lineage[:2])
+    assert(store.lineage(1000) == [])
+
+
+def test_columns_are_read_selectively(tmp_path):
+    store = History_Store(str(tmp_path), chunk_generations=2)
+    for number in range(6):
+        store.record(number, generation(number))
+
+    data = store.columns(['fitness'], generations=(2, 3))
+    assert(list(data) == ['fitness'])
+    assert(data['fitness'].tolist() == [20.0, 21.0, 22.0, 23.0, 30.0, 31.0, 32.0, 33.0])
+
+    stats = store.columns(['n_species', 'mean'], kind='generations')
+    assert(sorted(stats) == ['mean', 'n_species'])
+    assert(np.allclose(stats['mean'], [10.0 * g + 1.5 for g in range(6)]))
+    assert(store.columns(['species'], generations=(10, 20))['species'].dtype == np.int64)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import tracemalloc
+
+
+# Subsystems and the modules whose allocations are charged to them.
+# An allocation belongs to the innermost frame of these modules, so
+# numpy arrays are charged to the code that created them.
+SUBSYSTEMS = {'genomes': ['neat.py', 'species.py'],
+              'networks': ['compiled.py', 'network.py', 'activation.py'],
+              'agents': ['agent.py', 'populations.py'],
+              'grids': ['armagetron.py', 'worker_pool.py', 'remote.py'],
+              'novelty': ['novelty.py'],
+              'caches': ['evaluation.py'],
+              'records': ['history.py', 'checkpoint.py', 'stopping.py']}
+
+
+def resident_memory():
+    """Returns the process' resident set size in bytes, or None where
+    /proc is not available"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def allocation_peak(func, *args, **kargs):
+    """Measures the most memory a call held at once beyond what was
+    allocated before it. Memory which is reused, rather than allocated
+    by the call, does not count. Temporaries which are freed again
+    only show as the largest of them, tracemalloc cannot count them,
+    so whether a call allocates buffers is best seen by comparing
+    peaks at different input sizes.
+
+    :func: The function to call
+    :*args: Arguments for the function
+    :**kargs: Additional arguments for the function
+    :returns: The peak in bytes
+
+    """
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        func(*args, **kargs)
+        return tracemalloc.get_traced_memory()[1] - before
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+
+
+class Memory_Accountant():
+
+    """Attributes the memory allocated by Python to subsystems using
+    tracemalloc. Tracing slows the whole process down, so it is only
+    enabled on request."""
+
+    def __init__(self, subsystems=None, frames=16):
+        """Starts tracing allocations
+
+        :subsystems: A dict of subsystem name to module filenames,
+        SUBSYSTEMS by default
+        :frames: The number of frames stored per allocation
+
+        """
+        self.subsystems = subsystems or SUBSYSTEMS
+        self.modules = {module: name for name, modules in self.subsystems.items()
+                        for module in modules}
+        self.frames = frames
+        self.started = False
+        self.reports = []
+        self.start()
+
+    def start(self):
+        """Starts tracing, unless allocations are already traced"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self.started = True
+
+    def stop(self):
+        """Stops tracing if this accountant started it"""
+        if self.started and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.started = False
+
+    def measure(self):
+        """Sums the live allocations of every subsystem
+
+        :returns: A dict of subsystem name to bytes, with 'other' for
+        allocations outside the subsystems, 'traced' for the total and
+        'rss' for the resident set size
+
+        """
+        usage = dict.fromkeys(self.subsystems, 0)
+        usage['other'] = 0
+        owners = {}
+
+        snapshot = tracemalloc.take_snapshot()
+        for trace in snapshot.traces:
+            owner = 'other'
+            # Frames are ordered from the oldest to the most recent
+            for frame in reversed(trace.traceback):
+                filename = frame.filename
+                if filename not in owners:
+                    owners[filename] = self.modules.get(os.path.basename(filename))
+                if owners[filename] is not None:
+                    owner = owners[filename]
+                    break
+            usage[owner] += trace.size
+
+        usage['traced'] = tracemalloc.get_traced_memory()[0]
+        usage['rss'] = resident_memory()
+        return usage
+
+    def report(self, generation):
+        """Measures and prints the memory used after a generation
+
+        :generation: The generation number
+        :returns: The measured usage, see measure
+
+        """
+        usage = self.measure()
+        self.reports.append((generation, usage))
+        parts = ['%s %.1fMB' % (name, usage[name] / 2**20)
+                 for name in list(self.subsystems) + ['other']]
+        rss = ', rss %.1fMB' % (usage['rss'] / 2**20) if usage['rss'] else ''
+        print('\tMemory: %s, traced %.1fMB%s' % (', '.join(parts), usage['traced'] / 2**20, rss))
+        return usage
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import gc
+import tracemalloc
+import weakref
+
+from memory import allocation_peak, SUBSYSTEMS
+
+
+def test_agents_are_freed_without_collector(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    from armagetron import Simulation
+
+    sim = Simulation(20, 5, render=False, seed=3)
+    refs = [weakref.ref(agent) for agent in sim.population.current_population]
+    gc.collect()
+    gc.disable()
+    try:
+        sim.simulate(1)
+        assert(all(agent.grid is None and agent.sensor is None
+                   for agent in sim.population.current_population))
+        sim.simulate(3)
+        assert(all(ref() is None for ref in refs))
+    finally:
+        gc.enable()
+
+
+def test_memory_report(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    from armagetron import Simulation
+
+    sim = Simulation(10, 5, render=False, seed=4, memory_report=True)
+    result = sim.simulate(1)
+    assert(set(SUBSYSTEMS) <= set(result.memory))
+    assert(result.memory['traced'] > 0)
+    assert(sum(result.memory[name] for name in SUBSYSTEMS) > 0)
+    assert(sim.memory.reports[-1] == (0, result.memory))
+    # Tracing stops with the run and resumes with the next one
+    assert(not tracemalloc.is_tracing())
+    assert(sim.simulate(1).memory['traced'] > 0)
+    assert(not tracemalloc.is_tracing())
+
+
+def test_steady_state_ticks_reuse_buffers(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    from armagetron import Simulation
+
+    for backend in ('mlp', 'neat'):
+        sim = Simulation(40, 40, render=False, seed=5, backend=backend)
+        agents = sim.population.current_population
+        grid = sim.build_grid(agents, 0, 0, 0)
+        grid.simulate(2)
+        sensors = grid.sensors
+        assert(all(agent.sensor.base is sensors for agent in grid.active_agents))
+
+        # Compiled networks compute in the arena's per slot buffers
+        if backend == 'neat':
+            for i, agent in enumerate(grid.my_agents):
+                assert(agent.workspace[0].base is grid.workspaces[i])
+
+        # Resetting the arena reuses its buffers
+        grid.release()
+        cells = grid.grid
+        assert(sim.build_grid(agents, 1, 0, 0, arena=grid) is grid)
+        assert(grid.grid is cells and grid.sensors is sensors)
+        if backend == 'neat':
+            assert(all(agent.workspace[0].base is buffer
+                       for agent, buffer in zip(agents, grid.workspaces)))
+        assert(not grid.grid.any() and grid.iteration == 0)
+
+
+def test_steady_state_ticks_allocate_nothing(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    from armagetron import Simulation
+
+    # A tick's Python temporaries cost the same whatever the number
+    # of agents, every buffer or list allocated would grow with it
+    for backend in ('mlp', 'neat'):
+        peaks = []
+        for n in (10, 300):
+            sim = Simulation(n, n, render=False, seed=5, backend=backend)
+            grid = sim.build_grid(sim.population.current_population, 0, 0, 0)
+            grid.simulate(2)
+            assert(len(grid.active_agents) > n // 2)
+            peaks.append(min(allocation_peak(grid.step) for _ in range(3)))
+        assert(abs(peaks[1] - peaks[0]) < 1000)
+
+    # Lifetimes are summed in the same buffer every generation
+    sim.simulate(1)
+    totals = sim.totals
+    sim.simulate(1)
+    assert(sim.totals is totals)
+
+
+def test_networks_allocate_no_buffers():
+    import numpy as np
+    from activation import activation_code
+    from neat import NEAT_Pool, NEAT_Network
+    from network import MLP_NN, MLP_Stack
+
+    rng = np.random.default_rng(6)
+    pool = NEAT_Pool((5, 5), 3)
+    net = NEAT_Network(pool.starting_genome, pool)
+    for _ in range(6):
+        net.innovate_node(rng)
+        net.innovate_edge(rng)
+    codes = [activation_code(name) for name in ('sigmoid', 'tanh', 'relu', 'step', 'identity')]
+    labels = sorted({gene.out_node.label for gene in net.genome.values()})
+    for i, label in enumerate(labels):
+        net.set_activation(label, codes[i % len(codes)])
+
+    # Python objects cost the same whatever the batch size, every
+    # numpy buffer allocated would grow with it
+    inputs = rng.random((400, 25)) * 255
+    for precision in ('float64', 'float32', 'int8'):
+        network = net.reduced(precision)
+        peaks = []
+        for batch in (1, 400):
+            workspace = network.workspace(batch)
+            network.predict(inputs[:batch], workspace)
+            peaks.append(allocation_peak(network.predict, inputs[:batch], workspace))
+        assert(abs(peaks[1] - peaks[0]) < 1000)
+        assert(np.array_equal(network.predict(inputs), network.predict(inputs, workspace)))
+
+    sensors = (rng.random((400, 121)) < 0.5).astype(np.uint8) * 255
+    networks = [MLP_NN(121, 8, 3, rng) for _ in range(400)]
+    for precision in ('float64', 'float32'):
+        peaks = []
+        for n in (1, 400):
+            stack = MLP_Stack(networks[:n], precision)
+            out = np.empty((n, 3), dtype=stack.dtype)
+            stack.predict(sensors[:n], out=out)
+            peaks.append(allocation_peak(stack.predict, sensors[:n], out=out))
+        assert(abs(peaks[1] - peaks[0]) < 1000)
+
+    # int8 stacks hold networks of both kinds, whose einsums each
+    # cast through a fixed size buffer
+    peaks = []
+    for n in (50, 400):
+        stack = MLP_Stack(networks[:n], 'int8')
+        assert(0 < stack.n_quantized < n)
+        out = np.empty((n, 3), dtype=stack.dtype)
+        stack.predict(sensors[:n], out=out)
+        peaks.append(allocation_peak(stack.predict, sensors[:n], out=out))
+    assert(abs(peaks[1] - peaks[0]) < 1000)
+
+
+def test_cache_counts_reduced_networks():
+    from compiled import Network_Cache
+    from neat import NEAT_Pool, NEAT_Network
+
+    pool = NEAT_Pool((3, 3), 3)
+    net = NEAT_Network(pool.starting_genome, pool)
+    full = Network_Cache().get(net.key, net.compile)
+    float32 = full.reduced('float32')
+
+    # Reduced networks are entries of their own, evicted before the
+    # cache outgrows its bound
+    cache = Network_Cache(full.nbytes + float32.nbytes - 1)
+    assert(cache.get(net.key, net.compile).nbytes == full.nbytes)
+    assert(cache.get(net.key, net.compile, 'float32').dtype == float32.dtype)
+    assert(cache.nbytes == float32.nbytes and cache.evictions == 1)
+    assert(list(cache.networks) == [(net.key, 'float32')])
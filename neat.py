@@ -2,12 +2,15 @@
 # -*- coding: utf-8 -*-
 
 
-import random
+import weakref
+from threading import Lock
 
-import networkx as nx
-from networkx.algorithms.shortest_paths import has_path
+import numpy as np
 
-from activation import sigmoid
+from activation import ACTIVATIONS, DEFAULT, FUNCTIONS
+from compiled import compile_genome, network_cache, save_network
+from precision import check_precision
+from streams import default_rng
 
 
 class Node():
@@ -25,6 +28,179 @@ class Node():
         self.label = label
 
 
+class Gene():
+
+    """An immutable connection gene. Genes are interned by a
+    Gene_Store so that genomes can share records instead of
+    holding private copies"""
+
+    __slots__ = ('in_node', 'out_node', 'weight', 'enabled',
+                 'innovation', 'refs', 'serial')
+
+    _fields = {'in': 'in_node',
+               'out': 'out_node',
+               'weight': 'weight',
+               'enabled': 'enabled',
+               'innovation': 'innovation'}
+
+    def __init__(self, in_node, out_node, weight, enabled, innovation, serial=0):
+        """Initializes a gene
+
+        :in_node: Node to read values from
+        :out_node: Node to write values to
+        :weight: The connection weight
+        :enabled: Whether the connection is expressed
+        :innovation: The gene's innovation number
+        :serial: A number identifying the gene within its store
+
+        """
+        object.__setattr__(self, 'in_node', in_node)
+        object.__setattr__(self, 'out_node', out_node)
+        object.__setattr__(self, 'weight', weight)
+        object.__setattr__(self, 'enabled', enabled)
+        object.__setattr__(self, 'innovation', innovation)
+        object.__setattr__(self, 'refs', 0)
+        object.__setattr__(self, 'serial', serial)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Genes are immutable, use Gene_Store.intern')
+
+    def __getitem__(self, key):
+        """Allows genes to be read like the old gene dicts,
+        i.e. gene['weight']
+
+        """
+        return getattr(self, Gene._fields[key])
+
+    def __repr__(self):
+        return 'Gene(%d: %s->%s, w=%f, %s)' % (self.innovation,
+                                               self.in_node.label,
+                                               self.out_node.label,
+                                               self.weight,
+                                               'on' if self.enabled else 'off')
+
+    @property
+    def key(self):
+        """The identity of a gene. The innovation number already
+        determines the connected nodes"""
+        return (self.innovation, self.weight, self.enabled)
+
+
+class Gene_Store():
+
+    """An interning table of genes. Every distinct gene exists once
+    and is shared by every genome carrying it. Genomes acquire and
+    release references so extinct genes are dropped from the table"""
+
+    def __init__(self):
+        """Initializes an empty store"""
+        self.genes = {}
+        self.lock = Lock()
+        self.next_serial = 0
+        # Genomes of networks which were freed without being released,
+        # their references are dropped the next time the lock is held
+        self.pending = []
+
+    def __len__(self):
+        with self.lock:
+            self.__drain__()
+            return len(self.genes)
+
+    def defer_release(self, genome):
+        """Queues a genome's genes for release. Finalizers call this,
+        they may run while the lock is held by the same thread.
+
+        :genome: A dict of innovation number to gene
+
+        """
+        self.pending.append(genome)
+
+    def __drain__(self):
+        """Releases queued genomes, the lock must be held"""
+        while self.pending:
+            for gene in self.pending.pop().values():
+                self.__drop__(gene)
+
+    def __drop__(self, gene):
+        refs = gene.refs - 1
+        object.__setattr__(gene, 'refs', refs)
+        if refs <= 0 and self.genes.get(gene.key) is gene:
+            del self.genes[gene.key]
+
+    def __contains__(self, gene):
+        return self.genes.get(gene.key) is gene
+
+    def intern(self, in_node, out_node, weight, enabled, innovation):
+        """Returns the shared gene with the given values,
+        creating it if it does not exist yet
+
+        :returns: A Gene
+
+        """
+        key = (innovation, weight, enabled)
+        with self.lock:
+            self.__drain__()
+            gene = self.genes.get(key)
+            if gene is None:
+                gene = Gene(in_node, out_node, weight, enabled, innovation,
+                            self.next_serial)
+                self.next_serial += 1
+                self.genes[key] = gene
+            return gene
+
+    def replace(self, gene, weight=None, enabled=None):
+        """Copy-on-write update of a gene
+
+        :gene: The original gene, which is left untouched
+        :weight: The new weight, or None to keep the original
+        :enabled: The new enabled flag, or None to keep the original
+        :returns: The interned gene with the changes applied
+
+        """
+        weight = gene.weight if weight is None else weight
+        enabled = gene.enabled if enabled is None else enabled
+        if weight == gene.weight and enabled == gene.enabled:
+            return gene
+        return self.intern(gene.in_node, gene.out_node,
+                           weight, enabled, gene.innovation)
+
+    def acquire(self, genes):
+        """Adds a reference to every gene
+
+        :genes: An iterable of genes
+
+        """
+        with self.lock:
+            self.__drain__()
+            for gene in genes:
+                object.__setattr__(gene, 'refs', gene.refs + 1)
+
+    def release(self, genes):
+        """Drops a reference to every gene, genes which are no
+        longer referenced are removed from the store
+
+        :genes: An iterable of genes
+
+        """
+        with self.lock:
+            self.__drain__()
+            for gene in genes:
+                self.__drop__(gene)
+
+    def collect(self):
+        """Removes interned genes which were never acquired
+
+        :returns: The number of genes removed
+
+        """
+        with self.lock:
+            self.__drain__()
+            dead = [key for key, gene in self.genes.items() if gene.refs <= 0]
+            for key in dead:
+                del self.genes[key]
+        return len(dead)
+
+
 class NEAT_Pool():
 
     """A class which holds a pool of genomes"""
@@ -32,6 +208,7 @@ class NEAT_Pool():
     def __init__(self, input_dims, output_dim):
         """Initializes a Pool"""
         self.innovation_number = 0
+        self.genes = Gene_Store()
 
         self.nodes = {}
         self.node_num = 0
@@ -64,6 +241,8 @@ class NEAT_Pool():
                 initial_genome[edge['innovation']] = edge
 
         self.starting_genome = initial_genome
+        # The pool keeps the starting genes alive for new agents
+        self.genes.acquire(initial_genome.values())
 
     def new_hidden_node(self):
         self.node_num += 1
@@ -89,144 +268,346 @@ class NEAT_Network():
 
     """An instance of a genome"""
 
-    def __init__(self, genome, pool_ref):
+    def __init__(self, genome, pool_ref, activations=None):
         """Initializes a network with the desired
-        genome
+        genome. Gene records are shared with the genome
+        passed in, never copied.
 
         :genome: The genome to construct the network
+        :activations: The activation genes, a dict of node label
+        to activation code. Nodes without one use the default.
 
         """
 
-        self.genome = genome
-        self.network = nx.DiGraph()
+        self.genome = dict(genome)
+        self.activations = {label: code for label, code in (activations or {}).items()
+                            if code != DEFAULT}
         self.pool = pool_ref
-        self.__load_genome__(genome)
+        self.released = False
+        self._network = None
+        self._key = None
+        self._arrays = None
+        self._compiled = None
+        self.pool.genes.acquire(self.genome.values())
+        # A network dropped without release hands its genes back to the
+        # store, which releases them later: the collector may free it
+        # while this thread holds the store's lock
+        self._finalizer = weakref.finalize(self, self.pool.genes.defer_release, self.genome)
+
+    @property
+    def network(self):
+        """The networkx graph of the genome, built on first use"""
+        if self._network is None:
+            # networkx is only needed for inspecting genomes
+            import networkx as nx
+            self._network = nx.DiGraph()
+            self.__load_genome__(self.genome)
+        return self._network
 
     def __load_genome__(self, genome):
         for node in self.pool.input_nodes:
-            self.network.add_node(node)
+            self._network.add_node(node)
         for innov, gene in genome.items():
             if gene['enabled']:
                 if gene['in'] not in self.pool.nodes:
-                    self.network.add_node(gene['in'], value=0.0)
+                    self._network.add_node(gene['in'], value=0.0)
                 if gene['out'] not in self.pool.nodes:
-                    self.network.add_node(gene['out'], value=0.0)
-                self.network.add_edge(gene['in'],
-                                      gene['out'],
-                                      weight=gene['weight'],
-                                      enabled=gene['enabled'],
-                                      innovation=gene['innovation'])
+                    self._network.add_node(gene['out'], value=0.0)
+                self._network.add_edge(gene['in'],
+                                       gene['out'],
+                                       weight=gene['weight'],
+                                       enabled=gene['enabled'],
+                                       innovation=gene['innovation'])
+        for label, code in self.activations.items():
+            node = self.pool.nodes[label]
+            if node in self._network:
+                self._network.nodes[node]['activation'] = code
+
+    def release(self):
+        """Releases this network's references on the pool's genes.
+        Safe to call more than once.
+
+        """
+        if self.released:
+            return
+        self.released = True
+        self._finalizer.detach()
+        self.pool.genes.release(self.genome.values())
+        self._network = None
+        self._compiled = None
+
+    def drop_caches(self):
+        """Drops the graph and this network's reference to its
+        compiled evaluator, they are rebuilt when needed"""
+        self._network = None
+        self._compiled = None
+
+    def set_gene(self, gene):
+        """Places a gene in the genome, replacing any gene
+        with the same innovation number
+
+        :gene: An interned gene
+
+        """
+        self.pool.genes.acquire([gene])
+        old = self.genome.get(gene.innovation)
+        self.genome[gene.innovation] = gene
+        if old is not None:
+            self.pool.genes.release([old])
+        self._network = None
+        self._key = None
+        self._arrays = None
+        self._compiled = None
+
+    def set_activation(self, label, code):
+        """Sets the activation gene of a node
+
+        :label: The node's label
+        :code: The activation code, see activation.ACTIVATIONS
+
+        """
+        if code == DEFAULT:
+            self.activations.pop(label, None)
+        else:
+            self.activations[label] = code
+        self._network = None
+        self._key = None
+        self._compiled = None
+
+    @property
+    def key(self):
+        """A hash of the genome's structure and weights. Networks
+        with identical genomes share the same key"""
+        if self._key is None:
+            self._key = genome_hash(self.genome,
+                                    len(self.pool.input_nodes),
+                                    len(self.pool.output_nodes),
+                                    self.activations)
+        return self._key
+
+    @property
+    def compiled(self):
+        """The genome's Compiled_Network, shared through the process
+        wide cache with every network of identical genome"""
+        if self._compiled is None:
+            self._compiled = network_cache.get(self.key, self.compile)
+        return self._compiled
+
+    def compile(self):
+        """Compiles the genome without consulting the cache
+
+        :returns: A Compiled_Network
+
+        """
+        return compile_genome(self.genome,
+                              [node.label for node in self.pool.input_nodes],
+                              [node.label for node in self.pool.output_nodes],
+                              self.activations)
+
+    def export(self, path, spec=None):
+        """Exports the network as a standalone .npz file, see
+        compiled.load_network
+
+        :path: The filename
+        :spec: A dict describing the inputs and outputs
+
+        """
+        save_network(self.compiled, path, spec)
+
+    def genome_arrays(self):
+        """Returns the genome as arrays sorted by innovation number
+
+        :returns: A tuple of (innovations, weights)
+
+        """
+        return self.gene_arrays()[:2]
+
+    def gene_arrays(self):
+        """Returns every gene field as arrays sorted by innovation number
+
+        :returns: A tuple of (innovations, weights, enabled)
+
+        """
+        if self._arrays is None:
+            order = sorted(self.genome)
+            genes = [self.genome[i] for i in order]
+            innovations = np.array(order, dtype=np.int64)
+            weights = np.array([gene.weight for gene in genes],
+                               dtype=np.float64)
+            enabled = np.array([gene.enabled for gene in genes], dtype=bool)
+            self._arrays = (innovations, weights, enabled)
+        return self._arrays
+
+    def complexity(self):
+        """Returns the number of expressed connections"""
+        return sum(1 for gene in self.genome.values() if gene.enabled)
 
     def __add__(self, other):
         """Overrides the '+' operator for easy crossover
 
         :other: The other network
-        :returns: TODO
+        :returns: A new mutated network
+
+        """
+        return self.crossover(other)
+
+    def crossover(self, other, rng=None):
+        """Crosses this network over with another one and
+        mutates the offspring
+
+        :other: The other network
+        :rng: The numpy Generator to draw from, a shared
+        unseeded one is used if None
+        :returns: A new mutated network
 
         """
         if type(other) is not NEAT_Network:
             raise TypeError('You can only add Networks to other Networks')
+        rng = default_rng if rng is None else rng
 
+        store = self.pool.genes
         new_genome = {}
 
-        for i in range(self.pool.innovation_number):
-            left_gene = self.genome[i] if i in self.genome else None
-            right_gene = other.genome[i] if i in other.genome else None
+        for i in sorted(self.genome.keys() | other.genome.keys()):
+            left_gene = self.genome.get(i)
+            right_gene = other.genome.get(i)
 
             if left_gene is not None and right_gene is not None:
                 # Randomly choose a gene
-                chosen_gene = random.choice([left_gene, right_gene])
-                new_genome[i] = chosen_gene.copy()
+                chosen_gene = (left_gene, right_gene)[rng.integers(2)]
             elif left_gene is not None:
                 # Either disjoint or excess gene
                 # Use this gene
-                new_genome[i] = left_gene.copy()
-            elif right_gene is not None:
-                new_genome[i] = right_gene.copy()
+                chosen_gene = left_gene
             else:
-                # Neither parent contains the gene for this innovation number
-                continue
+                chosen_gene = right_gene
 
-            if new_genome[i]['enabled']:
+            enabled = chosen_gene.enabled
+            if enabled:
                 # Random chance of disabling node
-                if random.uniform(0.0, 1.0) < 0.1:
-                    new_genome[i]['enabled'] = False
+                if rng.random() < 0.1:
+                    enabled = False
             else:
                 # Random chance of enabling node
-                if random.uniform(0.0, 1.0) < 0.25:
-                    new_genome[i]['enabled'] = True
+                if rng.random() < 0.25:
+                    enabled = True
 
             # Mutate weights
-            new_genome[i]['weight'] += random.randrange(-1, 1) * 0.1
+            weight = chosen_gene.weight + int(rng.integers(-1, 1)) * 0.1
+
+            # Only genes which actually changed are materialized
+            new_genome[i] = store.replace(chosen_gene, weight, enabled)
 
-        self.mutate()
+        # Activation genes are inherited like connection genes
+        activations = {}
+        for label in sorted(self.activations.keys() | other.activations.keys()):
+            left = self.activations.get(label, DEFAULT)
+            right = other.activations.get(label, DEFAULT)
+            activations[label] = left if left == right else (left, right)[rng.integers(2)]
 
-        return NEAT_Network(new_genome, self.pool)
+        child = NEAT_Network(new_genome, self.pool, activations)
+        child.mutate(rng)
 
-    def mutate(self):
+        return child
+
+    def mutate(self, rng=None):
         """Mutates the network
 
+        :rng: The numpy Generator to draw from
+
         """
-        chance = random.uniform(0.0, 1.0)
+        rng = default_rng if rng is None else rng
+        chance = rng.random()
         if chance < 0.03:
-            self.innovate_node()
-        chance = random.uniform(0.0, 1.0)
+            self.innovate_node(rng)
+        chance = rng.random()
         if chance < 0.3:
-            self.innovate_edge()
+            self.innovate_edge(rng)
+        chance = rng.random()
+        if chance < 0.05:
+            self.mutate_activation(rng)
 
-    def feedforward(self, data):
-        # Load data
-        output = []
+    def mutate_activation(self, rng=None):
+        """Gives a random hidden or output node a random
+        activation function
 
-        flat_data = data.flatten()
-        i = 0
-        for node in self.pool.input_nodes:
-            self.network.nodes[node]['value'] = flat_data[i]
-            i += 0
+        :rng: The numpy Generator to draw from
+
+        """
+        rng = default_rng if rng is None else rng
+        labels = sorted({gene.out_node.label for gene in self.genome.values()
+                         if gene.out_node.type != 'input'})
+        if not labels:
+            return
+        label = labels[rng.integers(len(labels))]
+        self.set_activation(label, int(rng.integers(len(ACTIVATIONS))))
 
-        # For each output node, sum the previous nodes in the graph
-        for node in self.pool.output_nodes:
-            output.append(get_weighted_sum(node, self.network))
+    def reduced(self, precision):
+        """Returns the compiled network with reduced precision weights,
+        see Compiled_Network.reduced. Variants are shared through the
+        process wide cache like the compiled network."""
+        if check_precision(precision) == 'float64':
+            return self.compiled
+        return network_cache.get(self.key, self.compile, precision)
 
-        return output
+    def predict(self, inputs):
+        """Evaluates a batch of inputs with the compiled network
+
+        :inputs: A 2D array, one flattened sensor array per row
+        :returns: A 2D array with one row of outputs per input
+
+        """
+        return self.compiled.predict(inputs)
 
-    def innovate_node(self):
+    def feedforward(self, data):
+        """Feeds data through the compiled network
+
+        :data: The sensor array, input i reads the i-th flattened value
+        :returns: A list of output values
+
+        """
+        return self.compiled.feedforward(data)
+
+    def innovate_node(self, rng=None):
+        rng = default_rng if rng is None else rng
         # Choose an edge to mutate
-        # desired_edge = random.choice(self.network.edges)
-        edges = [edge for edge in self.network.edges(data=True)]
-        desired_edge = random.choice(edges)
+        edges = [gene for gene in self.genome.values() if gene.enabled]
+        if not edges:
+            return
+        desired_edge = edges[rng.integers(len(edges))]
 
         # Ask pool to generate a hidden node
         new_node = self.pool.new_hidden_node()
 
         # Create connections
-        gene1 = self.pool.new_gene(desired_edge[0], new_node)
-        gene2 = self.pool.new_gene(new_node, desired_edge[1])
-        
-        gene2['weight'] = desired_edge[2]['weight']
+        gene1 = self.pool.new_gene(desired_edge.in_node, new_node)
+        gene2 = self.pool.new_gene(new_node, desired_edge.out_node)
+        gene2 = self.pool.genes.replace(gene2, weight=desired_edge.weight)
 
-        self.genome[gene1['innovation']] = gene1
-        self.genome[gene2['innovation']] = gene2
+        self.set_gene(gene1)
+        self.set_gene(gene2)
 
         # Disable old edge
-        desired_edge[2]['enabled'] = False
+        self.set_gene(self.pool.genes.replace(desired_edge, enabled=False))
 
-    def innovate_edge(self):
+    def innovate_edge(self, rng=None):
         """Innovates a new edge connection
 
+        :rng: The numpy Generator to draw from
+
         """
+        rng = default_rng if rng is None else rng
         # Choose random node
-        choices = list(self.network.nodes)
-        node1 = random.choice(choices)
-        choices.remove(node1)
-        node2 = random.choice(choices)
+        choices, successors = self.__adjacency__()
+        node1 = choices.pop(rng.integers(len(choices)))
+        node2 = choices[rng.integers(len(choices))]
 
-        if has_path(self.network, node1, node2):
+        if has_path(successors, node1, node2):
             # There exists a path node1->node2
             # No not make a path from node2->node1
             src_node = node1
             dest_node = node2
-        elif has_path(self.network, node2, node1):
+        elif has_path(successors, node2, node1):
             # There exists a path node2->node1
             src_node = node2
             dest_node = node1
@@ -235,7 +616,41 @@ class NEAT_Network():
             return
 
         new_gene = self.pool.new_gene(src_node, dest_node)
-        self.genome[new_gene['innovation']] = new_gene
+        self.set_gene(new_gene)
+
+    def __adjacency__(self):
+        """Returns the nodes of the expressed network, in the order
+        the graph would list them, and the successors of every node"""
+        nodes = dict.fromkeys(self.pool.input_nodes)
+        successors = {}
+        for gene in self.genome.values():
+            if gene.enabled:
+                nodes[gene.in_node] = None
+                nodes[gene.out_node] = None
+                successors.setdefault(gene.in_node, []).append(gene.out_node)
+        return list(nodes), successors
+
+
+def has_path(successors, source, target):
+    """Checks whether a directed path leads from source to target
+
+    :successors: A dict of node to the nodes it connects to
+    :source: The node to start from
+    :target: The node to reach
+    :returns: True if target is reachable
+
+    """
+    seen = {source}
+    stack = [source]
+    while stack:
+        node = stack.pop()
+        if node is target:
+            return True
+        for nxt in successors.get(node, ()):
+            if nxt not in seen:
+                seen.add(nxt)
+                stack.append(nxt)
+    return False
 
 
 def get_weighted_sum(cur_node, network):
@@ -246,6 +661,8 @@ def get_weighted_sum(cur_node, network):
     :returns: The weighted sum (with activation function)
 
     """
+    import networkx as nx
+
     w_sum = 0.0
     try:
         for node in network.predecessors(cur_node):
@@ -254,13 +671,34 @@ def get_weighted_sum(cur_node, network):
         if network.in_degree(cur_node) == 0:
             w_sum = network.nodes[cur_node]['value']
         else:
-            w_sum = sigmoid(w_sum)
+            code = network.nodes[cur_node].get('activation', DEFAULT)
+            w_sum = float(FUNCTIONS[code](w_sum))
     except nx.exception.NetworkXError:
         w_sum = 0.0
     finally:
         return w_sum
 
 
+def genome_hash(genome, n_inputs, n_outputs, activations=None):
+    """Computes a canonical hash of a genome. It only depends on
+    the genes' values, so it is stable across processes.
+
+    :genome: A dict of genes
+    :n_inputs: The number of input nodes of the pool
+    :n_outputs: The number of output nodes of the pool
+    :activations: A dict of node label to non default activation code
+    :returns: An integer hash
+
+    """
+    return hash((n_inputs, n_outputs) +
+                tuple(sorted((activations or {}).items())) +
+                tuple((gene.innovation,
+                       gene.in_node.label,
+                       gene.out_node.label,
+                       gene.weight,
+                       gene.enabled) for _, gene in sorted(genome.items())))
+
+
 def create_connection(input_node, output_node, pool):
     """Creates a connection between two nodes
 
@@ -272,11 +710,10 @@ def create_connection(input_node, output_node, pool):
 
     pool.innovation_number += 1
 
-    edge = {}
-    edge['in'] = input_node
-    edge['out'] = output_node
-    edge['weight'] = 1.0
-    edge['enabled'] = True
-    edge['innovation'] = pool.innovation_number
+    edge = pool.genes.intern(input_node,
+                             output_node,
+                             1.0,
+                             True,
+                             pool.innovation_number)
 
     return edge
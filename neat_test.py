@@ -1,11 +1,18 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import gc
+import os
+import subprocess
+import sys
+
 import pytest
 import numpy as np
 import networkx as nx
 
-from neat import NEAT_Pool, NEAT_Network
+from activation import activation_code
+from neat import NEAT_Pool, NEAT_Network, get_weighted_sum
+from precision import argmax_agreement, probe_inputs
 
 def test_pool_creation():
     pool = NEAT_Pool(None, (5,5), 3)
@@ -20,3 +27,165 @@ def test_network_crossover():
     net2 = NEAT_Network(pool.starting_genome, pool)
 
     assert(net1 + net2 != net1)
+
+def test_offspring_share_genes():
+    pool = NEAT_Pool((2,2), 3)
+    net1 = NEAT_Network(pool.starting_genome, pool)
+    net2 = NEAT_Network(pool.starting_genome, pool)
+    child = net1 + net2
+
+    shared = [innov for innov, gene in child.genome.items()
+              if gene is pool.starting_genome.get(innov)]
+    assert(len(shared) > 0)
+    assert(all(gene in pool.genes for gene in child.genome.values()))
+
+def test_released_genes_leave_store():
+    pool = NEAT_Pool((2,2), 3)
+    base = len(pool.genes)
+    net = NEAT_Network(pool.starting_genome, pool)
+    gene = next(iter(net.genome.values()))
+    net.set_gene(pool.genes.replace(gene, weight=5.0))
+    assert(len(pool.genes) == base + 1)
+
+    net.release()
+    assert(len(pool.genes) == base)
+
+def test_dropped_networks_release_their_genes():
+    pool = NEAT_Pool((2,2), 3)
+    base = len(pool.genes)
+    net = NEAT_Network(pool.starting_genome, pool)
+    gene = next(iter(net.genome.values()))
+    net.set_gene(pool.genes.replace(gene, weight=5.0))
+
+    # The collector may free a network while its thread interns a
+    # gene, finalizing it must not wait on the store's lock
+    net.cycle = net
+    del net
+    with pool.genes.lock:
+        gc.collect()
+    assert(len(pool.genes) == base)
+
+def test_compiled_network_matches_graph():
+    rng = np.random.default_rng(3)
+    pool = NEAT_Pool((3,3), 3)
+    nets = [NEAT_Network(pool.starting_genome, pool) for _ in range(2)]
+    for _ in range(30):
+        left, right = rng.integers(len(nets), size=2)
+        nets.append(nets[left].crossover(nets[right], rng))
+
+    data = rng.random((3, 3))
+    for net in nets:
+        graph = net.network
+        for node, value in zip(pool.input_nodes, data.flatten()):
+            graph.nodes[node]['value'] = value
+        expected = [get_weighted_sum(node, graph) for node in pool.output_nodes]
+        assert(np.allclose(net.feedforward(data), expected))
+
+def test_identical_genomes_share_compiled_network():
+    pool = NEAT_Pool((2,2), 3)
+    net1 = NEAT_Network(pool.starting_genome, pool)
+    net2 = NEAT_Network(pool.starting_genome, pool)
+    assert(net1.key == net2.key)
+    assert(net1.compiled is net2.compiled)
+
+def test_activation_genes_are_compiled():
+    pool = NEAT_Pool((2,2), 3)
+    net = NEAT_Network(pool.starting_genome, pool)
+    before = net.key
+    for node in pool.output_nodes:
+        net.set_activation(node.label, activation_code('step'))
+    assert(net.key != before)
+
+    outputs = net.feedforward(np.random.default_rng(4).random((2, 2)))
+    assert(all(value in (0.0, 1.0) for value in outputs))
+
+    child = net + net
+    assert(child.activations)
+
+def test_exported_network_loads_without_pool(tmp_path):
+    rng = np.random.default_rng(5)
+    pool = NEAT_Pool((3,3), 3)
+    nets = [NEAT_Network(pool.starting_genome, pool) for _ in range(2)]
+    for _ in range(20):
+        left, right = rng.integers(len(nets), size=2)
+        nets.append(nets[left].crossover(nets[right], rng))
+    path = str(tmp_path / 'champion.npz')
+    nets[-1].export(path, {'sensor_radius': 1})
+
+    batch = rng.random((4, 3, 3))
+    np.save(str(tmp_path / 'batch.npy'), batch)
+    expected = nets[-1].compiled.predict(batch)
+
+    # The loader runs in a fresh interpreter without graph libraries
+    script = ('import sys, numpy as np, compiled;'
+              'net = compiled.load_network(sys.argv[1]);'
+              'assert net.spec == {"sensor_radius": 1};'
+              'assert "networkx" not in sys.modules;'
+              'np.save(sys.argv[2], net.predict(np.load(sys.argv[3])))')
+    subprocess.check_call([sys.executable, '-c', script, path,
+                           str(tmp_path / 'out.npy'), str(tmp_path / 'batch.npy')],
+                          cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert(np.allclose(np.load(str(tmp_path / 'out.npy')), expected))
+
+def test_reduced_precision_keeps_choices():
+    rng = np.random.default_rng(7)
+    pool = NEAT_Pool((3,3), 3)
+    nets = [NEAT_Network(pool.starting_genome, pool) for _ in range(2)]
+    for _ in range(20):
+        left, right = rng.integers(len(nets), size=2)
+        nets.append(nets[left].crossover(nets[right], rng))
+
+    probes = probe_inputs(9)
+    for net in nets:
+        reference = net.compiled.predict(probes)
+        float32 = net.reduced('float32')
+        assert(float32.dtype == np.float32)
+        assert(np.allclose(float32.predict(probes), reference, atol=1e-4))
+
+        # int8 networks are only used when every choice is kept
+        int8 = net.reduced('int8')
+        if int8.scales is None:
+            assert(int8.dtype == np.float32)
+        else:
+            assert(all(weights.dtype == np.int8 for _, _, weights, _ in int8.layers))
+            assert(int8.nbytes < float32.nbytes)
+        assert(argmax_agreement(reference, int8.predict(probes)) == 1.0)
+        assert(net.reduced('float64') is net.compiled)
+
+def test_compilation_simplifies_graph():
+    pool = NEAT_Pool((2,2), 3)
+    net = NEAT_Network(pool.starting_genome, pool)
+    inputs, outputs = pool.input_nodes, pool.output_nodes
+
+    def connect(src, dest, weight):
+        net.set_gene(pool.genes.replace(pool.new_gene(src, dest), weight=weight))
+
+    dead, constant, source, linear = [pool.new_hidden_node() for _ in range(4)]
+    # No output depends on the dead node
+    connect(inputs[0], dead, 1.0)
+    # No input reaches the constant node, it always computes sigmoid(0)
+    connect(source, constant, 1.0)
+    connect(constant, outputs[0], 2.0)
+    # The identity node is folded into the output
+    connect(inputs[1], linear, 0.5)
+    connect(linear, outputs[1], 3.0)
+    net.set_activation(linear.label, activation_code('identity'))
+    # Zero weights are skipped
+    gene = next(gene for gene in net.genome.values() if gene.in_node is inputs[2])
+    net.set_gene(pool.genes.replace(gene, weight=0.0))
+
+    compiled = net.compiled
+    assert(compiled.stats['connections'] == len(net.genome))
+    assert(compiled.stats['evaluated_nodes'] == len(outputs))
+    # The bias replaces the constant node, the folded chain merges
+    # into the direct connection of its input and output
+    assert(compiled.stats['evaluated_connections'] ==
+           len(pool.starting_genome) - 1 + 1)
+    assert(compiled.bias is not None)
+
+    data = np.random.default_rng(8).random((2, 2))
+    graph = net.network
+    for node, value in zip(inputs, data.flatten()):
+        graph.nodes[node]['value'] = value
+    expected = [get_weighted_sum(node, graph) for node in outputs]
+    assert(np.allclose(net.feedforward(data), expected))
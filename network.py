@@ -3,115 +3,302 @@
 
 import numpy as np
 
-def sigmoid(x):
-    return 1 / (1 + np.exp(-x))
-
-
-def dsigmoid(y):
-    return y * (1.0 - y)
+from activation import sigmoid
+from precision import argmax_agreement, check_precision, probe_inputs, quantize, weight_dtype
+from streams import default_rng
 
 
 class MLP_NN(object):
 
-    """Basic Neural Network"""
+    """Basic Neural Network with a fixed topology: one hidden layer
+    and a bias input. Evolution only changes its weights."""
 
-    def __init__(self, n, hidden, output):
+    def __init__(self, n, hidden, output, rng=None, wi=None, wo=None):
         """ Initializes a network
 
         :n: The number of input neurons
         :hidden: The number of hidden neurons
         :output: The number of output neurons
+        :rng: The numpy Generator random weights are drawn from
+        :wi: Input to hidden weights, random if None
+        :wo: Hidden to output weights, random if None
 
         """
         # Add 1 for bias node
         self.n = n + 1
         self.hidden = hidden
         self.output = output
-
-        # Set up array of 1s for activations
-        self.ai = [1.0] * self.n
-        self.ah = [1.0] * self.hidden
-        self.ao = [1.0] * self.output
+        self._key = None
+        self._quantized = None
 
         # Randomize weights
-        self.wi = np.random.rand(self.n, self.hidden)
-        self.wo = np.random.rand(self.hidden, self.output)
+        rng = default_rng if rng is None else rng
+        self.wi = rng.uniform(-1.0, 1.0, (self.n, self.hidden)) if wi is None else wi
+        self.wo = rng.uniform(-1.0, 1.0, (self.hidden, self.output)) if wo is None else wo
+
+    @property
+    def key(self):
+        """A hash of the network's weights, stable across processes"""
+        if self._key is None:
+            self._key = hash((self.n, self.hidden, self.output) +
+                             tuple(self.wi.ravel().tolist()) +
+                             tuple(self.wo.ravel().tolist()))
+        return self._key
+
+    def predict(self, inputs):
+        """Feeds a batch of inputs through the network
 
-        # Create zero-arrays for changes
-        self.ci = np.zeros((self.n, self.hidden))
-        self.co = np.zeros((self.hidden, self.output))
+        :inputs: A 2D array, one flattened input per row
+        :returns: A 2D array with one row of outputs per input
+
+        """
+        inputs = np.asarray(inputs, dtype=np.float64)
+        if inputs.shape[1] != self.n - 1:
+            raise ValueError('Feed input != neural input length: %d != %d' % \
+                    (inputs.shape[1], self.n - 1))
+
+        # The bias input is folded into its weight row
+        hidden = sigmoid(inputs @ self.wi[:-1] + self.wi[-1])
+        return sigmoid(hidden @ self.wo)
 
     def feedforward(self, inputs):
-        """Feeds input through the network
+        """Feeds a single input through the network
 
-        :inputs: TODO
-        :returns: TODO
+        :inputs: An array of any shape, it is flattened
+        :returns: A list of output values
 
         """
-        if len(inputs) != self.n - 1:
-            raise ValueError('Feed input != neural input length: %d != %d' % (len(inputs), self.n))
-
-        for i in range(self.n - 1):
-            self.ai[i] = inputs[i]
-
-        # hidden activations
-        for j in range(self.hidden):
-            net_sum = 0.0
-            for i in range(self.n):
-                net_sum += self.ai[i] * self.wi[i][j]
-            self.ah[j] = sigmoid(net_sum)
-
-        # output activation
-        for k in range(self.output):
-            net_sum = 0.0
-            for j in range(self.hidden):
-                net_sum += self.ah[j] * self.wo[j][k]
-            self.ao[k] = sigmoid(net_sum)
-
-        return self.ao[:]
-
-    @staticmethod
-    def crossover(nn0, nn1):
+        return self.predict(np.reshape(inputs, (1, -1)))[0].tolist()
+
+    def crossover(self, other, rng=None):
         """Performs genetic cross over on the weights
-        within the network
+        within the network. Every weight is taken from either
+        parent with equal chance, the child is then mutated.
 
-        :nn0: First parent's network
-        :nn1: Second parent's network
-        :returns: A new network with 50% crossover
+        :other: The second parent's network
+        :rng: The numpy Generator to draw from
+        :returns: A new network
 
         """
-        if nn0.n != nn1.n or \
-           nn0.hidden != nn1.hidden or \
-           nn0.output != nn1.output:
+        if self.n != other.n or \
+           self.hidden != other.hidden or \
+           self.output != other.output:
                raise ValueError('Crossover networks must have same dimensions')
 
-        child_network = MLP_NN(nn0.n - 1, nn0.hidden, nn0.output)
+        rng = default_rng if rng is None else rng
+        wi = np.where(rng.random(self.wi.shape) < 0.5, self.wi, other.wi)
+        wo = np.where(rng.random(self.wo.shape) < 0.5, self.wo, other.wo)
+
+        child = MLP_NN(self.n - 1, self.hidden, self.output, wi=wi, wo=wo)
+        child.mutate(rng)
+        return child
+
+    def __add__(self, other):
+        return self.crossover(other)
+
+    def mutate(self, rng=None, scale=0.05):
+        """Perturbs every weight by uniform noise
+
+        :rng: The numpy Generator to draw from
+        :scale: The largest change of a weight
+
+        """
+        rng = default_rng if rng is None else rng
+        self.wi = self.wi + rng.uniform(-scale, scale, self.wi.shape)
+        self.wo = self.wo + rng.uniform(-scale, scale, self.wo.shape)
+        self._key = None
+        self._quantized = None
+
+    def quantized(self):
+        """Returns the network's weights quantized to int8, if the
+        quantized network picks the same output on every pattern of
+        the probe bank
+
+        :returns: A tuple of (wi, wi scales, wo, wo scales), or None
+
+        """
+        if self._quantized is None:
+            wi, wi_scales = quantize(self.wi)
+            wo, wo_scales = quantize(self.wo)
+            probes = probe_inputs(self.n - 1)
+            # Checked the way MLP_Stacks evaluate them, with the
+            # scales applied to the sums
+            hidden = sigmoid((probes @ wi[:-1] + wi[-1]) * wi_scales)
+            outputs = sigmoid((hidden @ wo) * wo_scales)
+            agrees = argmax_agreement(self.predict(probes), outputs) == 1.0
+            self._quantized = (wi, wi_scales, wo, wo_scales) if agrees else False
+        return self._quantized or None
+
+    def reduced(self, precision):
+        """Single networks are evaluated in float64, reduced precision
+        only applies to MLP_Stacks"""
+        check_precision(precision)
+        return self
 
-        input_mask = np.random.randint(0,1,size=nn0.wi.shape)
-        output_mask = np.random.randint(0,1,size=nn0.wo.shape)
+    def complexity(self):
+        """Returns the number of connections"""
+        return self.wi.size + self.wo.size
 
-        result_ih = np.zeros(nn0.wi.shape)
-        result_ho = np.zeros(nn0.wo.shape)
+    def release(self):
+        """Networks do not hold pooled resources"""
+        pass
 
-        for x in range(input_mask.shape[0]):
-            for y in range(input_mask.shape[1]):
-                # Perform crossover
-                result_ih[x][y] = nn0.wi[x][y] if input_mask[x][y] else nn1.wi[x][y]
+    def drop_caches(self):
+        """Networks do not cache evaluators"""
+        pass
 
-        # Mutate
-        w, h = result_ih.shape
-        result_ih = np.add(result_ih, ((np.random.rand(w,h) * 2) - 1) * 0.05)
 
-        for x in range(output_mask.shape[0]):
-            for y in range(output_mask.shape[1]):
-                w, h = result_ho.shape
-                # Perform crossover
-                result_ho[x][y] = nn0.wo[x][y] if output_mask[x][y] else nn1.wo[x][y]
-        # Mutate
-        w, h = result_ho.shape
-        result_ho = np.add(result_ho, ((np.random.rand(w,h) * 2) - 1) * 0.05)
+class MLP_Stack():
+
+    """The weights of many same sized MLP_NNs stacked together, so
+    a whole population is evaluated with one einsum per layer"""
+
+    def __init__(self, networks, precision='float64'):
+        """Stacks networks
+
+        :networks: A list of MLP_NNs with identical dimensions
+        :precision: One of precision.PRECISIONS. With 'int8' every
+        network which passes its probe check keeps its weights as int8
+        and their scales are applied to the sums, the others are
+        stacked apart with their float32 weights.
+
+        """
+        self.precision = check_precision(precision)
+        self.dtype = weight_dtype(precision)
+        self.size = 0
+        # The weights of networks evaluated in the stack's dtype, of
+        # every network unless the stack is int8
+        self.wi = None
+        self.wo = None
+        # The hidden biases, contiguous and in the stack's dtype, so
+        # adding them never makes numpy buffer a strided or cast operand
+        self.bi = None
+        # The int8 weights, their hidden biases and the scales of every
+        # hidden and output node
+        self.qi = None
+        self.qo = None
+        self.qbi = None
+        self.qi_scales = None
+        self.qo_scales = None
+        # A tuple of (rows, weights, scales, hidden values) for the
+        # networks of either kind, rows is None if the kind is alone
+        self.groups = []
+        # Arrays by name, only reallocated when they are too small
+        self.buffers = {}
+        # The number of stacked networks whose weights are quantized
+        self.n_quantized = 0
+        self.load(networks)
+
+    def __len__(self):
+        return self.size
+
+    def __reserve__(self, name, rows, shape, dtype):
+        """Returns the first rows of a buffer, which is reused when it
+        has enough rows and the same dimensions and dtype"""
+        array = self.buffers.get(name)
+        if array is None or len(array) < rows or array.shape[1:] != shape or \
+           array.dtype != dtype:
+            array = np.empty((rows,) + shape, dtype=dtype)
+            self.buffers[name] = array
+        return array[:rows]
+
+    def load(self, networks):
+        """Replaces the stacked networks. The arrays are reused when
+        the number and dimensions of the networks did not change.
+
+        :networks: A list of MLP_NNs with identical dimensions
+
+        """
+        shapes = {(network.n, network.hidden, network.output) for network in networks}
+        if len(shapes) != 1:
+            raise ValueError('Stacked networks must have same dimensions')
+        self.n, self.hidden, self.output = shapes.pop()
+        self.size = len(networks)
+
+        quantized = [network.quantized() if self.precision == 'int8' else None
+                     for network in networks]
+        rows = [i for i, weights in enumerate(quantized) if weights is None]
+        quantized_rows = [i for i, weights in enumerate(quantized) if weights is not None]
+        self.n_quantized = len(quantized_rows)
+        self.groups = []
+
+        self.wi = self.__reserve__('wi', len(rows), (self.n, self.hidden), self.dtype)
+        self.wo = self.__reserve__('wo', len(rows), (self.hidden, self.output), self.dtype)
+        self.bi = self.__reserve__('bi', len(rows), (self.hidden,), self.dtype)
+        for row, i in enumerate(rows):
+            self.wi[row] = networks[i].wi
+            self.wo[row] = networks[i].wo
+            self.bi[row] = self.wi[row, -1]
+        if rows:
+            self.groups.append((rows, (self.wi, self.bi, self.wo), None,
+                                self.__reserve__('hidden', len(rows), (self.hidden,), self.dtype)))
+
+        self.qi = self.__reserve__('qi', len(quantized_rows), (self.n, self.hidden), np.int8)
+        self.qo = self.__reserve__('qo', len(quantized_rows), (self.hidden, self.output), np.int8)
+        self.qbi = self.__reserve__('qbi', len(quantized_rows), (self.hidden,), self.dtype)
+        self.qi_scales = self.__reserve__('qi_scales', len(quantized_rows), (self.hidden,), self.dtype)
+        self.qo_scales = self.__reserve__('qo_scales', len(quantized_rows), (self.output,), self.dtype)
+        for row, i in enumerate(quantized_rows):
+            self.qi[row], self.qi_scales[row], self.qo[row], self.qo_scales[row] = quantized[i]
+            self.qbi[row] = self.qi[row, -1]
+        if quantized_rows:
+            self.groups.append((quantized_rows, (self.qi, self.qbi, self.qo),
+                                (self.qi_scales, self.qo_scales),
+                                self.__reserve__('quantized hidden', len(quantized_rows),
+                                                 (self.hidden,), self.dtype)))
+
+        # Networks of a kind which is alone are fed the inputs as is
+        if len(self.groups) == 1:
+            _, weights, scales, hidden = self.groups[0]
+            self.groups[0] = (None, weights, scales, hidden)
+        else:
+            self.groups = [(np.array(rows, dtype=np.intp), weights, scales, hidden)
+                           for rows, weights, scales, hidden in self.groups]
+
+    def predict(self, inputs, out=None):
+        """Feeds one input through every network
+
+        :inputs: A 2D array, row i is fed to network i
+        :out: An array of shape (len(self), outputs) and the stack's
+        dtype the outputs are written to. With it, nothing is allocated.
+        :returns: A 2D array, row i holds the outputs of network i
+
+        """
+        inputs = np.asarray(inputs)
+        temporary = out is None
+        if temporary:
+            out = np.empty((len(self), self.output), dtype=self.dtype)
 
-        child_network.wi = result_ih
-        child_network.wo = result_ho
+        for i, (rows, weights, scales, hidden) in enumerate(self.groups):
+            if temporary:
+                hidden = np.empty_like(hidden)
+            if rows is None:
+                self.__feed__(inputs, weights, scales, hidden, out)
+                continue
+            if temporary:
+                gathered = np.empty((len(rows), inputs.shape[1]), dtype=inputs.dtype)
+                outputs = np.empty((len(rows), self.output), dtype=self.dtype)
+            else:
+                gathered = self.__reserve__('inputs %d' % i, len(rows), inputs.shape[1:],
+                                            inputs.dtype)
+                outputs = self.__reserve__('outputs %d' % i, len(rows), (self.output,),
+                                           self.dtype)
+            np.take(inputs, rows, axis=0, out=gathered, mode='clip')
+            out[rows] = self.__feed__(gathered, weights, scales, hidden, outputs)
+        return out
 
-        return child_network
+    def __feed__(self, inputs, weights, scales, hidden, out):
+        """Feeds inputs through networks of one kind. Sums are computed
+        in the stack's dtype, whatever the dtype of the inputs and
+        weights. Scales are per node, so int8 weights are never widened:
+        the sums of their products are scaled instead."""
+        wi, bi, wo = weights
+        np.einsum('pi,pih->ph', inputs, wi[:, :-1], out=hidden, dtype=self.dtype)
+        hidden += bi
+        if scales is not None:
+            hidden *= scales[0]
+        sigmoid(hidden, out=hidden)
+        np.einsum('ph,pho->po', hidden, wo, out=out, dtype=self.dtype)
+        if scales is not None:
+            out *= scales[1]
+        return sigmoid(out, out=out)
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from network import MLP_NN, MLP_Stack
+from precision import argmax_agreement, probe_inputs
+
+
+def test_batch_matches_single_inputs():
+    rng = np.random.default_rng(0)
+    network = MLP_NN(9, 4, 3, rng)
+    batch = rng.random((5, 9))
+    outputs = network.predict(batch)
+    for row, output in zip(batch, outputs):
+        assert(np.allclose(network.feedforward(row.reshape(3, 3)), output))
+
+
+def test_stack_matches_networks():
+    rng = np.random.default_rng(1)
+    networks = [MLP_NN(9, 4, 3, rng) for _ in range(6)]
+    inputs = rng.random((6, 9))
+    outputs = MLP_Stack(networks).predict(inputs)
+    for network, row, output in zip(networks, inputs, outputs):
+        assert(np.allclose(network.predict(row[None])[0], output))
+
+
+def test_crossover_mixes_parents():
+    rng = np.random.default_rng(2)
+    left = MLP_NN(9, 4, 3, rng)
+    right = MLP_NN(9, 4, 3, rng)
+    child = left.crossover(right, rng)
+    from_left = np.abs(child.wi - left.wi) <= 0.05
+    from_right = np.abs(child.wi - right.wi) <= 0.05
+    assert(np.all(from_left | from_right))
+    assert(from_left.any() and from_right.any())
+
+
+def test_reduced_precision_stacks():
+    rng = np.random.default_rng(3)
+    networks = [MLP_NN(9, 4, 3, rng) for _ in range(6)]
+    inputs = (rng.random((6, 9)) < 0.5).astype(np.uint8) * 255
+    reference = MLP_Stack(networks).predict(inputs.astype(np.float64))
+
+    float32 = MLP_Stack(networks, 'float32')
+    assert(np.allclose(float32.predict(inputs), reference, atol=1e-4))
+
+    passing = [network.quantized() is not None for network in networks]
+    assert(any(passing) and not all(passing))
+    # Networks failing their probe check fall back one by one
+    int8 = MLP_Stack(networks, 'int8')
+    assert(int8.n_quantized == sum(passing))
+    assert(np.array_equal(int8.wi, float32.wi[~np.array(passing)]))
+    # Quantized weights are kept as int8
+    assert(int8.qi.dtype == np.int8 and int8.qo.dtype == np.int8)
+    assert(len(int8.qi) == int8.n_quantized and len(int8.wi) == len(networks) - int8.n_quantized)
+    out = np.empty((len(networks), 3), dtype=np.float32)
+    for row in probe_inputs(9)[:32]:
+        batch = np.tile(row, (len(networks), 1))
+        expected = MLP_Stack(networks).predict(batch)
+        assert(argmax_agreement(expected, int8.predict(batch.astype(np.uint8), out)) == 1.0)
+        assert(np.array_equal(int8.predict(batch.astype(np.uint8)), out))
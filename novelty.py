@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+
+def behavior_descriptor(agent, width, height):
+    """Summarizes how an agent behaved on its grid
+
+    :agent: An agent which finished a grid simulation
+    :width: The grid width
+    :height: The grid height
+    :returns: A 1D array: the final position, the normalized
+    coarse visit histogram and the left/right turn rates
+
+    """
+    visits = agent.visits.flatten()
+    steps = max(visits.sum(), 1.0)
+    final = [min(max(float(agent.x) / width, 0.0), 1.0),
+             min(max(float(agent.y) / height, 0.0), 1.0)]
+    turns = [agent.turns[0] / steps, agent.turns[1] / steps]
+    return np.concatenate((final, visits / steps, turns))
+
+
+class Novelty_Archive():
+
+    """A bounded archive of past behaviors indexed by a KD-tree.
+    New behaviors are kept in a small pending buffer which is searched
+    by brute force until it is large enough to rebuild the tree, so
+    adding behaviors never pays for a full rebuild."""
+
+    def __init__(self, max_size=100000, rebuild_size=512, eps=0.0):
+        """Initializes an archive
+
+        :max_size: The maximum number of behaviors stored, the oldest
+        behaviors are evicted first
+        :rebuild_size: The number of pending behaviors which triggers
+        a rebuild of the tree
+        :eps: Allowed relative error of tree queries, 0 is exact
+
+        """
+        if max_size < 1:
+            raise ValueError('Archive size must be positive')
+
+        self.max_size = max_size
+        self.rebuild_size = rebuild_size
+        self.eps = eps
+
+        self.points = None
+        self.size = 0
+        self.cursor = 0
+        self.tree = None
+        self.pending = []
+
+    def __len__(self):
+        return self.size
+
+    def add(self, descriptors):
+        """Adds behaviors to the archive
+
+        :descriptors: A 2D array, one behavior per row
+
+        """
+        descriptors = np.atleast_2d(descriptors)
+        if self.points is None:
+            self.points = np.empty((self.max_size, descriptors.shape[1]))
+
+        for descriptor in descriptors:
+            # Ring buffer, once full the oldest behavior is replaced
+            self.points[self.cursor] = descriptor
+            self.pending.append(self.cursor)
+            self.cursor = (self.cursor + 1) % self.max_size
+            self.size = min(self.size + 1, self.max_size)
+
+        if len(self.pending) >= self.rebuild_size:
+            self.rebuild()
+
+    def rebuild(self):
+        """Rebuilds the KD-tree over every stored behavior"""
+        if self.size > 0:
+            # The tree must not share the ring buffer, slots it
+            # indexes are overwritten once the archive is full
+            self.tree = build_tree(self.points[:self.size].copy())
+        self.pending = []
+
+    def query(self, descriptors, k):
+        """Finds the distances to the k nearest archived behaviors
+
+        :descriptors: A 2D array of behaviors to query
+        :k: The number of neighbours
+        :returns: A 2D array of sorted distances with at most k columns
+
+        """
+        descriptors = np.atleast_2d(descriptors)
+        found = []
+        n_valid = 0
+        if self.tree is not None:
+            # Slots which were overwritten since the last rebuild are
+            # evicted from the tree, they are only searched as pending
+            stale = np.array([slot for slot in self.pending if slot < self.tree.n],
+                             dtype=np.intp)
+            n = min(k + len(stale), self.tree.n)
+            d, i = self.tree.query(descriptors, k=n, eps=self.eps, workers=-1)
+            d = d.reshape(len(descriptors), n)
+            d[np.isin(i.reshape(len(descriptors), n), stale)] = np.inf
+            found.append(d)
+            n_valid += self.tree.n - len(stale)
+        if self.pending:
+            from scipy.spatial.distance import cdist
+            found.append(cdist(descriptors, self.points[self.pending]))
+            n_valid += len(self.pending)
+
+        n = min(k, n_valid)
+        if not found or n == 0:
+            return np.zeros((len(descriptors), 0))
+        distances = np.concatenate(found, axis=1)
+        distances = np.partition(distances, n - 1, axis=1)[:, :n]
+        return np.sort(distances, axis=1)
+
+
+class Novelty_Search():
+
+    """Scores agents by how different their behavior is from the
+    current population and from the behaviors seen in the past"""
+
+    def __init__(self,
+                 objective='novelty',
+                 k=15,
+                 novelty_weight=0.5,
+                 n_archived=10,
+                 archive=None):
+        """Initializes novelty search
+
+        :objective: Either 'novelty', or 'combined' for a weighted
+        sum of normalized fitness and novelty
+        :k: The number of nearest neighbours novelty is measured over
+        :novelty_weight: The weight of novelty in the combined objective
+        :n_archived: The number of most novel behaviors archived
+        every generation
+        :archive: A Novelty_Archive, a default one is created if None
+
+        """
+        if objective not in ('novelty', 'combined'):
+            raise ValueError('Unknown objective %s' % objective)
+        if k < 1:
+            raise ValueError('k must be a positive integer')
+
+        self.objective = objective
+        self.k = k
+        self.novelty_weight = novelty_weight
+        self.n_archived = n_archived
+        self.archive = archive if archive is not None else Novelty_Archive()
+
+    def novelty(self, descriptors):
+        """Computes the novelty of every behavior, the mean distance
+        to its k nearest neighbours in the population and the archive
+
+        :descriptors: A 2D array, one behavior per row
+        :returns: An array of novelty scores
+
+        """
+        n = len(descriptors)
+        found = []
+        if n > 1:
+            # The closest point of the population is the behavior itself
+            tree = build_tree(descriptors)
+            k = min(self.k + 1, n)
+            d, _ = tree.query(descriptors, k=k, workers=-1)
+            found.append(d.reshape(n, k)[:, 1:])
+        if len(self.archive) > 0:
+            found.append(self.archive.query(descriptors, self.k))
+
+        if not found:
+            return np.zeros(n)
+        distances = np.concatenate(found, axis=1)
+        k = min(self.k, distances.shape[1])
+        if k == 0:
+            return np.zeros(n)
+        distances = np.partition(distances, k - 1, axis=1)[:, :k]
+        return distances.mean(axis=1)
+
+    def score(self, agent_scores, width, height):
+        """Replaces agent fitness with the novelty objective and
+        archives the most novel behaviors
+
+        :agent_scores: A dict of agent fitness scores
+        :width: The grid width
+        :height: The grid height
+        :returns: A new dict of agent scores
+
+        """
+        agents = list(agent_scores.keys())
+        descriptors = np.array([behavior_descriptor(agent, width, height)
+                                for agent in agents])
+        novelty = self.novelty(descriptors)
+
+        if self.n_archived > 0:
+            most_novel = np.argsort(novelty)[::-1][:self.n_archived]
+            self.archive.add(descriptors[most_novel])
+
+        if self.objective == 'novelty':
+            scores = novelty
+        else:
+            fitness = np.array([agent_scores[agent] for agent in agents])
+            scores = ((1.0 - self.novelty_weight) * normalize(fitness) +
+                      self.novelty_weight * normalize(novelty))
+
+        return dict(zip(agents, scores.tolist()))
+
+
+def build_tree(points):
+    """Builds a KD-tree over behaviors. Sliding midpoint splits are
+    both faster to build and to query on clustered behavior data.
+
+    :points: A 2D array
+    :returns: A cKDTree
+
+    """
+    from scipy.spatial import cKDTree
+    return cKDTree(points, balanced_tree=False, compact_nodes=False)
+
+
+def normalize(values):
+    """Scales values between 0 and 1
+
+    :values: An array
+    :returns: The scaled array
+
+    """
+    low = values.min()
+    spread = values.max() - low
+    if spread <= 0:
+        return np.zeros(len(values))
+    return (values - low) / spread
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from novelty import Novelty_Archive
+
+
+def test_archive_query_matches_brute_force():
+    points = np.random.rand(300, 5)
+    queries = np.random.rand(20, 5)
+
+    # The first points end up in the tree, the rest stay pending
+    archive = Novelty_Archive(max_size=1000, rebuild_size=200)
+    archive.add(points[:200])
+    archive.add(points[200:])
+    assert(archive.tree is not None and len(archive.pending) > 0)
+
+    found = archive.query(queries, 7)
+    brute = np.sort(np.linalg.norm(queries[:, None] - points[None], axis=2), axis=1)[:, :7]
+    assert(np.allclose(found, brute))
+
+
+def test_archive_is_bounded():
+    archive = Novelty_Archive(max_size=50, rebuild_size=10)
+    archive.add(np.random.rand(120, 3))
+    assert(len(archive) == 50)
+
+
+def test_overfilled_archive_matches_brute_force():
+    rng = np.random.default_rng(0)
+    points = rng.random((230, 4))
+    queries = rng.random((15, 4))
+
+    # The archive wraps around twice, the last rows are still pending
+    archive = Novelty_Archive(max_size=100, rebuild_size=40)
+    for start in range(0, len(points), 10):
+        archive.add(points[start:start + 10])
+    assert(archive.tree is not None and len(archive.pending) > 0)
+
+    kept = points[-100:]
+    found = archive.query(queries, 9)
+    brute = np.sort(np.linalg.norm(queries[:, None] - kept[None], axis=2), axis=1)[:, :9]
+    assert(np.allclose(found, brute))
@@ -5,6 +5,7 @@
 import random
 import numpy as np
 from agent import Agent
+from streams import default_rng
 
 
 class Population():
@@ -12,7 +13,15 @@ class Population():
     """This class holds a collection of agents
     together as a discrete population"""
 
-    def __init__(self, max_population, sim_population, genetic_pool):
+    def __init__(self,
+                 max_population,
+                 sim_population,
+                 genetic_pool,
+                 speciator=None,
+                 streams=None,
+                 backend='neat',
+                 agents=None,
+                 sensor_radius=5):
         """Initializes a population
 
         :max_population: The maximum population at any
@@ -20,17 +29,31 @@ class Population():
         :sim_population: The maximum population allowed
         in any simulation instance
         :genetic_pool: A reference to NEAT's genetic pool
+        :speciator: A Speciator used to protect innovation, if
+        None mates are chosen from the whole population
+        :streams: Random_Streams all of the population's randomness
+        is drawn from, if None results are not reproducible
+        :backend: The brain backend of new agents, see Agent
+        :agents: The initial agents, e.g. restored from a checkpoint.
+        A new random population is created if None
+        :sensor_radius: How far new agents can see, their brains
+        must have (2*sensor_radius + 1)**2 inputs
 
         """
 
         self.max_population = max_population
         self.sim_population = sim_population
         self.genetic_pool = genetic_pool
+        self.speciator = speciator
+        self.streams = streams
+        self.backend = backend
+        self.sensor_radius = sensor_radius
+        self.champion = None
         self.cur_id = 0
-        
+
         self.current_population = []
         self.current_generation = 0
-        self.__set_new_population__()
+        self.__set_new_population__(agents)
 
     def __iter__(self):
         """Returns the iterator for Populations
@@ -45,17 +68,10 @@ class Population():
         """
         if len(self.agents_waiting_for_sim) == 0:
             raise StopIteration
-        try:
-            sample = random.sample(self.agents_waiting_for_sim, self.sim_population)
-            #self.agents_waiting_for_sim -= sample
-            tmp = self.agents_waiting_for_sim
-            self.agents_waiting_for_sim = [item for item in tmp if item not in sample]
-            return sample
-        except ValueError:
-            # Agent queue is smaller than sim_population
-            sample = self.agents_waiting_for_sim
-            self.agents_waiting_for_sim = []
-            return sample
+        # The queue was shuffled when it was scheduled
+        sample = self.agents_waiting_for_sim[:self.sim_population]
+        self.agents_waiting_for_sim = self.agents_waiting_for_sim[self.sim_population:]
+        return sample
 
     def __set_new_population__(self, population=None):
         """Sets the new population
@@ -69,14 +85,41 @@ class Population():
             if len(population) != self.max_population:
                 raise ValueError('Provided population does not match\
                         this Population instance\'s maximum population')
+            # Agents which did not survive release their genes so
+            # extinct genes leave the genetic pool
+            survivors = set(map(id, population))
+            for agent in self.current_population:
+                if id(agent) not in survivors:
+                    agent.release()
+            self.genetic_pool.genes.collect()
             self.current_population = population
         else:
             for i in range(self.max_population):
-                agent = Agent(self.cur_id, self.genetic_pool)
+                rng = None
+                if self.streams is not None:
+                    rng = self.streams.reproduction(self.current_generation,
+                                                    self.cur_id)
+                agent = Agent(self.cur_id,
+                              self.genetic_pool,
+                              sensor_radius=self.sensor_radius,
+                              backend=self.backend,
+                              rng=rng)
                 self.current_population.append(agent)
                 self.cur_id += 1
 
-        self.agents_waiting_for_sim = self.current_population
+        self.schedule(self.current_population)
+
+    def schedule(self, agents, rng=None):
+        """Sets the agents which are handed out for simulation,
+        in random order
+
+        :agents: A list of agents
+        :rng: The numpy Generator used to shuffle the agents
+
+        """
+        rng = default_rng if rng is None else rng
+        order = rng.permutation(len(agents))
+        self.agents_waiting_for_sim = [agents[i] for i in order]
 
     def get_next_sim_population(self):
         """Randomly select the next simulation population
@@ -117,44 +160,108 @@ class Population():
         elif percentile > 100:
             raise ValueError('Cannot compute 100+ percentiles...')
 
-        # Prepare for population selection
-        cutoff = np.percentile(list(agent_scores.values()), percentile)
-        elites, commoners = split_population(agent_scores, cutoff)
+        if self.streams is None:
+            rng = default_rng
+        else:
+            rng = self.streams.selection(self.current_generation)
+
+        # The best agent is kept so it can be exported after its
+        # generation was replaced
+        self.champion = max(agent_scores, key=agent_scores.get)
 
         high = max(list(agent_scores.values()))
         low = min(list(agent_scores.values()))
         avg = sum(list(agent_scores.values())) / len(list(agent_scores.values()))
         print('\tTop %f, Low %f, Avg %f' % (high, low, avg))
-        print('\tCutoff: %d, Number of elites %d, Number of Commoners %d' % \
-                (cutoff, len(elites), len(commoners)))
 
+        if self.speciator is None:
+            # Prepare for population selection
+            cutoff = np.percentile(list(agent_scores.values()), percentile)
+            elites, commoners = split_population(agent_scores, cutoff)
+            if not elites:
+                elites = [self.champion]
+            print('\tCutoff: %d, Number of elites %d, Number of Commoners %d' % \
+                    (cutoff, len(elites), len(commoners)))
+            next_generation = self.__mate__(elites,
+                                            commoners,
+                                            self.max_population,
+                                            n_parents,
+                                            rng)
+        else:
+            self.speciator.speciate(list(agent_scores.keys()), rng)
+            allocation = self.speciator.allocate_offspring(agent_scores,
+                                                           self.max_population)
+            print('\tSpecies: %d, Threshold %f' % \
+                    (len(self.speciator.species), self.speciator.threshold))
+
+            # Selection happens within each species so new structures
+            # only compete against similar genomes
+            next_generation = []
+            for species, n_offspring in allocation:
+                scores = {agent: agent_scores[agent] for agent in species.members}
+                cutoff = np.percentile(list(scores.values()), percentile)
+                elites, commoners = split_population(scores, cutoff)
+                if not elites:
+                    elites = [max(scores, key=scores.get)]
+                if len(commoners) < n_parents - 1:
+                    commoners = species.members
+                next_generation += self.__mate__(elites,
+                                                 commoners,
+                                                 n_offspring,
+                                                 n_parents,
+                                                 rng)
+
+        # Set the new population
+        self.__set_new_population__(next_generation)
+        self.current_generation += 1
+
+
+    def __mate__(self, elites, commoners, n_offspring, n_parents, rng=None):
+        """Mates elites with randomly selected commoners
+
+        :elites: Agents which are guaranteed to be parents
+        :commoners: Agents mates are drawn from
+        :n_offspring: The number of offspring to create
+        :n_parents: The number of parents per offspring
+        :rng: The numpy Generator mates are chosen with
+        :returns: A list of offspring
+
+        """
         # Elites get priority when it comes to breeding, for each elite
         # select a mate(s)
         n_elites = len(elites)
-        n_commoners = len(commoners)
-        next_generation = []
+        offspring_list = []
         n_generated = 0
 
         # Generate offspring
-        while n_generated < self.max_population:
+        while n_generated < n_offspring:
             # Generate offspring
             elite = elites[n_generated % n_elites]
-            mates = random.sample(commoners, n_parents - 1)
+            if rng is None:
+                mates = random.sample(commoners, n_parents - 1)
+            else:
+                picks = rng.choice(len(commoners), n_parents - 1, replace=False)
+                mates = [commoners[i] for i in picks]
             parents = mates + [elite]
+            # Every offspring has its own stream, keyed by its id
+            if self.streams is None:
+                child_rng = None
+            else:
+                child_rng = self.streams.reproduction(self.current_generation,
+                                                      self.cur_id)
             # Mate
             offspring = parents[0]
             for parent in parents[1:]:
-                offspring += parent
+                offspring = offspring.crossover(parent, child_rng)
 
             offspring.agent_id = self.cur_id
+            offspring.parents = tuple(parent.agent_id for parent in parents)
 
-            next_generation.append(offspring)
+            offspring_list.append(offspring)
             self.cur_id += 1
             n_generated += 1
 
-        # Set the new population
-        self.__set_new_population__(next_generation)
-        self.current_generation += 1
+        return offspring_list
 
 
 def split_population(agent_scores, cutoff):
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+
+# Evaluation precisions. 'float64' is the reference. 'float32' evaluates
+# networks with float32 weights, 'int8' with weights stored as int8
+# with one scale per node and computed in float32, for every network
+# whose choices survive the rounding. Both reduced precisions store
+# cells and sensors as uint8.
+PRECISIONS = ('float64', 'float32', 'int8')
+
+# The seed of the probe bank, fixed so every process checks against
+# the same patterns
+PROBE_SEED = 0x5e45
+
+
+def check_precision(precision):
+    if precision not in PRECISIONS:
+        raise ValueError('Unknown precision %s' % precision)
+    return precision
+
+
+def cell_dtype(precision):
+    """The dtype of grid cells. Reduced precision cells only record
+    whether they are occupied, not by whom."""
+    return np.uint32 if precision == 'float64' else np.uint8
+
+
+def sensor_dtype(precision):
+    """The dtype of walls and sensors, which read 0 or 255"""
+    return np.float64 if precision == 'float64' else np.uint8
+
+
+def weight_dtype(precision):
+    """The dtype networks compute in"""
+    return np.float64 if precision == 'float64' else np.float32
+
+
+def quantize(weights):
+    """Quantizes weights to int8, symmetrically with one scale per
+    column, i.e. per receiving node. Stacked weights are quantized
+    per matrix.
+
+    :weights: An array of at least 2 dimensions
+    :returns: A tuple of (int8 weights, float32 scales), the weights
+    are approximately int8 weights * scales
+
+    """
+    scales = np.abs(weights).max(axis=-2) / 127.0
+    scales[scales == 0] = 1.0
+    quantized = np.rint(weights / np.expand_dims(scales, -2)).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+def probe_inputs(n_inputs, n_probes=256):
+    """A fixed bank of sensor patterns: an empty view, a walled
+    in view and random mixes of walls and empty cells
+
+    :n_inputs: The number of sensor values
+    :n_probes: The number of patterns
+    :returns: A float64 array with one pattern per row
+
+    """
+    rng = np.random.default_rng(PROBE_SEED)
+    density = rng.random((n_probes, 1))
+    probes = np.where(rng.random((n_probes, n_inputs)) < density, 255.0, 0.0)
+    probes[0] = 0.0
+    probes[1 % n_probes] = 255.0
+    return probes
+
+
+def argmax_agreement(reference, candidate):
+    """The fraction of rows whose largest output is the same
+
+    :reference: A 2D array of outputs
+    :candidate: A 2D array of outputs for the same inputs
+    :returns: A float between 0 and 1
+
+    """
+    if len(reference) == 0:
+        return 1.0
+    return float(np.mean(np.argmax(reference, axis=-1) == np.argmax(candidate, axis=-1)))
@@ -0,0 +1,480 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from collections import deque
+from functools import partial
+import argparse
+import json
+import os
+from queue import Empty, Queue
+import socket
+import struct
+import sys
+from threading import Event, Lock, Thread
+
+import numpy as np
+
+
+# Messages are a JSON header followed by raw numpy array bytes,
+# nothing is pickled:
+#
+#     <u4 header length> <u8 payload length> <header> <payload>
+#
+# The header's 'arrays' entry lists the (name, dtype, shape) of every
+# array in the payload, in order.
+PROTOCOL_VERSION = 1
+PREFIX = struct.Struct('<IQ')
+
+
+def send_message(sock, header, arrays=None):
+    """Sends a message
+
+    :sock: A connected socket
+    :header: A JSON serializable dict
+    :arrays: A dict of numpy arrays
+
+    """
+    arrays = arrays or {}
+    chunks = [np.ascontiguousarray(array) for array in arrays.values()]
+    header = dict(header, arrays=[[name, chunk.dtype.str, list(chunk.shape)]
+                                  for name, chunk in zip(arrays, chunks)])
+    encoded = json.dumps(header).encode('utf-8')
+    payload = sum(chunk.nbytes for chunk in chunks)
+    sock.sendall(PREFIX.pack(len(encoded), payload) + encoded)
+    for chunk in chunks:
+        sock.sendall(memoryview(chunk).cast('B'))
+
+
+def recv_message(sock):
+    """Receives a message
+
+    :sock: A connected socket
+    :returns: A tuple of (header, arrays)
+
+    """
+    length, payload = PREFIX.unpack(recv_exactly(sock, PREFIX.size))
+    header = json.loads(recv_exactly(sock, length).decode('utf-8'))
+    data = recv_exactly(sock, payload)
+
+    arrays = {}
+    offset = 0
+    for name, dtype, shape in header.pop('arrays'):
+        dtype = np.dtype(dtype)
+        count = int(np.prod(shape))
+        arrays[name] = np.frombuffer(data, dtype=dtype, count=count,
+                                     offset=offset).reshape(shape)
+        offset += count * dtype.itemsize
+    return header, arrays
+
+
+def recv_exactly(sock, n):
+    buffer = bytearray(n)
+    view = memoryview(buffer)
+    received = 0
+    while received < n:
+        count = sock.recv_into(view[received:])
+        if count == 0:
+            raise ConnectionError('Connection closed')
+        received += count
+    return bytes(buffer)
+
+
+def parse_address(address):
+    """Parses 'unix:/path/to/socket' or 'host:port'
+
+    :returns: A tuple of (socket family, address)
+
+    """
+    if address.startswith('unix:'):
+        return socket.AF_UNIX, address[len('unix:'):]
+    host, port = address.rsplit(':', 1)
+    return socket.AF_INET, (host, int(port))
+
+
+def encode_agents(agents):
+    """Serializes the brains of a grid's agents
+
+    :agents: A list of agents whose brains are all NEAT_Networks
+    or all MLP_NNs
+    :returns: A tuple of (header, arrays)
+
+    """
+    from network import MLP_NN
+
+    brains = [agent.brain for agent in agents]
+    ids = np.array([agent.agent_id for agent in agents], dtype=np.int64)
+    header = {'sensor_radius': agents[0].sensor_radius}
+
+    if all(isinstance(brain, MLP_NN) for brain in brains):
+        header['backend'] = 'mlp'
+        return header, {'agent_ids': ids,
+                        'wi': np.stack([brain.wi for brain in brains]),
+                        'wo': np.stack([brain.wo for brain in brains])}
+
+    pool = brains[0].pool
+    genes = [gene for brain in brains for gene in brain.genome.values()]
+    activations = [item for brain in brains for item in sorted(brain.activations.items())]
+    header['backend'] = 'neat'
+    return header, {'agent_ids': ids,
+                    'inputs': np.array([node.label for node in pool.input_nodes], dtype=np.int64),
+                    'outputs': np.array([node.label for node in pool.output_nodes], dtype=np.int64),
+                    'gene_offsets': np.cumsum([0] + [len(brain.genome) for brain in brains]),
+                    'innovation': np.array([gene.innovation for gene in genes], dtype=np.int64),
+                    'src': np.array([gene.in_node.label for gene in genes], dtype=np.int64),
+                    'dest': np.array([gene.out_node.label for gene in genes], dtype=np.int64),
+                    'weight': np.array([gene.weight for gene in genes], dtype=np.float64),
+                    'enabled': np.array([gene.enabled for gene in genes], dtype=np.uint8),
+                    'activation_offsets': np.cumsum([0] + [len(brain.activations)
+                                                           for brain in brains]),
+                    'activation_label': np.array([label for label, _ in activations],
+                                                 dtype=np.int64),
+                    'activation_code': np.array([code for _, code in activations],
+                                                dtype=np.int64)}
+
+
+def decode_brains(header, arrays):
+    """Rebuilds the brains sent by encode_agents, without a pool
+
+    :returns: A list of networks with a feedforward method
+
+    """
+    if header['backend'] == 'mlp':
+        from network import MLP_NN
+        wi, wo = arrays['wi'], arrays['wo']
+        return [MLP_NN(wi.shape[1] - 1, wi.shape[2], wo.shape[2], wi=wi[i], wo=wo[i])
+                for i in range(len(wi))]
+
+    from compiled import compile_genome, network_cache
+    from neat import Gene, Node, genome_hash
+
+    nodes = {}
+
+    def node(label):
+        if label not in nodes:
+            nodes[label] = Node(label, 'hidden')
+        return nodes[label]
+
+    inputs = arrays['inputs'].tolist()
+    outputs = arrays['outputs'].tolist()
+    gene_offsets = arrays['gene_offsets'].tolist()
+    activation_offsets = arrays['activation_offsets'].tolist()
+    columns = [arrays[name].tolist() for name in ('innovation', 'src', 'dest', 'weight', 'enabled')]
+    labels = arrays['activation_label'].tolist()
+    codes = arrays['activation_code'].tolist()
+
+    brains = []
+    for i in range(len(gene_offsets) - 1):
+        genome = {}
+        for j in range(gene_offsets[i], gene_offsets[i + 1]):
+            innovation, src, dest, weight, enabled = (column[j] for column in columns)
+            genome[innovation] = Gene(node(src), node(dest), weight, bool(enabled), innovation)
+        activations = dict(zip(labels[activation_offsets[i]:activation_offsets[i + 1]],
+                               codes[activation_offsets[i]:activation_offsets[i + 1]]))
+        # Workers keep evaluators across tasks, genomes which survive
+        # a generation are only compiled once
+        key = genome_hash(genome, len(inputs), len(outputs), activations)
+        brains.append(network_cache.get(key, partial(compile_genome, genome, inputs,
+                                                      outputs, activations),
+                                        header.get('precision', 'float64')))
+    return brains
+
+
+def run_task(header, arrays):
+    """Simulates the grid described by a task message
+
+    :returns: A tuple of (header, arrays) of the result message
+
+    """
+    from agent import Agent
+    from armagetron import Grid
+    from streams import Random_Streams
+
+    agents = [Agent(int(agent_id), None, sensor_radius=header['sensor_radius'], brain=brain)
+              for agent_id, brain in zip(arrays['agent_ids'].tolist(),
+                                         decode_brains(header, arrays))]
+    for agent in agents:
+        agent.reset()
+    generation, trial, index = header['grid']
+    streams = Random_Streams(int(header['entropy']))
+    grid = Grid(header['width'],
+                header['height'],
+                agents,
+                None,
+                generation,
+                header['number'],
+                behavior_bins=header['behavior_bins'],
+                placements=[tuple(p) for p in arrays['placements'].tolist()],
+                rng=streams.grid(generation, trial, index),
+                max_time=header['max_time'],
+                precision=header.get('precision', 'float64'))
+    grid.simulate(header['max_ticks'])
+
+    return ({'type': 'result',
+             'task': header['task'],
+             'ticks': grid.iteration,
+             'elapsed': grid.elapsed},
+            {'lifetimes': np.array([agent.lifetime for agent in agents], dtype=np.float64),
+             'turns': np.array([agent.turns for agent in agents], dtype=np.int64),
+             'x': np.array([agent.x for agent in agents], dtype=np.int64),
+             'y': np.array([agent.y for agent in agents], dtype=np.int64),
+             'visits': np.array([agent.visits for agent in agents], dtype=np.float64)})
+
+
+class Connection():
+
+    """A coordinator's connection to one worker, reused for every
+    evaluation. Up to depth tasks are in flight at once."""
+
+    def __init__(self, address, timeout, depth=2):
+        """Connects to a worker
+
+        :address: The worker's address, see parse_address
+        :timeout: Seconds without any message, heartbeats included,
+        after which the worker is considered lost
+        :depth: The number of tasks sent ahead
+
+        """
+        family, target = parse_address(address)
+        self.address = address
+        self.depth = depth
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(target)
+        if family == socket.AF_INET:
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        send_message(self.sock, {'type': 'hello', 'version': PROTOCOL_VERSION})
+        reply, _ = recv_message(self.sock)
+        if reply.get('version') != PROTOCOL_VERSION:
+            raise ConnectionError('Worker %s speaks protocol %s' % (address, reply.get('version')))
+        self.pid = reply.get('pid')
+        self.alive = True
+
+    def close(self):
+        self.alive = False
+        try:
+            send_message(self.sock, {'type': 'close'})
+        except OSError:
+            pass
+        self.sock.close()
+
+    def serve(self, tasks, results, remaining, done):
+        """Sends tasks from the queue and collects their results
+        until every task is done. If the worker is lost, its
+        unfinished tasks are put back for other connections.
+
+        :tasks: A Queue of (task id, header, arrays)
+        :results: A dict task id to (header, arrays), filled in
+        :remaining: A one item list counting unfinished tasks, with
+        its lock
+        :done: An Event set once every task finished
+
+        """
+        in_flight = deque()
+        try:
+            while not done.is_set():
+                while len(in_flight) < self.depth:
+                    try:
+                        task = tasks.get(timeout=0.01 if in_flight else 0.05)
+                    except Empty:
+                        break
+                    in_flight.append(task)
+                    task_id, header, arrays = task
+                    send_message(self.sock, dict(header, type='task', task=task_id), arrays)
+                if not in_flight:
+                    continue
+
+                header, arrays = recv_message(self.sock)
+                if header['type'] == 'heartbeat':
+                    continue
+                for task in list(in_flight):
+                    if task[0] == header['task']:
+                        in_flight.remove(task)
+                results[header['task']] = (header, arrays)
+                counter, lock = remaining
+                with lock:
+                    counter[0] -= 1
+                    if counter[0] == 0:
+                        done.set()
+        except (OSError, ConnectionError, ValueError) as e:
+            print('\tLost worker %s: %s' % (self.address, e))
+            self.alive = False
+            self.sock.close()
+            for task in in_flight:
+                tasks.put(task)
+
+
+class Remote_Pool():
+
+    """Dispatches grid evaluations to remote workers over
+    persistent connections"""
+
+    def __init__(self, addresses, timeout=10.0, depth=2):
+        """Connects to workers
+
+        :addresses: A list of worker addresses, 'host:port' or
+        'unix:/path'
+        :timeout: Seconds of silence after which a worker is lost
+        :depth: The number of tasks sent ahead to each worker
+
+        """
+        self.addresses = addresses
+        self.timeout = timeout
+        self.depth = depth
+        self.connections = []
+        self.connect()
+
+    def connect(self):
+        """Connects to every reachable worker"""
+        self.connections = []
+        for address in self.addresses:
+            try:
+                self.connections.append(Connection(address, self.timeout, self.depth))
+            except OSError as e:
+                print('Could not connect to worker %s: %s' % (address, e))
+        if not self.connections:
+            raise ConnectionError('No evaluation workers reachable')
+
+    @property
+    def alive(self):
+        return [connection for connection in self.connections if connection.alive]
+
+    def evaluate(self, tasks):
+        """Evaluates tasks on the workers
+
+        :tasks: A list of (header, arrays) task messages
+        :returns: A list of (header, arrays) results, in task order
+
+        """
+        if not tasks:
+            return []
+        # A closed pool reconnects, e.g. for the next run
+        if not self.connections:
+            self.connect()
+
+        queue = Queue()
+        for task_id, (header, arrays) in enumerate(tasks):
+            queue.put((task_id, header, arrays))
+        results = {}
+        remaining = ([len(tasks)], Lock())
+        done = Event()
+
+        threads = [Thread(target=connection.serve, args=(queue, results, remaining, done))
+                   for connection in self.alive]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if not done.is_set():
+            raise ConnectionError('Every evaluation worker was lost')
+        return [results[task_id] for task_id in range(len(tasks))]
+
+    def close(self):
+        """Closes every connection, so the workers' serving threads
+        exit. The next evaluation connects again."""
+        for connection in self.alive:
+            connection.close()
+        self.connections = []
+
+
+def grid_task(simulation, agents, generation, trial, index, n_groups, placements):
+    """Describes a grid of an evaluation as a task message
+
+    :returns: A tuple of (header, arrays)
+
+    """
+    header, arrays = encode_agents(agents)
+    header.update({'grid': [generation, trial, index],
+                   'number': trial * n_groups + index,
+                   'entropy': str(simulation.streams.entropy),
+                   'width': simulation.sim_dims[0],
+                   'height': simulation.sim_dims[1],
+                   'behavior_bins': 4,
+                   'max_ticks': simulation.max_ticks,
+                   'max_time': simulation.max_grid_time,
+                   'precision': simulation.precision})
+    arrays['placements'] = np.array(placements[:len(agents)], dtype=np.int64).reshape(-1, 3)
+    return header, arrays
+
+
+def handle(conn, heartbeat):
+    """Serves one coordinator connection
+
+    :conn: The accepted socket
+    :heartbeat: Seconds between heartbeats while a task runs
+
+    """
+    send_lock = Lock()
+    try:
+        while True:
+            header, arrays = recv_message(conn)
+            if header['type'] == 'hello':
+                send_message(conn, {'type': 'hello',
+                                    'version': PROTOCOL_VERSION,
+                                    'pid': os.getpid()})
+            elif header['type'] == 'task':
+                working = Event()
+
+                def beat():
+                    while not working.wait(heartbeat):
+                        with send_lock:
+                            send_message(conn, {'type': 'heartbeat'})
+
+                beater = Thread(target=beat)
+                beater.daemon = True
+                beater.start()
+                try:
+                    reply = run_task(header, arrays)
+                finally:
+                    working.set()
+                    beater.join()
+                with send_lock:
+                    send_message(conn, *reply)
+            elif header['type'] == 'close':
+                break
+    except (OSError, ConnectionError):
+        pass
+    finally:
+        conn.close()
+
+
+def serve(address, heartbeat=1.0, ready=None):
+    """Runs an evaluation worker until it is killed. Every
+    coordinator connection is served on its own thread.
+
+    :address: The address to listen on, see parse_address
+    :heartbeat: Seconds between heartbeats while a task runs
+    :ready: A function called once the worker is listening
+
+    """
+    family, target = parse_address(address)
+    listener = socket.socket(family, socket.SOCK_STREAM)
+    if family == socket.AF_UNIX:
+        if os.path.exists(target):
+            os.remove(target)
+    else:
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(target)
+    listener.listen()
+    if ready is not None:
+        ready()
+
+    while True:
+        conn, _ = listener.accept()
+        thread = Thread(target=handle, args=(conn, heartbeat))
+        thread.daemon = True
+        thread.start()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs a grid evaluation worker')
+    parser.add_argument('address', help="'host:port' or 'unix:/path/to/socket'")
+    parser.add_argument('--heartbeat', type=float, default=1.0)
+    args = parser.parse_args()
+
+    def ready():
+        print('Listening on %s' % args.address)
+        sys.stdout.flush()
+
+    serve(args.address, args.heartbeat, ready)
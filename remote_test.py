@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import signal
+import socket
+import subprocess
+import sys
+
+import pytest
+
+from armagetron import Simulation
+from worker_pool import Worker_Pool
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def start_worker(address):
+    worker = subprocess.Popen([sys.executable, 'remote.py', address, '--heartbeat', '0.1'],
+                              cwd=HERE,
+                              stdout=subprocess.PIPE,
+                              universal_newlines=True)
+    assert(worker.stdout.readline().startswith('Listening'))
+    return worker
+
+
+@pytest.fixture
+def workers(tmp_path):
+    addresses = ['unix:%s' % (tmp_path / ('worker-%d.sock' % i)) for i in range(2)]
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        addresses.append('127.0.0.1:%d' % s.getsockname()[1])
+    processes = [start_worker(address) for address in addresses]
+    yield addresses, processes
+    for process in processes:
+        process.kill()
+        process.wait()
+
+
+def scores_by_id(scores):
+    return sorted((agent.agent_id, score) for agent, score in scores.items())
+
+
+def test_remote_matches_local(tmp_path, monkeypatch, workers):
+    monkeypatch.chdir(tmp_path)
+    addresses, processes = workers
+
+    local = Simulation(20, 5, render=False, seed=3, max_ticks=200)
+    remote = Simulation(20, 5, render=False, seed=3, max_ticks=200,
+                        remote=addresses, remote_timeout=1.0)
+    expected = local.evaluate(0, Worker_Pool(1))
+    assert(scores_by_id(remote.evaluate(0, None)) == scores_by_id(expected))
+    assert(remote.ticks == local.ticks)
+
+    # A stalled and a dead worker lose their tasks to the survivor
+    os.kill(processes[0].pid, signal.SIGSTOP)
+    processes[1].kill()
+    remote.fitness_cache = local.fitness_cache = None
+    expected = local.evaluate(0, Worker_Pool(1))
+    assert(scores_by_id(remote.evaluate(0, None)) == scores_by_id(expected))
+    assert(len(remote.remote.alive) == 1)
+
+
+def test_remote_novelty_matches_local(tmp_path, monkeypatch, workers):
+    monkeypatch.chdir(tmp_path)
+    addresses, _ = workers
+
+    local = Simulation(20, 5, render=False, seed=3, max_ticks=200, objective='combined')
+    remote = Simulation(20, 5, render=False, seed=3, max_ticks=200, objective='combined',
+                        remote=addresses, remote_timeout=1.0)
+    # Novelty needs every agent's final position and behavior
+    for expected, result in zip(list(local.run(3)), list(remote.run(3))):
+        assert(scores_by_id(result.scores) == scores_by_id(expected.scores))
+
+    # Runs close their connections, the next one connects again
+    assert(not remote.remote.connections)
+    assert(len(list(remote.run(1))[0].scores) == 20)
+
+
+def test_workers_reuse_compiled_networks():
+    from remote import decode_brains, encode_agents
+
+    sim = Simulation(10, 5, render=False, seed=1)
+    agents = sim.population.current_population
+    header, arrays = encode_agents(agents)
+    brains = decode_brains(header, arrays)
+    assert(all(a is b for a, b in zip(brains, decode_brains(header, arrays))))
+    # Decoded genomes hash like the coordinator's
+    assert(all(brain is agent.brain.compiled for brain, agent in zip(brains, agents)))
@@ -47,7 +47,7 @@ class Renderer(Thread):
             self.buffer.task_done()
 
     def wait_till_done(self):
-        self.queue.join()
+        self.buffer.join()
 
 
 def insert_lines(a, scale, value=128, thickness=1):
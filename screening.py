@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import math
+
+import numpy as np
+
+from precision import probe_inputs
+
+
+# The number of probe sensor patterns every agent is run on
+N_PROBES = 64
+
+
+class Screener():
+
+    """Decides which agents are worth a full simulation. Every agent
+    is first run on a fixed bank of sensor patterns: policies which
+    make the same move whatever they see are degenerate. The others are
+    ranked by a ridge regression from cheap features to fitness, which
+    is trained online on the agents that were simulated. The best
+    ranked fraction is simulated, together with an exploration quota
+    drawn at random from the rest, so the model keeps seeing agents it
+    would have rejected."""
+
+    def __init__(self, keep=0.5, explore=0.1, ridge=1.0, decay=0.9, min_samples=50):
+        """Initializes a screener
+
+        :keep: The fraction of agents simulated on the model's ranking
+        :explore: The fraction of agents simulated although the model
+        or the probes rejected them
+        :ridge: The regularization of the regression
+        :decay: How much of the past the model keeps every generation,
+        fitness drifts as the population improves
+        :min_samples: The number of simulated agents the model needs
+        before it is trusted, until then only degenerate agents are
+        screened out
+
+        """
+        if not 0 < keep <= 1 or not 0 <= explore <= 1:
+            raise ValueError('Screening fractions must be within 0 and 1')
+        self.keep = keep
+        self.explore = explore
+        self.ridge = ridge
+        self.decay = decay
+        self.min_samples = min_samples
+
+        self.gram = None
+        self.moments = None
+        self.samples = 0.0
+        self.weights = None
+        # Scores of the last generation by agent id, offspring are
+        # judged by their parents
+        self.parent_scores = {}
+        # Features of the agents selected for simulation, until
+        # their scores are observed
+        self.selected = {}
+
+    def probe(self, agent):
+        """Returns the move an agent makes on every probe pattern
+
+        :agent: The agent
+        :returns: An array of output indices
+
+        """
+        sensor_dia = 2*agent.sensor_radius + 1
+        probes = probe_inputs(sensor_dia * sensor_dia, N_PROBES)
+        return np.argmax(agent.brain.predict(probes), axis=1)
+
+    def features(self, agent, choices):
+        """Describes an agent for the regression
+
+        :agent: The agent
+        :choices: The moves it made on the probes
+        :returns: A float array
+
+        """
+        known = [self.parent_scores[parent] for parent in agent.parents
+                 if parent in self.parent_scores]
+        if known:
+            parents = sum(known) / len(known)
+        elif self.parent_scores:
+            parents = sum(self.parent_scores.values()) / len(self.parent_scores)
+        else:
+            parents = 0.0
+        moves = np.bincount(choices, minlength=3)[:3] / len(choices)
+        # How often what it sees changes its mind, the first probe
+        # is the empty view
+        reacts = np.mean(choices != choices[0])
+        return np.array([1.0,
+                         parents,
+                         math.log1p(agent.get_complexity()),
+                         moves[0],
+                         moves[1],
+                         moves[2],
+                         reacts])
+
+    def predict(self, features):
+        """Returns the predicted scores of rows of features, or None
+        while the model has too few samples"""
+        if self.weights is None or self.samples < self.min_samples:
+            return None
+        return features @ self.weights
+
+    def select(self, agents, rng):
+        """Splits agents into those which are simulated and those
+        which are not
+
+        :agents: The agents awaiting evaluation
+        :rng: The numpy Generator exploration picks are drawn with
+        :returns: A tuple of (simulated, skipped) agent lists, in the
+        order of agents. At least one agent is simulated.
+
+        """
+        if not agents:
+            return [], []
+
+        rows = []
+        degenerate = []
+        for agent in agents:
+            choices = self.probe(agent)
+            degenerate.append(np.all(choices == choices[0]))
+            rows.append(self.features(agent, choices))
+        rows = np.array(rows)
+        degenerate = np.array(degenerate)
+
+        predicted = self.predict(rows)
+        if predicted is None:
+            chosen = ~degenerate
+        else:
+            n_keep = math.ceil(self.keep * len(agents))
+            ranking = [i for i in np.argsort(-predicted, kind='stable') if not degenerate[i]]
+            chosen = np.zeros(len(agents), dtype=bool)
+            chosen[ranking[:n_keep]] = True
+
+        rejected = np.flatnonzero(~chosen)
+        n_explore = min(len(rejected), math.ceil(self.explore * len(agents)))
+        if n_explore:
+            chosen[rng.choice(rejected, n_explore, replace=False)] = True
+        # Skipped agents are scored below the simulated ones, which
+        # takes at least one of them
+        if not chosen.any():
+            chosen[rng.integers(len(agents))] = True
+
+        simulated = [agent for agent, keep in zip(agents, chosen) if keep]
+        skipped = [agent for agent, keep in zip(agents, chosen) if not keep]
+        self.selected = {agent: row for agent, row, keep in zip(agents, rows, chosen) if keep}
+        return simulated, skipped
+
+    def observe(self, scores):
+        """Trains the model on the simulated agents' scores, and keeps
+        the generation's scores to judge its offspring by
+
+        :scores: A dict of agent scores for the whole generation
+
+        """
+        self.parent_scores = {agent.agent_id: score for agent, score in scores.items()}
+        selected = [(row, scores[agent]) for agent, row in self.selected.items()
+                    if agent in scores]
+        self.selected = {}
+        if not selected:
+            return
+
+        rows = np.array([row for row, _ in selected])
+        targets = np.array([score for _, score in selected])
+        if self.gram is None:
+            self.gram = np.zeros((rows.shape[1], rows.shape[1]))
+            self.moments = np.zeros(rows.shape[1])
+        self.gram = self.decay * self.gram + rows.T @ rows
+        self.moments = self.decay * self.moments + rows.T @ targets
+        self.samples = self.decay * self.samples + len(rows)
+        self.weights = np.linalg.solve(self.gram + self.ridge * np.eye(len(self.gram)),
+                                       self.moments)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from agent import Agent
+from network import MLP_NN
+from screening import Screener
+
+
+def test_degenerate_policies_are_screened_out():
+    rng = np.random.default_rng(0)
+    # Zero weights pick the same move whatever the agent sees
+    blind = [Agent(i, None, brain=MLP_NN(121, 8, 3, wi=np.zeros((122, 8)), wo=np.zeros((8, 3))))
+             for i in range(5)]
+    seeing = [Agent(i + 5, None, backend='mlp', rng=rng) for i in range(5)]
+
+    screener = Screener(explore=0.0)
+    simulated, skipped = screener.select(blind + seeing, rng)
+    assert(skipped == blind and simulated == seeing)
+
+    # The model is trained on the simulated agents only
+    screener.observe({agent: float(i) for i, agent in enumerate(blind + seeing)})
+    assert(screener.samples == len(seeing) and not screener.selected)
+    assert(screener.parent_scores[blind[0].agent_id] == 0.0)
+
+
+def test_screened_simulation(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    from armagetron import Simulation
+
+    runs = []
+    for n_threads in (1, 3):
+        sim = Simulation(30, 10, render=False, seed=4, backend='mlp', n_threads=n_threads,
+                         screening={'keep': 0.5, 'explore': 0.1, 'min_samples': 10})
+        results = list(sim.run(4))
+        assert(all(len(result.scores) == 30 for result in results))
+        runs.append(([result.top for result in results], sim.ticks))
+    assert(runs[0] == runs[1])
+    # Once the model is trusted, at most 60% of the agents are simulated
+    assert(sim.evaluated <= 18)
+
+
+def test_all_degenerate_generation(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    from armagetron import Simulation
+    # Every agent makes the same move whatever it sees
+    monkeypatch.setattr(Screener, 'probe', lambda self, agent: np.zeros(8, dtype=np.intp))
+
+    for speciation in (False, True):
+        sim = Simulation(20, 10, render=False, seed=5, speciation=speciation,
+                         screening={'explore': 0.0})
+        results = list(sim.run(3))
+        assert(sim.evaluated == 1)
+        for result, offspring in zip(results, results[1:]):
+            # A single agent is simulated, and it is every elite
+            ranked = sorted(result.scores.values())
+            assert(ranked[-1] > ranked[-2] and ranked[0] == ranked[-2])
+            champion = max(result.scores, key=result.scores.get)
+            assert(all(agent.parents[-1] == champion.agent_id for agent in offspring.scores))
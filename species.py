@@ -0,0 +1,448 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+import random
+
+import numpy as np
+
+
+class Species():
+
+    """A group of agents with compatible genomes"""
+
+    def __init__(self, species_id, representative):
+        """Initializes a species
+
+        :species_id: A unique id for the species
+        :representative: The network new members are compared against
+
+        """
+        self.species_id = species_id
+        self.representative = representative
+        self.members = []
+        self.age = 0
+        self.best_fitness = None
+        self.staleness = 0
+
+    def __len__(self):
+        return len(self.members)
+
+    def __str__(self):
+        return 'Species-%d' % self.species_id
+
+    def update_fitness(self, agent_scores):
+        """Tracks whether the species is still improving
+
+        :agent_scores: A dict of agent scores
+        :returns: The best score within the species
+
+        """
+        best = max(agent_scores[agent] for agent in self.members)
+        if self.best_fitness is None or best > self.best_fitness:
+            self.best_fitness = best
+            self.staleness = 0
+        else:
+            self.staleness += 1
+        return best
+
+
+class Speciator():
+
+    """Divides a population into species with NEAT's compatibility
+    distance. Distances from the genomes still without a species to a
+    representative are computed in one vectorized pass over the
+    concatenated genomes, and are cached while the representative is
+    kept so unchanged genomes are never compared twice."""
+
+    def __init__(self,
+                 threshold=3.0,
+                 c_excess=1.0,
+                 c_disjoint=1.0,
+                 c_weight=0.4,
+                 small_genome=20,
+                 target_species=None,
+                 threshold_step=0.3,
+                 max_staleness=15,
+                 cache_size=1 << 16):
+        """Initializes a speciator
+
+        :threshold: Genomes closer than this to a representative
+        belong to its species
+        :c_excess: Coefficient of excess genes
+        :c_disjoint: Coefficient of disjoint genes
+        :c_weight: Coefficient of the mean weight difference
+        :small_genome: Genomes smaller than this are not normalized
+        by their size
+        :target_species: If set, the threshold is adjusted every
+        generation to approach this number of species
+        :threshold_step: How much the threshold is adjusted by
+        :max_staleness: Generations without improvement before a
+        species stops receiving offspring
+        :cache_size: The maximum number of cached distances
+
+        """
+        if threshold <= 0:
+            raise ValueError('Compatibility threshold must be positive')
+
+        self.threshold = threshold
+        self.c_excess = c_excess
+        self.c_disjoint = c_disjoint
+        self.c_weight = c_weight
+        self.small_genome = small_genome
+        self.target_species = target_species
+        self.threshold_step = threshold_step
+        self.max_staleness = max_staleness
+
+        self.species = []
+        self.next_species_id = 0
+
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def distance(self, net1, net2):
+        """Computes the compatibility distance between two networks
+
+        :returns: The distance
+
+        """
+        return self.distances(Genome_Batch([net1]), net2)[0]
+
+    def distances(self, batch, representative, selected=None):
+        """Computes the compatibility distance between genomes of a
+        batch and a representative, using cached values where possible
+
+        :batch: A Genome_Batch
+        :representative: The network to compare against
+        :selected: A boolean mask of the unique genomes to compare,
+        all of them if None
+        :returns: An array of distances, one for each selected genome
+
+        """
+        indices = np.arange(len(batch.keys)) if selected is None else np.flatnonzero(selected)
+        keys = batch.keys[indices]
+        rep_key = representative.key
+        result = np.empty(len(keys))
+        missing = np.ones(len(keys), dtype=bool)
+
+        cached = self.cache.get(rep_key)
+        if cached is not None and len(keys) > 0:
+            self.cache.move_to_end(rep_key)
+            cached_keys, values = cached
+            pos = np.minimum(np.searchsorted(cached_keys, keys), len(cached_keys) - 1)
+            hit = cached_keys[pos] == keys
+            result[hit] = values[pos[hit]]
+            missing = ~hit
+
+        n_missing = int(missing.sum())
+        self.cache_hits += len(keys) - n_missing
+        self.cache_misses += n_missing
+        if n_missing == 0:
+            return result
+
+        compared = np.zeros(len(batch.keys), dtype=bool)
+        compared[indices[missing]] = True
+        result[missing] = compatibility_distances(batch.select(compared),
+                                                  representative.genome_arrays(),
+                                                  self.c_excess,
+                                                  self.c_disjoint,
+                                                  self.c_weight,
+                                                  self.small_genome)
+
+        # batch.keys is sorted, so the cache entry stays sorted
+        self.cache[rep_key] = (keys, result.copy())
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+        return result
+
+    def adopt(self, species):
+        """Adds a species. The speciator holds references on its
+        representative's genes, representatives outlive the agents
+        they came from.
+
+        :species: A Species
+
+        """
+        hold(species.representative)
+        self.species.append(species)
+
+    def __represent__(self, species, representative):
+        """Replaces the representative of a species
+
+        :species: A Species
+        :representative: The new representative network
+
+        """
+        hold(representative)
+        retired = species.representative
+        species.representative = representative
+        self.__retire__(retired)
+
+    def __retire__(self, representative):
+        """Forgets a representative which was replaced or whose
+        species died, its distances are never looked up again
+
+        :representative: The network
+
+        """
+        representative.pool.genes.release(representative.genome.values())
+        if all(species.representative.key != representative.key for species in self.species):
+            self.cache.pop(representative.key, None)
+
+    def speciate(self, agents, rng=None):
+        """Assigns every agent to a species. Representatives from
+        the previous generation are kept so species persist.
+
+        :agents: A list of agents
+        :rng: The numpy Generator new representatives are chosen with
+        :returns: The list of non-empty species
+
+        """
+        for species in self.species:
+            species.members = []
+
+        # Identical genomes are only compared once
+        batch = Genome_Batch([agent.brain for agent in agents])
+        n_unique = len(batch.keys)
+        unassigned = np.arange(n_unique)
+        assignment = np.full(n_unique, -1)
+
+        # A genome joins the first existing species it is compatible
+        # with, so each representative is only compared against the
+        # genomes no earlier one took
+        for j, species in enumerate(self.species):
+            selected = assignment < 0
+            if not selected.any():
+                break
+            d = self.distances(batch, species.representative, selected)
+            assignment[np.flatnonzero(selected)[d < self.threshold]] = j
+        unassigned = np.flatnonzero(assignment < 0)
+
+        # Remaining genomes found new species
+        while len(unassigned) > 0:
+            founder = unassigned[0]
+            species = Species(self.next_species_id, batch.networks[founder])
+            self.next_species_id += 1
+            self.adopt(species)
+            assignment[founder] = len(self.species) - 1
+
+            rest = unassigned[1:]
+            if len(rest) == 0:
+                break
+            selected = np.zeros(n_unique, dtype=bool)
+            selected[rest] = True
+            d = compatibility_distances(batch.select(selected),
+                                        species.representative.genome_arrays(),
+                                        self.c_excess,
+                                        self.c_disjoint,
+                                        self.c_weight,
+                                        self.small_genome)
+            close = d < self.threshold
+            assignment[rest[close]] = len(self.species) - 1
+            unassigned = rest[~close]
+
+        for agent, unique in zip(agents, batch.inverse):
+            self.species[assignment[unique]].members.append(agent)
+
+        # Drop extinct species and choose new representatives. A
+        # representative whose genome survived unchanged is kept so its
+        # cached distances stay valid
+        extinct = [species for species in self.species if not species.members]
+        self.species = [species for species in self.species if species.members]
+        for species in extinct:
+            self.__retire__(species.representative)
+        for species in self.species:
+            rep_key = species.representative.key
+            survivor = [agent for agent in species.members
+                        if agent.brain.key == rep_key]
+            if survivor:
+                representative = survivor[0].brain
+            else:
+                members = species.members
+                if rng is None:
+                    representative = random.choice(members).brain
+                else:
+                    representative = members[rng.integers(len(members))].brain
+            if representative is not species.representative:
+                self.__represent__(species, representative)
+            species.age += 1
+
+        self.__adjust_threshold__()
+        return self.species
+
+    def allocate_offspring(self, agent_scores, n_offspring):
+        """Applies explicit fitness sharing and divides the
+        offspring between species
+
+        :agent_scores: A dict of agent scores
+        :n_offspring: The total number of offspring to produce
+        :returns: A list of (species, number of offspring) tuples
+
+        """
+        if not self.species:
+            raise ValueError('Population has not been speciated')
+
+        best = [species.update_fitness(agent_scores) for species in self.species]
+        champion = self.species[int(np.argmax(best))]
+
+        # Adjusted fitness is the raw fitness divided by the species
+        # size, so a species' share is its mean fitness
+        low = min(agent_scores[agent] for species in self.species
+                  for agent in species.members)
+        shares = np.zeros(len(self.species))
+        for j, species in enumerate(self.species):
+            if species.staleness > self.max_staleness and species is not champion:
+                continue
+            scores = [agent_scores[agent] - low for agent in species.members]
+            shares[j] = sum(scores) / len(species.members)
+
+        if shares.sum() <= 0:
+            shares[:] = 1.0
+            for j, species in enumerate(self.species):
+                if species.staleness > self.max_staleness and species is not champion:
+                    shares[j] = 0.0
+
+        # Largest remainder rounding keeps the population size exact
+        quotas = shares / shares.sum() * n_offspring
+        counts = np.floor(quotas).astype(int)
+        remainder = n_offspring - counts.sum()
+        for j in np.argsort(counts - quotas)[:remainder]:
+            counts[j] += 1
+
+        return [(species, int(count))
+                for species, count in zip(self.species, counts)
+                if count > 0]
+
+    def __adjust_threshold__(self):
+        if self.target_species is None:
+            return
+        if len(self.species) < self.target_species:
+            self.threshold = max(self.threshold_step,
+                                 self.threshold - self.threshold_step)
+        elif len(self.species) > self.target_species:
+            self.threshold += self.threshold_step
+
+
+def hold(network):
+    """Adds a reference to every gene of a network's genome, so the
+    genes stay in the pool's store after the network is released
+
+    :network: A NEAT_Network
+
+    """
+    network.pool.genes.acquire(network.genome.values())
+
+
+class Genome_Batch():
+
+    """The unique genomes of a list of networks, concatenated into
+    flat arrays sorted by genome key"""
+
+    def __init__(self, networks):
+        """Packs a list of networks
+
+        :networks: A list of networks
+
+        """
+        keys = np.array([net.key for net in networks], dtype=np.int64)
+        self.keys, first, self.inverse = np.unique(keys,
+                                                   return_index=True,
+                                                   return_inverse=True)
+        self.networks = [networks[i] for i in first]
+        self.packed = pack_genomes(self.networks)
+
+    def select(self, mask):
+        """Returns the packed arrays of a subset of genomes
+
+        :mask: A boolean mask over the unique genomes
+        :returns: Packed genomes as returned by pack_genomes
+
+        """
+        innovations, weights, owners, sizes, max_innovations = self.packed
+        if mask.all():
+            return self.packed
+        gene_mask = mask[owners]
+        rank = np.cumsum(mask) - 1
+        return (innovations[gene_mask],
+                weights[gene_mask],
+                rank[owners[gene_mask]],
+                sizes[mask],
+                max_innovations[mask])
+
+
+def pack_genomes(networks):
+    """Concatenates the sorted genomes of several networks
+
+    :networks: A list of networks
+    :returns: A tuple of (innovations, weights, owners, sizes, max innovations)
+
+    """
+    arrays = [net.genome_arrays() for net in networks]
+    sizes = np.array([len(innov) for innov, _ in arrays], dtype=np.int64)
+    if len(arrays) == 0 or sizes.sum() == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return (empty, np.zeros(0), empty, sizes, np.zeros(len(arrays), dtype=np.int64))
+
+    innovations = np.concatenate([innov for innov, _ in arrays])
+    weights = np.concatenate([weight for _, weight in arrays])
+    owners = np.repeat(np.arange(len(arrays)), sizes)
+    max_innovations = np.array([innov[-1] if len(innov) else 0
+                                for innov, _ in arrays], dtype=np.int64)
+    return (innovations, weights, owners, sizes, max_innovations)
+
+
+def compatibility_distances(packed,
+                            representative,
+                            c_excess=1.0,
+                            c_disjoint=1.0,
+                            c_weight=0.4,
+                            small_genome=20):
+    """Computes the NEAT compatibility distance from every packed
+    genome to a representative in a single sorted merge
+
+    :packed: Genomes packed by pack_genomes
+    :representative: A tuple of (innovations, weights) sorted by innovation
+    :returns: An array of distances, one for every genome
+
+    """
+    innovations, weights, owners, sizes, max_innovations = packed
+    rep_innovations, rep_weights = representative
+    n = len(sizes)
+    n_rep = len(rep_innovations)
+
+    if n_rep == 0:
+        excess = sizes.astype(np.float64)
+        disjoint = np.zeros(n)
+        mean_diff = np.zeros(n)
+    else:
+        # Locate every gene within the representative's genome
+        pos = np.searchsorted(rep_innovations, innovations)
+        pos = np.minimum(pos, n_rep - 1)
+        match = rep_innovations[pos] == innovations
+
+        matches = np.bincount(owners, weights=match, minlength=n)
+        diff = np.where(match, np.abs(weights - rep_weights[pos]), 0.0)
+        weight_diff = np.bincount(owners, weights=diff, minlength=n)
+
+        # Genes past the other genome's last innovation are excess
+        genome_excess = np.bincount(owners,
+                                    weights=innovations > rep_innovations[-1],
+                                    minlength=n)
+        rep_excess = n_rep - np.searchsorted(rep_innovations,
+                                             max_innovations,
+                                             side='right')
+        rep_excess = np.where(sizes > 0, rep_excess, n_rep)
+
+        excess = genome_excess + rep_excess
+        disjoint = (sizes - matches - genome_excess) + (n_rep - matches - rep_excess)
+        mean_diff = np.divide(weight_diff, matches,
+                              out=np.zeros(n),
+                              where=matches > 0)
+
+    size = np.maximum(sizes, n_rep).astype(np.float64)
+    size[size < small_genome] = 1.0
+
+    return (c_excess * excess + c_disjoint * disjoint) / size + c_weight * mean_diff
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from neat import NEAT_Pool, NEAT_Network
+from species import Genome_Batch, Speciator, compatibility_distances, pack_genomes
+
+
+def naive_distance(net1, net2, c1=1.0, c2=1.0, c3=0.4, small_genome=20):
+    g1, g2 = net1.genome, net2.genome
+    max1, max2 = max(g1), max(g2)
+    excess = disjoint = matches = 0
+    diff = 0.0
+    for innov in g1.keys() | g2.keys():
+        if innov in g1 and innov in g2:
+            matches += 1
+            diff += abs(g1[innov].weight - g2[innov].weight)
+        elif innov > min(max1, max2):
+            excess += 1
+        else:
+            disjoint += 1
+    n = max(len(g1), len(g2))
+    n = 1 if n < small_genome else n
+    return (c1 * excess + c2 * disjoint) / n + c3 * diff / max(matches, 1)
+
+
+def make_networks(n):
+    rng = np.random.default_rng(1)
+    pool = NEAT_Pool((3, 3), 3)
+    nets = [NEAT_Network(pool.starting_genome, pool) for _ in range(4)]
+    for _ in range(n):
+        left, right = rng.integers(len(nets), size=2)
+        nets.append(nets[left].crossover(nets[right], rng))
+    return nets
+
+
+def test_distances_match_reference():
+    nets = make_networks(40)
+    packed = pack_genomes(nets)
+    for rep in nets[::7]:
+        fast = compatibility_distances(packed, rep.genome_arrays())
+        slow = [naive_distance(net, rep) for net in nets]
+        assert(np.allclose(fast, slow))
+
+
+def test_speciate_covers_population():
+    nets = make_networks(40)
+
+    class Member():
+        def __init__(self, brain):
+            self.brain = brain
+
+    agents = [Member(net) for net in nets]
+    speciator = Speciator(threshold=0.5)
+    species = speciator.speciate(agents)
+    assert(sum(len(s) for s in species) == len(agents))
+
+    scores = {agent: float(i) for i, agent in enumerate(agents)}
+    allocation = speciator.allocate_offspring(scores, 100)
+    assert(sum(count for _, count in allocation) == 100)
+
+    # A second pass over the same genomes is served from the cache
+    misses = speciator.cache_misses
+    speciator.distances(Genome_Batch(nets), species[0].representative)
+    speciator.distances(Genome_Batch(nets), species[0].representative)
+    assert(speciator.cache_misses - misses <= len(nets))
+    assert(speciator.cache_hits > 0)
+
+
+def test_cache_only_holds_current_representatives():
+    nets = make_networks(60)
+
+    class Member():
+        def __init__(self, brain):
+            self.brain = brain
+
+    speciator = Speciator(threshold=0.5)
+    rng = np.random.default_rng(0)
+    for generation in (nets[:30], nets[30:], nets[15:45]):
+        species = speciator.speciate([Member(net) for net in generation], rng)
+        representatives = {s.representative.key for s in species}
+        assert(set(speciator.cache) <= representatives)
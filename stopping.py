@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+
+class Generation_Result():
+
+    """The outcome of one generation, yielded by Simulation.run"""
+
+    def __init__(self, generation, scores, species, ticks, total_ticks, eval_time, elapsed):
+        """Summarizes a scored generation
+
+        :generation: The generation number
+        :scores: A dict of agent scores
+        :species: The number of species, 0 without speciation
+        :ticks: The grid steps simulated this generation
+        :total_ticks: The grid steps simulated since the run started
+        :eval_time: The seconds spent evaluating this generation
+        :elapsed: The seconds since the run started
+
+        """
+        self.generation = generation
+        self.scores = scores
+        self.species = species
+        self.ticks = ticks
+        self.total_ticks = total_ticks
+        self.eval_time = eval_time
+        self.elapsed = elapsed
+        # Set when a stop criterion ended the run after this generation
+        self.stop_reason = None
+        # The memory usage by subsystem, if memory is reported
+        self.memory = None
+
+        values = np.fromiter(scores.values(), dtype=np.float64, count=len(scores))
+        self.top = float(values.max()) if len(values) else 0.0
+        self.low = float(values.min()) if len(values) else 0.0
+        self.mean = float(values.mean()) if len(values) else 0.0
+        self.median = float(np.median(values)) if len(values) else 0.0
+        self.champion = max(scores, key=scores.get) if scores else None
+
+    def __str__(self):
+        return 'Generation %d: top %f, mean %f, %d ticks, %.2fs' % \
+                (self.generation, self.top, self.mean, self.ticks, self.eval_time)
+
+
+class Plateau():
+
+    """Stops once the best score has not improved over a window
+    of generations"""
+
+    def __init__(self, window=10, min_delta=0.0):
+        """Initializes the criterion
+
+        :window: The number of generations without improvement
+        :min_delta: The improvement which counts as progress
+
+        """
+        if window < 1:
+            raise ValueError('Plateau window must be positive')
+        self.window = window
+        self.min_delta = min_delta
+        self.tops = []
+
+    def __call__(self, result):
+        self.tops.append(result.top)
+        if len(self.tops) <= self.window:
+            return None
+        before = max(self.tops[:-self.window])
+        if max(self.tops[-self.window:]) <= before + self.min_delta:
+            return 'no improvement over %d generations' % self.window
+        return None
+
+
+class Target_Score():
+
+    """Stops once an agent reaches a score"""
+
+    def __init__(self, score):
+        self.score = score
+
+    def __call__(self, result):
+        if result.top >= self.score:
+            return 'target score %f reached' % self.score
+        return None
+
+
+class Wall_Clock():
+
+    """Stops once the run has taken a number of seconds"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def __call__(self, result):
+        if result.elapsed >= self.seconds:
+            return 'wall clock budget of %.1fs spent' % self.seconds
+        return None
+
+
+class Tick_Budget():
+
+    """Stops once a number of grid steps have been simulated"""
+
+    def __init__(self, ticks):
+        self.ticks = ticks
+
+    def __call__(self, result):
+        if result.total_ticks >= self.ticks:
+            return 'tick budget of %d spent' % self.ticks
+        return None
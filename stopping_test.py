@@ -0,0 +1,15 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from stopping import Generation_Result, Plateau
+
+
+def result(generation, top):
+    return Generation_Result(generation, {'a': top, 'b': 0.0}, 0, 0, 0, 0.0, 0.0)
+
+
+def test_plateau_waits_for_window():
+    plateau = Plateau(window=3, min_delta=0.5)
+    tops = [1.0, 2.0, 4.0, 4.2, 4.4]
+    assert(all(plateau(result(i, top)) is None for i, top in enumerate(tops)))
+    assert(plateau(result(5, 4.5)) is not None)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+
+# Kinds of random streams, part of every stream's spawn key
+PLACEMENT = 0
+GROUPING = 1
+SELECTION = 2
+REPRODUCTION = 3
+GRID = 4
+SCREENING = 5
+
+
+class Random_Streams():
+
+    """Derives independent random streams from a single seed. Every
+    stream is addressed by a key such as (GRID, generation, trial, index)
+    instead of being drawn in sequence, so any single stream can be
+    recreated in isolation regardless of how threads were scheduled."""
+
+    def __init__(self, seed=None):
+        """Initializes the streams
+
+        :seed: An integer seed, or None for fresh entropy
+
+        """
+        self.entropy = np.random.SeedSequence(seed).entropy
+
+    def seed_sequence(self, *key):
+        """Returns the SeedSequence of a stream
+
+        :key: Integers identifying the stream
+        :returns: A numpy SeedSequence
+
+        """
+        return np.random.SeedSequence(self.entropy, spawn_key=key)
+
+    def generator(self, *key):
+        """Returns a new Generator for a stream. Calling this twice
+        with the same key yields identical sequences.
+
+        :key: Integers identifying the stream
+        :returns: A numpy Generator
+
+        """
+        return np.random.default_rng(self.seed_sequence(*key))
+
+    def placement(self, generation, trial):
+        """The stream start configurations of a trial are drawn from"""
+        return self.seed_sequence(PLACEMENT, generation, trial)
+
+    def grouping(self, generation):
+        """The stream which divides agents between grids"""
+        return self.generator(GROUPING, generation)
+
+    def selection(self, generation):
+        """The stream mates and species representatives are chosen with"""
+        return self.generator(SELECTION, generation)
+
+    def reproduction(self, generation, event):
+        """The stream of a single crossover and mutation"""
+        return self.generator(REPRODUCTION, generation, event)
+
+    def grid(self, generation, trial, index):
+        """The stream of a single grid simulation"""
+        return self.generator(GRID, generation, trial, index)
+
+    def screening(self, generation):
+        """The stream unpromising agents are picked for exploration with"""
+        return self.generator(SCREENING, generation)
+
+
+default_rng = np.random.default_rng()
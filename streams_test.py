@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from populations import Population
+from neat import NEAT_Pool
+from species import Speciator
+from streams import Random_Streams
+
+
+def breed_twice(seed):
+    pool = NEAT_Pool((2, 2), 3)
+    population = Population(30, 10, pool, Speciator(), Random_Streams(seed))
+    for _ in range(2):
+        agents = population.current_population
+        scores = {agent: float(i % 7) for i, agent in enumerate(agents)}
+        population.breed(scores)
+    population.schedule(population.current_population,
+                        population.streams.grouping(2))
+    return [[agent.brain.key for agent in group] for group in population]
+
+
+def test_streams_are_addressable():
+    streams = Random_Streams(3)
+    assert(streams.grid(1, 0, 5).random() == streams.grid(1, 0, 5).random())
+    assert(streams.grid(1, 0, 5).random() != streams.grid(1, 0, 6).random())
+
+
+def test_breeding_is_reproducible():
+    assert(breed_twice(11) == breed_twice(11))
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import redirect_stdout
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import time
+
+
+# Columns of the summary table
+SUMMARY_COLUMNS = ['key', 'config', 'generations', 'top', 'best', 'mean',
+                   'ticks', 'seconds', 'stop_reason']
+
+
+def expand(grid, seeds=(None,)):
+    """Expands a grid of parameters into Simulation configurations
+
+    :grid: A dict of Simulation argument to a list of values
+    :seeds: The seeds every combination is run with
+    :returns: A list of config dicts
+
+    """
+    names = sorted(grid)
+    configs = []
+    for values in itertools.product(*(grid[name] for name in names)):
+        for seed in seeds:
+            config = dict(zip(names, values))
+            config['seed'] = seed
+            configs.append(config)
+    return configs
+
+
+def code_version(directory=None):
+    """Hashes the simulation's source files, so cached results are
+    not reused once the code changes
+
+    :directory: The source directory, this module's by default
+    :returns: A hex digest
+
+    """
+    directory = directory or os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.py') and not name.endswith('_test.py'):
+            digest.update(name.encode('utf-8'))
+            with open(os.path.join(directory, name), 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+def config_key(config, generations, version):
+    """Returns the cache key of a sweep point
+
+    :config: The Simulation arguments
+    :generations: The number of generations it runs for
+    :version: The code version
+    :returns: A hex digest
+
+    """
+    encoded = json.dumps({'config': config, 'generations': generations, 'version': version},
+                         sort_keys=True)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()[:16]
+
+
+def run_point(config, generations, plateau, log_path):
+    """Runs one sweep point, in a worker process
+
+    :config: The Simulation arguments
+    :generations: The maximum number of generations
+    :plateau: A Plateau window to stop early with, or None
+    :log_path: Where the run's output is written
+    :returns: A dict of results
+
+    """
+    from armagetron import Simulation
+    from stopping import Plateau
+
+    stop = [Plateau(plateau)] if plateau else []
+    start = time.perf_counter()
+    tops = []
+    with open(log_path, 'w') as log, redirect_stdout(log):
+        simulation = Simulation(**dict(config, render=False))
+        result = None
+        for result in simulation.run(generations, stop):
+            tops.append(result.top)
+
+    return {'config': config,
+            'generations': len(tops),
+            'top': result.top,
+            'best': max(tops),
+            'mean': result.mean,
+            'ticks': simulation.ticks,
+            'seconds': time.perf_counter() - start,
+            'stop_reason': result.stop_reason,
+            'tops': tops}
+
+
+class Sweep():
+
+    """Runs Simulation configurations in parallel processes within a
+    CPU budget. Finished points are cached on disk, so running a sweep
+    again only runs what is missing."""
+
+    def __init__(self, directory, generations=20, cpu_budget=None, plateau=None):
+        """Initializes a sweep
+
+        :directory: Where results, logs and the summary are written
+        :generations: The maximum number of generations per point
+        :cpu_budget: The number of cores to use, all if None
+        :plateau: If set, points stop early once the best score has
+        not improved for this many generations
+
+        """
+        self.directory = directory
+        self.generations = generations
+        self.cpu_budget = cpu_budget or os.cpu_count() or 1
+        self.plateau = plateau
+        self.version = code_version()
+        self.executed = 0
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def path(self, key, extension='json'):
+        return os.path.join(self.directory, '%s.%s' % (key, extension))
+
+    def cached(self, key):
+        """Returns the cached result of a point, or None"""
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def run(self, configs):
+        """Runs every configuration which has no cached result
+
+        :configs: A list of Simulation argument dicts
+        :returns: A list of result dicts, in the order of configs
+
+        """
+        keys = [config_key(config, self.generations, self.version) for config in configs]
+        results = {key: self.cached(key) for key in keys}
+        pending = [(key, config) for key, config in zip(keys, configs)
+                   if results[key] is None]
+        pending = list(dict(pending).items())
+        print('Sweep: %d points, %d cached' % (len(set(keys)), len(set(keys)) - len(pending)))
+
+        # A point occupies as many cores as it has threads
+        def cores(config):
+            return min(config.get('n_threads', 1), self.cpu_budget)
+
+        running = {}
+        used = 0
+        with ProcessPoolExecutor(max_workers=self.cpu_budget) as executor:
+            while pending or running:
+                while pending and used + cores(pending[0][1]) <= self.cpu_budget:
+                    key, config = pending.pop(0)
+                    future = executor.submit(run_point,
+                                             config,
+                                             self.generations,
+                                             self.plateau,
+                                             self.path(key, 'log'))
+                    running[future] = (key, config)
+                    used += cores(config)
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key, config = running.pop(future)
+                    used -= cores(config)
+                    result = dict(future.result(), key=key)
+                    self.__store__(key, result)
+                    results[key] = result
+                    self.executed += 1
+                    print('\t%s done: top %f in %d generations' % \
+                            (key, result['top'], result['generations']))
+
+        rows = [results[key] for key in keys]
+        self.write_summary(rows)
+        return rows
+
+    def write_summary(self, rows):
+        """Writes a tab separated table of results, best first
+
+        :rows: A list of result dicts
+        :returns: The table as a string
+
+        """
+        lines = ['\t'.join(SUMMARY_COLUMNS)]
+        for row in sorted(rows, key=lambda row: -row['best']):
+            values = dict(row, config=json.dumps(row['config'], sort_keys=True))
+            lines.append('\t'.join(format_value(values[column])
+                                   for column in SUMMARY_COLUMNS))
+        table = '\n'.join(lines) + '\n'
+        with open(os.path.join(self.directory, 'summary.tsv'), 'w') as f:
+            f.write(table)
+        print(table)
+        return table
+
+    def __store__(self, key, result):
+        tmp = self.path(key, 'json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(result, f)
+        os.replace(tmp, self.path(key))
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return '%.3f' % value
+    return str(value)
+
+
+def parse_values(text):
+    """Parses a comma separated list of JSON values, e.g. '100,200'"""
+    return [json.loads(value) for value in text.split(',')]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs a parameter sweep')
+    parser.add_argument('params', nargs='+',
+                        help='Simulation arguments as name=value,value...')
+    parser.add_argument('--seeds', default='0', help='Comma separated seeds')
+    parser.add_argument('--generations', type=int, default=20)
+    parser.add_argument('--cpus', type=int, default=None)
+    parser.add_argument('--plateau', type=int, default=None)
+    parser.add_argument('--directory', default='sweep')
+    args = parser.parse_args()
+
+    grid = {}
+    for param in args.params:
+        name, values = param.split('=', 1)
+        grid[name] = parse_values(values)
+
+    sweep = Sweep(args.directory, args.generations, args.cpus, args.plateau)
+    sweep.run(expand(grid, parse_values(args.seeds)))
@@ -0,0 +1,22 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+
+from sweep import Sweep, expand
+
+
+def test_sweep_caches_points(tmp_path):
+    configs = expand({'population_size': [10], 'sim_population': [5, 10]}, seeds=[0, 1])
+    assert(len(configs) == 4)
+
+    directory = str(tmp_path / 'sweep')
+    sweep = Sweep(directory, generations=1, cpu_budget=2)
+    rows = sweep.run(configs)
+    assert(sweep.executed == 4)
+    assert([row['config'] for row in rows] == configs)
+    assert(os.path.exists(os.path.join(directory, 'summary.tsv')))
+
+    again = Sweep(directory, generations=1, cpu_budget=2)
+    assert([row['top'] for row in again.run(configs)] == [row['top'] for row in rows])
+    assert(again.executed == 0)
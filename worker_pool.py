@@ -21,6 +21,7 @@ class Worker(Thread):
         self.tasks = tasks
         self.daemon = True
         self.results = results
+        self.retired = False
         self.start()
 
     def run(self):
@@ -29,13 +30,21 @@ class Worker(Thread):
 
         """
         while True:
-            func, args, kargs = self.tasks.get()
+            task = self.tasks.get()
+            if task is None:
+                # Retired by Worker_Pool.resize
+                self.retired = True
+                self.tasks.task_done()
+                return
+            func, args, kargs = task
             try:
                 result = func(*args, **kargs)
                 self.results.append(result)
             except Exception as e:
                 print(e)
             finally:
+                # Idle workers must not keep the last grid alive
+                task = func = args = kargs = result = None
                 self.tasks.task_done()
 
 class Worker_Pool:
@@ -57,6 +66,42 @@ class Worker_Pool:
             worker = Worker(self.tasks, self.results)
             self.workers.append(worker)
 
+    def __len__(self):
+        return len(self.workers)
+
+    def resize(self, n_threads):
+        """Changes the number of workers. Must only be called
+        while no tasks are queued.
+
+        :n_threads: The new number of threads
+
+        """
+        if n_threads < 1:
+            raise ValueError('Thread count must be above 0')
+
+        while len(self.workers) < n_threads:
+            self.workers.append(Worker(self.tasks, self.results))
+
+        if len(self.workers) > n_threads:
+            retired = len(self.workers) - n_threads
+            for _ in range(retired):
+                self.tasks.put(None)
+            self.tasks.join()
+            for worker in self.workers:
+                if worker.retired:
+                    worker.join()
+            self.workers = [worker for worker in self.workers if not worker.retired]
+
+    def close(self):
+        """Retires every worker"""
+        for _ in self.workers:
+            self.tasks.put(None)
+        self.tasks.join()
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+        self.reset_results()
+
     def reset_results(self):
         self.results = []
         for worker in self.workers: